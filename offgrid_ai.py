@@ -1,11 +1,273 @@
-from operator import itemgetter
-from offgrid_ai_pb2 import SystemData, FinancialInputs, NaturalGasType
+import os
+from array import array
+from operator import attrgetter, itemgetter
+from typing import NamedTuple
+from google.protobuf.message import Message
+from offgrid_ai_pb2 import (
+    DataFile,
+    SystemData,
+    SystemProduction,
+    SystemSpec,
+    FinancialInputs,
+    NaturalGasType,
+)
+
+# Number of operating years covered by the precomputed discount & escalation tables.
+PROJECT_HORIZON_YEARS = 20
+# The fields held by SpecRecord and SystemRecord, in proto order.
+_SPEC_DEFAULTS = {
+    field.name: field.default_value for field in SystemSpec.DESCRIPTOR.fields
+}
+_SPEC_FIELDS = tuple(_SPEC_DEFAULTS)
+_PRODUCTION_FIELDS = tuple(
+    field.name for field in SystemProduction.DESCRIPTOR.fields if field.name != "year"
+)
+
+
+class CompiledFinancialInputs(NamedTuple):
+    """A flat, immutable form of FinancialInputs with the per-unit capex rates summed,
+    the debt annuity factor computed and the discount & escalation factors tabulated
+    for the project horizon. Every LCOE function accepts this in place of a
+    FinancialInputs proto; use compile_financial_inputs to build it once and reuse it
+    across systems.
+    """
+
+    cost_of_equity: float
+    cost_of_debt: float
+    leverage: float
+    debt_term: int
+    investment_tax_credit: float
+    construction_time: int
+    combined_tax_rate: float
+    om_escalator: float
+    fuel_price_mmbtu: float
+    fuel_escalator: float
+    lcoe_escalator: float
+    turbine_vs_generator_fuel_consumption_ratio: float
+    depreciation_schedule: tuple
+    # Hard capex rates ($/W for solar, $/kWh for BESS, $/kW otherwise).
+    solar_capex_per_watt: float
+    bess_capex_per_kwh: float
+    generator_capex_per_kw: float
+    gas_turbine_capex_per_kw: float
+    system_integration_capex_per_kw: float
+    # The part of each hard capex rate which is eligible for the ITC.
+    solar_itc_applicable_per_watt: float
+    bess_itc_applicable_per_kwh: float
+    generator_itc_applicable_per_kw: float
+    gas_turbine_itc_applicable_per_kw: float
+    system_integration_itc_applicable_per_kw: float
+    soft_cost_percentage: float
+    soft_cost_multiplier: float
+    solar_fixed_om_kw: float
+    bess_fixed_om_kw: float
+    generators_fixed_om_kw: float
+    generators_variable_om_kwh: float
+    gas_turbines_fixed_om_kw: float
+    gas_turbines_variable_om_kwh: float
+    bos_fixed_om_kw: float
+    soft_costs: float
+    # Annual debt payment per $ of starting balance.
+    debt_annuity_factor: float
+    # discount_factors[year + construction_time] discounts a cash flow in that year.
+    discount_factors: tuple
+    # The escalation vectors are indexed by operating year - 1.
+    lcoe_escalation: tuple
+    fuel_escalation: tuple
+    om_escalation: tuple
+    # Interest paid in each year of the debt term per $ of starting balance.
+    interest_fractions: tuple
+    # The deterministic serialization of the FinancialInputs these were compiled from,
+    # which identifies them in offgrid_ai_cache keys. None if compiled with overrides.
+    source: bytes = None
+
+
+def compile_financial_inputs(
+    financial_inputs: FinancialInputs,
+    horizon_years: int = PROJECT_HORIZON_YEARS,
+    overrides: dict = None,
+) -> CompiledFinancialInputs:
+    """Flattens a FinancialInputs proto into a CompiledFinancialInputs. Inputs which are
+    already compiled are returned unchanged.
+
+    overrides maps dotted field paths to values used in place of those in the proto.
+    Unlike proto fields these can be of any numeric type, e.g. complex numbers for
+    complex-step differentiation (see offgrid_ai_gradients.py).
+    """
+    if isinstance(financial_inputs, CompiledFinancialInputs):
+        if overrides:
+            raise ValueError("Overrides can only be applied to a FinancialInputs proto")
+        return financial_inputs
+    if overrides:
+        for field_path in overrides:
+            try:
+                get_financial_input(financial_inputs, field_path)
+            except AttributeError:
+                raise ValueError(f"Unknown FinancialInputs field: {field_path}")
+        financial_inputs = _OverriddenFields(financial_inputs, overrides)
+    solar_capex = financial_inputs.capex_inputs.solar_capex
+    bess_capex = financial_inputs.capex_inputs.bess_capex
+    generator_capex = financial_inputs.capex_inputs.generator_capex
+    gas_turbine_capex = financial_inputs.capex_inputs.gas_turbine_capex
+    system_integration_capex = financial_inputs.capex_inputs.system_integration_capex
+    soft_cost_capex = financial_inputs.capex_inputs.soft_cost_capex
+    opex_inputs = financial_inputs.opex_inputs
+
+    soft_cost_percentage = (
+        soft_cost_capex.general_conditions
+        + soft_cost_capex.epc_overhead
+        + soft_cost_capex.design_engineering_and_surveys
+        + soft_cost_capex.permitting_and_inspection
+        + soft_cost_capex.startup_and_commissioning
+        + soft_cost_capex.insurance
+        + soft_cost_capex.taxes
+    )
+    depreciation_schedule = (
+        financial_inputs.depreciation_yr1,
+        financial_inputs.depreciation_yr2,
+        financial_inputs.depreciation_yr3,
+        financial_inputs.depreciation_yr4,
+        financial_inputs.depreciation_yr5,
+        financial_inputs.depreciation_yr6,
+    )
+    cost_of_debt = financial_inputs.cost_of_debt
+    debt_term = financial_inputs.debt_term
+    leverage = financial_inputs.leverage
+    if debt_term == 0:
+        # No debt term means no loan, whatever the leverage, so equity pays for all
+        # of the capex.
+        leverage = 0.0
+        debt_annuity_factor = 0.0
+        interest_fractions = ()
+    elif cost_of_debt == 0:
+        # The zero rate limit: straight line principal and no interest.
+        debt_annuity_factor = 1 / debt_term
+        interest_fractions = (0.0,) * debt_term
+    else:
+        debt_growth = (1 + cost_of_debt) ** debt_term
+        debt_annuity_factor = cost_of_debt * debt_growth / (debt_growth - 1)
+        interest_fractions = tuple(
+            cost_of_debt
+            * (debt_growth - (1 + cost_of_debt) ** (year - 1))
+            / (debt_growth - 1)
+            for year in range(1, debt_term + 1)
+        )
+    last_year = max(horizon_years, debt_term, len(depreciation_schedule))
+    operating_years = range(horizon_years)
+
+    return CompiledFinancialInputs(
+        cost_of_equity=financial_inputs.cost_of_equity,
+        cost_of_debt=cost_of_debt,
+        leverage=leverage,
+        debt_term=debt_term,
+        investment_tax_credit=financial_inputs.investment_tax_credit,
+        construction_time=financial_inputs.construction_time,
+        combined_tax_rate=financial_inputs.combined_tax_rate,
+        om_escalator=financial_inputs.om_escalator,
+        fuel_price_mmbtu=financial_inputs.fuel_price_mmbtu,
+        fuel_escalator=financial_inputs.fuel_escalator,
+        lcoe_escalator=financial_inputs.lcoe_escalator,
+        turbine_vs_generator_fuel_consumption_ratio=financial_inputs.turbine_vs_generator_fuel_consumption_ratio,
+        depreciation_schedule=depreciation_schedule,
+        solar_capex_per_watt=(
+            solar_capex.modules
+            + solar_capex.inverters
+            + solar_capex.racking_and_foundations
+            + solar_capex.balance_of_system
+            + solar_capex.labor
+        ),
+        bess_capex_per_kwh=(
+            bess_capex.bess_units + bess_capex.balance_of_system + bess_capex.labor
+        ),
+        generator_capex_per_kw=(
+            generator_capex.gensets
+            + generator_capex.balance_of_system
+            + generator_capex.labor
+        ),
+        gas_turbine_capex_per_kw=(
+            gas_turbine_capex.gas_turbines
+            + gas_turbine_capex.balance_of_system
+            + gas_turbine_capex.labor
+        ),
+        system_integration_capex_per_kw=(
+            system_integration_capex.microgrid_switchgear_transformers_etc
+            + system_integration_capex.controls
+            + system_integration_capex.labor
+        ),
+        solar_itc_applicable_per_watt=(
+            solar_capex.modules * solar_capex.modules_itc_applicability
+            + solar_capex.inverters * solar_capex.inverters_itc_applicability
+            + solar_capex.racking_and_foundations
+            * solar_capex.racking_and_foundations_itc_applicability
+            + solar_capex.balance_of_system
+            * solar_capex.balance_of_system_itc_applicability
+            + solar_capex.labor * solar_capex.labor_itc_applicability
+        ),
+        bess_itc_applicable_per_kwh=(
+            bess_capex.bess_units * bess_capex.bess_units_itc_applicability
+            + bess_capex.balance_of_system
+            * bess_capex.balance_of_system_itc_applicability
+            + bess_capex.labor * bess_capex.labor_itc_applicability
+        ),
+        generator_itc_applicable_per_kw=(
+            generator_capex.gensets * generator_capex.gensets_itc_applicability
+            + generator_capex.balance_of_system
+            * generator_capex.balance_of_system_itc_applicability
+            + generator_capex.labor * generator_capex.labor_itc_applicability
+        ),
+        gas_turbine_itc_applicable_per_kw=(
+            gas_turbine_capex.gas_turbines
+            * gas_turbine_capex.gas_turbines_itc_applicability
+            + gas_turbine_capex.balance_of_system
+            * gas_turbine_capex.balance_of_system_itc_applicability
+            + gas_turbine_capex.labor * gas_turbine_capex.labor_itc_applicability
+        ),
+        system_integration_itc_applicable_per_kw=(
+            system_integration_capex.microgrid_switchgear_transformers_etc
+            * system_integration_capex.microgrid_switchgear_transformers_etc_itc_applicability
+            + system_integration_capex.controls
+            * system_integration_capex.controls_itc_applicability
+            + system_integration_capex.labor
+            * system_integration_capex.labor_itc_applicability
+        ),
+        soft_cost_percentage=soft_cost_percentage,
+        soft_cost_multiplier=1 + soft_cost_percentage,
+        solar_fixed_om_kw=opex_inputs.solar_fixed_om_kw,
+        bess_fixed_om_kw=opex_inputs.bess_fixed_om_kw,
+        generators_fixed_om_kw=opex_inputs.generators_fixed_om_kw,
+        generators_variable_om_kwh=opex_inputs.generators_variable_om_kwh,
+        gas_turbines_fixed_om_kw=opex_inputs.gas_turbines_fixed_om_kw,
+        gas_turbines_variable_om_kwh=opex_inputs.gas_turbines_variable_om_kwh,
+        bos_fixed_om_kw=opex_inputs.bos_fixed_om_kw,
+        soft_costs=opex_inputs.soft_costs,
+        debt_annuity_factor=debt_annuity_factor,
+        discount_factors=tuple(
+            (1 + financial_inputs.cost_of_equity) ** -index
+            for index in range(last_year + financial_inputs.construction_time + 1)
+        ),
+        lcoe_escalation=tuple(
+            (1 + financial_inputs.lcoe_escalator) ** year for year in operating_years
+        ),
+        fuel_escalation=tuple(
+            (1 + financial_inputs.fuel_escalator) ** year for year in operating_years
+        ),
+        om_escalation=tuple(
+            (1 + financial_inputs.om_escalator) ** year for year in operating_years
+        ),
+        interest_fractions=interest_fractions,
+        source=(
+            None
+            if overrides
+            else financial_inputs.SerializeToString(deterministic=True)
+        ),
+    )
 
 
 def after_tax_equity_npv(
     system_data: SystemData, financial_inputs: FinancialInputs, lcoe: float
 ) -> float:
     """Computer the after-tax equity NPV for the given system, costs and LCOE."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     return (
         ebitda_npv(system_data, financial_inputs, lcoe)
         + debt_service_npv(system_data, financial_inputs)
@@ -18,207 +280,139 @@ def ebitda_npv(
     system_data: SystemData, financial_inputs: FinancialInputs, lcoe: float
 ) -> float:
     """Computes the NPV of the EBITDA over the project lifetime."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     operating_year_revenues = []
-    for production in system_data.production:
+    for year, load_served_mwh in _production_rows(system_data, "load_served_mwh"):
         revenue = (
             lcoe
-            * production.load_served_mwh
-            * (1 + financial_inputs.lcoe_escalator) ** (production.year - 1)
+            * load_served_mwh
+            * _escalation(
+                financial_inputs.lcoe_escalation,
+                financial_inputs.lcoe_escalator,
+                year,
+            )
         )
-        operating_year_revenues.append((production.year, revenue))
-    return calc_npv(
-        operating_year_revenues,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    ) + fuel_cost_npv(system_data, financial_inputs) + fixed_om_npv(system_data, financial_inputs) + variable_om_npv(system_data, financial_inputs)
+        operating_year_revenues.append((year, revenue))
+    return _npv(operating_year_revenues, financial_inputs) + fuel_cost_npv(system_data, financial_inputs) + fixed_om_npv(system_data, financial_inputs) + variable_om_npv(system_data, financial_inputs)
 
 
 def fuel_cost_npv(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
     """Computes the NPV of the fuel cost over the project lifetime."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     operating_year_fuel_cost = []
-    for production in system_data.production:
+    for year, generator_fuel_mmbtu in _production_rows(
+        system_data, "generator_fuel_mmbtu"
+    ):
         fuel_cost = (
-            -production.generator_fuel_mmbtu
+            -generator_fuel_mmbtu
             * financial_inputs.fuel_price_mmbtu
-            * (1 + financial_inputs.fuel_escalator) ** (production.year - 1)
+            * _escalation(
+                financial_inputs.fuel_escalation,
+                financial_inputs.fuel_escalator,
+                year,
+            )
         )
         if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE:
             fuel_cost *= financial_inputs.turbine_vs_generator_fuel_consumption_ratio
-        operating_year_fuel_cost.append((production.year, fuel_cost))
-    return calc_npv(
-        operating_year_fuel_cost,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+        operating_year_fuel_cost.append((year, fuel_cost))
+    return _npv(operating_year_fuel_cost, financial_inputs)
 
 
 def fixed_om_npv(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
     """Computes the NPV of the fixed O&M expenses over the project lifetime."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    spec = system_data.spec
+    solar_fixed_om = -financial_inputs.solar_fixed_om_kw * spec.solar_capacity_mw * 1000
+    battery_fixed_om = -financial_inputs.bess_fixed_om_kw * spec.bess_max_power_mw * 1000
+    generator_fixed_om = (
+        -financial_inputs.generators_fixed_om_kw * spec.natural_gas_capacity_mw * 1000
+        if spec.nat_gas_type == NaturalGasType.GENERATOR
+        else 0
+    )
+    gas_turbine_fixed_om = (
+        -financial_inputs.gas_turbines_fixed_om_kw * spec.natural_gas_capacity_mw * 1000
+        if spec.nat_gas_type == NaturalGasType.GAS_TURBINE
+        else 0
+    )
+    bos_fixed_om = -financial_inputs.bos_fixed_om_kw * spec.load_mw * 1000
+    soft_costs_om = -financial_inputs.soft_costs * hard_capex(
+        system_data, financial_inputs
+    )
+    total_fixed_om_costs = (
+        solar_fixed_om
+        + battery_fixed_om
+        + generator_fixed_om
+        + gas_turbine_fixed_om
+        + bos_fixed_om
+        + soft_costs_om
+    )
     operating_year_fixed_om = []
-    for production in system_data.production:
-        solar_fixed_om = (
-            -financial_inputs.opex_inputs.solar_fixed_om_kw
-            * system_data.spec.solar_capacity_mw
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-        )
-        battery_fixed_om = (
-            -financial_inputs.opex_inputs.bess_fixed_om_kw
-            * system_data.spec.bess_max_power_mw
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-        )
-        generator_fixed_om = (
-            -financial_inputs.opex_inputs.generators_fixed_om_kw
-            * system_data.spec.natural_gas_capacity_mw
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-            if system_data.spec.nat_gas_type == NaturalGasType.GENERATOR
-            else 0
-        )
-        gas_turbine_fixed_om = (
-            -financial_inputs.opex_inputs.gas_turbines_fixed_om_kw
-            * system_data.spec.natural_gas_capacity_mw
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-            if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE
-            else 0
-        )
-        bos_fixed_om = (
-            -financial_inputs.opex_inputs.bos_fixed_om_kw
-            * system_data.spec.load_mw
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-        )
-        soft_costs_om = (
-            -financial_inputs.opex_inputs.soft_costs
-            * hard_capex(system_data, financial_inputs)
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-        )
-        total_fixed_om_costs = (
-            solar_fixed_om
-            + battery_fixed_om
-            + generator_fixed_om
-            + gas_turbine_fixed_om
-            + bos_fixed_om
-            + soft_costs_om
+    for year in _production_years(system_data):
+        operating_year_fixed_om.append(
+            (
+                year,
+                total_fixed_om_costs
+                * _escalation(
+                    financial_inputs.om_escalation,
+                    financial_inputs.om_escalator,
+                    year,
+                ),
+            )
         )
-        operating_year_fixed_om.append((production.year, total_fixed_om_costs))
-    return calc_npv(
-        operating_year_fixed_om,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    return _npv(operating_year_fixed_om, financial_inputs)
 
 
 def variable_om_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Computes the NPV of the variable O&M expenses over the project lifetime."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if system_data.spec.nat_gas_type == NaturalGasType.GENERATOR:
+        variable_om_kwh = financial_inputs.generators_variable_om_kwh
+    elif system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE:
+        variable_om_kwh = financial_inputs.gas_turbines_variable_om_kwh
+    else:
+        variable_om_kwh = 0
     operating_year_variable_om = []
-    for production in system_data.production:
-        generator_variable_om = (
-            -financial_inputs.opex_inputs.generators_variable_om_kwh
-            * production.generator_output_mwh
+    for year, generator_output_mwh in _production_rows(
+        system_data, "generator_output_mwh"
+    ):
+        total_variable_om_costs = (
+            -variable_om_kwh
+            * generator_output_mwh
             * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-            if system_data.spec.nat_gas_type == NaturalGasType.GENERATOR
-            else 0
-        )
-        gas_turbines_variable_om = (
-            -financial_inputs.opex_inputs.gas_turbines_variable_om_kwh
-            * production.generator_output_mwh
-            * 1000
-            * (1 + financial_inputs.om_escalator) ** (production.year - 1)
-            if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE
-            else 0
+            * _escalation(
+                financial_inputs.om_escalation,
+                financial_inputs.om_escalator,
+                year,
+            )
         )
-        total_variable_om_costs = generator_variable_om + gas_turbines_variable_om
-        operating_year_variable_om.append((production.year, total_variable_om_costs))
-    return calc_npv(
-        operating_year_variable_om,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+        operating_year_variable_om.append((year, total_variable_om_costs))
+    return _npv(operating_year_variable_om, financial_inputs)
 
 
 def total_capex(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
     """Compute the total capital expenditures that the project requires."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     hard_capex_spend = hard_capex(system_data, financial_inputs)
-    soft_cost_capex = financial_inputs.capex_inputs.soft_cost_capex
-    soft_cost_percentage = (
-        soft_cost_capex.general_conditions
-        + soft_cost_capex.epc_overhead
-        + soft_cost_capex.design_engineering_and_surveys
-        + soft_cost_capex.permitting_and_inspection
-        + soft_cost_capex.startup_and_commissioning
-        + soft_cost_capex.insurance
-        + soft_cost_capex.taxes
-    )
-    return hard_capex_spend * (1 + soft_cost_percentage)
+    return hard_capex_spend * financial_inputs.soft_cost_multiplier
+
+
+def soft_cost_percentage(financial_inputs: FinancialInputs) -> float:
+    """Compute the soft costs as a percentage of the hard capital expenditures."""
+    return compile_financial_inputs(financial_inputs).soft_cost_percentage
 
 
 def hard_capex(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
     """Compute the hard capital expenditures."""
-    solar_capex = financial_inputs.capex_inputs.solar_capex
-    bess_capex = financial_inputs.capex_inputs.bess_capex
-    generator_capex = financial_inputs.capex_inputs.generator_capex
-    gas_turbine_capex = financial_inputs.capex_inputs.gas_turbine_capex
-    system_integration_capex = financial_inputs.capex_inputs.system_integration_capex
-
-    solar_capex_spend = (
-        (
-            solar_capex.modules
-            + solar_capex.inverters
-            + solar_capex.racking_and_foundations
-            + solar_capex.balance_of_system
-            + solar_capex.labor
-        )
-        * 1000000
-        * system_data.spec.solar_capacity_mw
-    )
-    bess_capex_spend = (
-        (bess_capex.bess_units + bess_capex.balance_of_system + bess_capex.labor)
-        * 1000
-        * system_data.spec.bess_energy_capacity_mwh
-    )
-    generators_capex_spend = (
-        (
-            generator_capex.gensets
-            + generator_capex.balance_of_system
-            + generator_capex.labor
-        )
-        * 1000
-        * system_data.spec.natural_gas_capacity_mw
-        if system_data.spec.nat_gas_type == NaturalGasType.GENERATOR
-        else 0
-    )
-    gas_turbine_capex_spend = (
-        (
-            gas_turbine_capex.gas_turbines
-            + gas_turbine_capex.balance_of_system
-            + gas_turbine_capex.labor
-        )
-        * 1000
-        * system_data.spec.natural_gas_capacity_mw
-        if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE
-        else 0
-    )
-    system_integration_capex_spend = (
-        (
-            system_integration_capex.microgrid_switchgear_transformers_etc
-            + system_integration_capex.controls
-            + system_integration_capex.labor
-        )
-        * 1000
-        * system_data.spec.load_mw
-    )
-    return (
-        solar_capex_spend
-        + bess_capex_spend
-        + generators_capex_spend
-        + gas_turbine_capex_spend
-        + system_integration_capex_spend
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return _capex_spend(
+        system_data,
+        financial_inputs.solar_capex_per_watt,
+        financial_inputs.bess_capex_per_kwh,
+        financial_inputs.generator_capex_per_kw,
+        financial_inputs.gas_turbine_capex_per_kw,
+        financial_inputs.system_integration_capex_per_kw,
     )
 
 
@@ -226,88 +420,36 @@ def federal_itc_applicable_spend(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute those expenditures which are eligible for the federal investment tax credit."""
-    solar_capex = financial_inputs.capex_inputs.solar_capex
-    bess_capex = financial_inputs.capex_inputs.bess_capex
-    generator_capex = financial_inputs.capex_inputs.generator_capex
-    gas_turbine_capex = financial_inputs.capex_inputs.gas_turbine_capex
-    system_integration_capex = financial_inputs.capex_inputs.system_integration_capex
-
-    solar_capex_spend_itc_applicable = (
-        (
-            solar_capex.modules * solar_capex.modules_itc_applicability
-            + solar_capex.inverters * solar_capex.inverters_itc_applicability
-            + solar_capex.racking_and_foundations
-            * solar_capex.racking_and_foundations_itc_applicability
-            + solar_capex.balance_of_system
-            * solar_capex.balance_of_system_itc_applicability
-            + solar_capex.labor * solar_capex.labor_itc_applicability
-        )
-        * 1000000
-        * system_data.spec.solar_capacity_mw
-    )
-    bess_capex_spend_itc_applicable = (
-        (
-            bess_capex.bess_units * bess_capex.bess_units_itc_applicability
-            + bess_capex.balance_of_system
-            * bess_capex.balance_of_system_itc_applicability
-            + bess_capex.labor * bess_capex.labor_itc_applicability
-        )
-        * 1000
-        * system_data.spec.bess_energy_capacity_mwh
-    )
-    generators_capex_spend_itc_applicable = (
-        (
-            generator_capex.gensets * generator_capex.gensets_itc_applicability
-            + generator_capex.balance_of_system
-            * generator_capex.balance_of_system_itc_applicability
-            + generator_capex.labor * generator_capex.labor_itc_applicability
-        )
-        * 1000
-        * system_data.spec.natural_gas_capacity_mw
-        if system_data.spec.nat_gas_type == NaturalGasType.GENERATOR
-        else 0
-    )
-    gas_turbine_capex_spend_itc_applicable = (
-        (
-            gas_turbine_capex.gas_turbines
-            * gas_turbine_capex.gas_turbines_itc_applicability
-            + gas_turbine_capex.balance_of_system
-            * gas_turbine_capex.balance_of_system_itc_applicability
-            + gas_turbine_capex.labor * gas_turbine_capex.labor_itc_applicability
-        )
-        * 1000
-        * system_data.spec.natural_gas_capacity_mw
-        if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE
-        else 0
-    )
-    system_integration_capex_spend_itc_applicable = (
-        (
-            system_integration_capex.microgrid_switchgear_transformers_etc
-            * system_integration_capex.microgrid_switchgear_transformers_etc_itc_applicability
-            + system_integration_capex.controls
-            * system_integration_capex.controls_itc_applicability
-            + system_integration_capex.labor
-            * system_integration_capex.labor_itc_applicability
-        )
-        * 1000
-        * system_data.spec.load_mw
-    )
-    hard_capex_spend_itc_applicable = (
-        solar_capex_spend_itc_applicable
-        + bess_capex_spend_itc_applicable
-        + generators_capex_spend_itc_applicable
-        + gas_turbine_capex_spend_itc_applicable
-        + system_integration_capex_spend_itc_applicable
-    )
-    total_capex_spend_itc_applicable = hard_capex_spend_itc_applicable * (
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    total_capex_spend_itc_applicable = hard_capex_itc_applicable(
+        system_data, financial_inputs
+    ) * (
         total_capex(system_data, financial_inputs)
         / hard_capex(system_data, financial_inputs)
     )
     return total_capex_spend_itc_applicable
 
 
+def hard_capex_itc_applicable(
+    system_data: SystemData, financial_inputs: FinancialInputs
+) -> float:
+    """Compute the hard capital expenditures which are eligible for the federal
+    investment tax credit.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return _capex_spend(
+        system_data,
+        financial_inputs.solar_itc_applicable_per_watt,
+        financial_inputs.bess_itc_applicable_per_kwh,
+        financial_inputs.generator_itc_applicable_per_kw,
+        financial_inputs.gas_turbine_itc_applicable_per_kw,
+        financial_inputs.system_integration_itc_applicable_per_kw,
+    )
+
+
 def federal_itc(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
     """Compute the amount of the federal investment tax credit."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     return (
         federal_itc_applicable_spend(system_data, financial_inputs)
         * financial_inputs.investment_tax_credit
@@ -318,69 +460,41 @@ def federal_itc_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute the NPV of the federal investment tax credit."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     annual_federal_itc = [(1, federal_itc(system_data, financial_inputs))]
-    return calc_npv(
-        annual_federal_itc,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    return _npv(annual_federal_itc, financial_inputs)
 
 
 def debt_service_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute the NPV of the debt service payments."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     starting_balance = (
         total_capex(system_data, financial_inputs) * financial_inputs.leverage
     )
-    annual_payment = (
-        starting_balance
-        * financial_inputs.cost_of_debt
-        * ((1 + financial_inputs.cost_of_debt) ** financial_inputs.debt_term)
-        / ((1 + financial_inputs.cost_of_debt) ** financial_inputs.debt_term - 1)
-    )
+    annual_payment = starting_balance * financial_inputs.debt_annuity_factor
     debt_service_payments = []
     for year in range(1, financial_inputs.debt_term + 1):
         debt_service_payments.append((year, -annual_payment))
-    return calc_npv(
-        debt_service_payments,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    return _npv(debt_service_payments, financial_inputs)
 
 
 def depreciation_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute the NPV of the depreciation."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     depreciable_amount = -(
         total_capex(system_data, financial_inputs)
         - federal_itc(system_data, financial_inputs) * 0.5
     )
     annual_depreciation = []
-    annual_depreciation.append(
-        (1, depreciable_amount * financial_inputs.depreciation_yr1)
-    )
-    annual_depreciation.append(
-        (2, depreciable_amount * financial_inputs.depreciation_yr2)
-    )
-    annual_depreciation.append(
-        (3, depreciable_amount * financial_inputs.depreciation_yr3)
-    )
-    annual_depreciation.append(
-        (4, depreciable_amount * financial_inputs.depreciation_yr4)
-    )
-    annual_depreciation.append(
-        (5, depreciable_amount * financial_inputs.depreciation_yr5)
-    )
-    annual_depreciation.append(
-        (6, depreciable_amount * financial_inputs.depreciation_yr6)
-    )
-    return calc_npv(
-        annual_depreciation,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    for year, depreciation in enumerate(
+        financial_inputs.depreciation_schedule, start=1
+    ):
+        annual_depreciation.append((year, depreciable_amount * depreciation))
+    return _npv(annual_depreciation, financial_inputs)
 
 
 def interest_expense_npv(
@@ -389,32 +503,23 @@ def interest_expense_npv(
     """Compute the NPV of the interest expense. This is the interest only, not
     including principal payments as this is needed to calculate tax due.
     """
+    financial_inputs = compile_financial_inputs(financial_inputs)
     starting_balance = (
         total_capex(system_data, financial_inputs) * financial_inputs.leverage
     )
     interest_payments = []
-    for year in range(1, financial_inputs.debt_term + 1):
-        interest_payment = (
-            starting_balance
-            * financial_inputs.cost_of_debt
-            * (
-                (1 + financial_inputs.cost_of_debt) ** financial_inputs.debt_term
-                - (1 + financial_inputs.cost_of_debt) ** (year - 1)
-            )
-            / ((1 + financial_inputs.cost_of_debt) ** financial_inputs.debt_term - 1)
-        )
-        interest_payments.append((year, -interest_payment))
-    return calc_npv(
-        interest_payments,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    for year, interest_fraction in enumerate(
+        financial_inputs.interest_fractions, start=1
+    ):
+        interest_payments.append((year, -starting_balance * interest_fraction))
+    return _npv(interest_payments, financial_inputs)
 
 
 def tax_benefit_npv(
     system_data: SystemData, financial_inputs: FinancialInputs, lcoe: float
 ) -> float:
     """Compute the NPV of federal income tax payments including the federal investment tax credit."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     return -financial_inputs.combined_tax_rate * (
         ebitda_npv(system_data, financial_inputs, lcoe)
         + depreciation_npv(system_data, financial_inputs)
@@ -426,51 +531,246 @@ def equity_capex_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute the NPV of the capital expenditures funded by equity."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     total_capex_spend = total_capex(system_data, financial_inputs)
     equity_capex = total_capex_spend * (1 - financial_inputs.leverage)
     equity_capex_per_year = equity_capex / financial_inputs.construction_time
     operating_year_equity_capex = []
     for year in range(0, -financial_inputs.construction_time, -1):
         operating_year_equity_capex.append((year, -equity_capex_per_year))
-    return calc_npv(
-        operating_year_equity_capex,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    return _npv(operating_year_equity_capex, financial_inputs)
 
 
 def incremental_after_tax_equity_npv(
     system_data: SystemData, financial_inputs: FinancialInputs
 ) -> float:
     """Compute the increase in after-tax equity NPV that results from a $1/MWh increase in the LCOE"""
+    financial_inputs = compile_financial_inputs(financial_inputs)
     operating_year_production = []
-    for production in system_data.production:
+    for year, load_served_mwh in _production_rows(system_data, "load_served_mwh"):
         operating_year_production.append(
             (
-                production.year,
-                production.load_served_mwh
-                * (1 + financial_inputs.lcoe_escalator) ** (production.year - 1),
+                year,
+                load_served_mwh
+                * _escalation(
+                    financial_inputs.lcoe_escalation,
+                    financial_inputs.lcoe_escalator,
+                    year,
+                ),
             )
         )
-    production_npv = calc_npv(
-        operating_year_production,
-        financial_inputs.cost_of_equity,
-        financial_inputs.construction_time,
-    )
+    production_npv = _npv(operating_year_production, financial_inputs)
     return production_npv * (1 - financial_inputs.combined_tax_rate)
 
 
-def breakeven_lcoe(system_data: SystemData, financial_inputs: FinancialInputs) -> float:
+def breakeven_lcoe(
+    system_data: SystemData, financial_inputs: FinancialInputs, cache=None
+) -> float:
     """Computes the LCOE at which the return on equity is equal to the cost of equity and the
     project breaks even. This can be computed directly rather than via a binary search as
-    the after-tax equity NPV is linear in the LCOE.
+    the after-tax equity NPV is linear in the LCOE. If an offgrid_ai_cache.LcoeCache is
+    given, the result is looked up there first (and computed by evaluate_lcoe, which
+    agrees with this to rounding error).
     """
+    if cache is not None:
+        return cache.breakeven_lcoe(system_data, financial_inputs)
+    financial_inputs = compile_financial_inputs(financial_inputs)
     return -after_tax_equity_npv(
         system_data, financial_inputs, 0
     ) / incremental_after_tax_equity_npv(system_data, financial_inputs)
 
 
+class LcoeBreakdown(NamedTuple):
+    """The breakeven LCOE of a system together with the component NPVs it was
+    computed from. The NPVs which depend on the LCOE are evaluated at the breakeven
+    LCOE. The *_per_mwh fields split the LCOE into the share paid for by each cost.
+    """
+
+    lcoe: float
+    ebitda_npv: float
+    fuel_cost_npv: float
+    fixed_om_npv: float
+    variable_om_npv: float
+    debt_service_npv: float
+    depreciation_npv: float
+    interest_expense_npv: float
+    federal_itc_npv: float
+    tax_benefit_npv: float
+    equity_capex_npv: float
+    incremental_after_tax_equity_npv: float
+    equity_capex_per_mwh: float
+    debt_service_per_mwh: float
+    tax_benefit_per_mwh: float
+    fixed_om_per_mwh: float
+    variable_om_per_mwh: float
+    fuel_cost_per_mwh: float
+
+
+def evaluate_lcoe(
+    system_data: SystemData, financial_inputs: FinancialInputs
+) -> LcoeBreakdown:
+    """Computes the breakeven LCOE and its breakdown in a single pass over the
+    production data, computing every intermediate value (capex, ITC, discount factors)
+    only once. The results match breakeven_lcoe and the individual component functions.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return _evaluate_production_npvs(
+        system_data.spec,
+        _production_npvs(system_data, financial_inputs),
+        financial_inputs,
+    )
+
+
+def evaluate_lcoe_by_nat_gas_type(
+    system_data: SystemData,
+    financial_inputs: FinancialInputs,
+    nat_gas_types=(NaturalGasType.GENERATOR, NaturalGasType.GAS_TURBINE),
+) -> list:
+    """Computes evaluate_lcoe for the system with each of nat_gas_types in turn, in the
+    same order. The production NPVs do not depend on the gas type, so the production
+    data is read once however many types are evaluated, and nothing is copied.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    production_npvs = _production_npvs(system_data, financial_inputs)
+    return [
+        _evaluate_production_npvs(
+            override_spec(system_data, nat_gas_type=nat_gas_type).spec,
+            production_npvs,
+            financial_inputs,
+        )
+        for nat_gas_type in nat_gas_types
+    ]
+
+
+class SystemDataView:
+    """A SystemData with a modified copy of the spec which shares the original's
+    production rows. It can be passed to any function here in place of a SystemData.
+    """
+
+    __slots__ = ("spec", "production")
+
+    def __init__(self, spec: SystemSpec, production):
+        self.spec = spec
+        self.production = production
+
+
+def override_spec(system_data: SystemData, **overrides) -> SystemDataView:
+    """Returns a view of system_data with the given spec fields replaced, e.g.
+    override_spec(system_data, nat_gas_type=NaturalGasType.GAS_TURBINE). Only the
+    spec is copied; the production rows are shared with system_data. A SystemRecord
+    gives a SystemRecord sharing its production array.
+    """
+    if isinstance(system_data, SystemRecord):
+        spec = SpecRecord(
+            **{field: getattr(system_data.spec, field) for field in _SPEC_FIELDS}
+        )
+        for field, value in overrides.items():
+            setattr(spec, field, value)
+        return SystemRecord(spec, system_data.year, system_data.values)
+    spec = SystemSpec()
+    spec.CopyFrom(system_data.spec)
+    for field, value in overrides.items():
+        setattr(spec, field, value)
+    return SystemDataView(spec, system_data.production)
+
+
+class SpecRecord:
+    """The fields of a SystemSpec as plain attributes."""
+
+    __slots__ = _SPEC_FIELDS
+
+    def __init__(self, **fields):
+        for field in _SPEC_FIELDS:
+            setattr(self, field, fields.get(field, _SPEC_DEFAULTS[field]))
+
+
+class ProductionRecord(NamedTuple):
+    """The fields of a SystemProduction, in proto order."""
+
+    year: int
+    solar_output_raw_mwh: float
+    solar_output_net_mwh: float
+    bess_throughput_mwh: float
+    bess_net_output_mwh: float
+    generator_output_mwh: float
+    generator_fuel_mmbtu: float
+    load_served_mwh: float
+
+
+class SystemRecord:
+    """A compact SystemData which can be passed to any function here in its place.
+    The spec is a SpecRecord and the production of every year is held in a single
+    array('d'), one contiguous run of years per SystemProduction field, so reading a
+    system costs attribute and array lookups rather than protocol buffer field
+    accesses and holding one takes less memory than the parsed message.
+    The functions here read the arrays directly; other code can use the production
+    property, which builds a ProductionRecord per year.
+
+    Conversion to and from SystemData is lossless for systems with every field set,
+    as all systems in the data file have; to_system_data sets every field.
+    """
+
+    __slots__ = ("spec", "year", "values")
+
+    def __init__(self, spec: SpecRecord, year: array, values: array):
+        if len(values) != len(year) * len(_PRODUCTION_FIELDS):
+            raise ValueError("Expected one value per year for each production field")
+        self.spec = spec
+        self.year = year
+        self.values = values
+
+    @classmethod
+    def from_system_data(cls, system_data: SystemData) -> "SystemRecord":
+        spec = system_data.spec
+        # Iterating a repeated field builds a wrapper per row, so it is done once.
+        production = list(system_data.production)
+        return cls(
+            SpecRecord(**{field: getattr(spec, field) for field in _SPEC_FIELDS}),
+            array("i", [row.year for row in production]),
+            array(
+                "d",
+                [
+                    getattr(row, field)
+                    for field in _PRODUCTION_FIELDS
+                    for row in production
+                ],
+            ),
+        )
+
+    def to_system_data(self) -> SystemData:
+        system_data = SystemData()
+        for field in _SPEC_FIELDS:
+            setattr(system_data.spec, field, getattr(self.spec, field))
+        for row in self.production:
+            production = system_data.production.add()
+            production.year = row.year
+            for field in _PRODUCTION_FIELDS:
+                setattr(production, field, getattr(row, field))
+        return system_data
+
+    def column(self, field: str) -> array:
+        """Returns the values of one production field for every year."""
+        start = _PRODUCTION_FIELDS.index(field) * len(self.year)
+        return self.values[start : start + len(self.year)]
+
+    @property
+    def production(self) -> tuple:
+        columns = [self.column(field) for field in _PRODUCTION_FIELDS]
+        return tuple(map(ProductionRecord, self.year, *columns))
+
+
+def system_records(data_file) -> list:
+    """Converts a DataFile, or any iterable of SystemData, to SystemRecords."""
+    if isinstance(data_file, DataFile):
+        data_file = data_file.system_data
+    return [SystemRecord.from_system_data(system_data) for system_data in data_file]
+
+
 def lifetime_renewable_percentage(system_data: SystemData) -> float:
+    if isinstance(system_data, SystemRecord):
+        total_load_served_mwh = sum(system_data.column("load_served_mwh"))
+        total_generator_output_mwh = sum(system_data.column("generator_output_mwh"))
+        return 1.0 - (total_generator_output_mwh / total_load_served_mwh)
     total_load_served_mwh = 0
     total_generator_output_mwh = 0
     for production in system_data.production:
@@ -492,6 +792,25 @@ def calc_npv(time_series, discount_rate, year_offset):
     return npv
 
 
+def get_financial_input(financial_inputs: FinancialInputs, field_path: str):
+    """Returns the value of a (possibly nested) field given its dotted path, e.g.
+    "capex_inputs.solar_capex.modules".
+    """
+    message = financial_inputs
+    for field_name in field_path.split("."):
+        message = getattr(message, field_name)
+    return message
+
+
+def set_financial_input(financial_inputs: FinancialInputs, field_path: str, value):
+    """Sets the value of a (possibly nested) field given its dotted path."""
+    *parent_names, field_name = field_path.split(".")
+    message = financial_inputs
+    for parent_name in parent_names:
+        message = getattr(message, parent_name)
+    setattr(message, field_name, value)
+
+
 def print_system_spec(system_data: SystemData):
     """Print a short description of the system specification."""
     nat_gas_type = (
@@ -505,21 +824,19 @@ def print_system_spec(system_data: SystemData):
 def find_pareto_frontier(system_data_with_lcoe):
     """Given a list of candidate systems and their LCOE, compute the
        Pareto frontier that trades off between the LCOE & lifetime
-       renewable percentage.
+       renewable percentage. The list passed in is not modified.
     """
     pareto_frontier = []
+    frontier_lifetime_renewable = None
 
-    system_data_with_lcoe.sort(key=itemgetter(1))
-    for system_data, lcoe in system_data_with_lcoe:
-        if len(pareto_frontier) == 0:
+    for system_data, lcoe in sorted(system_data_with_lcoe, key=itemgetter(1)):
+        lifetime_renewable = lifetime_renewable_percentage(system_data)
+        if (
+            frontier_lifetime_renewable is None
+            or lifetime_renewable > frontier_lifetime_renewable
+        ):
             pareto_frontier.append((system_data, lcoe))
-        else:
-            previous_lifetime_renewable = lifetime_renewable_percentage(
-                pareto_frontier[-1][0]
-            )
-            lifetime_renewable = lifetime_renewable_percentage(system_data)
-            if lifetime_renewable > previous_lifetime_renewable:
-                pareto_frontier.append((system_data, lcoe))
+            frontier_lifetime_renewable = lifetime_renewable
     return pareto_frontier
 
 
@@ -618,3 +935,294 @@ def build_standard_financial_inputs() -> FinancialInputs:
     financial_inputs.opex_inputs.bos_fixed_om_kw = 6
     financial_inputs.opex_inputs.soft_costs = 0.0025
     return financial_inputs
+
+
+def _capex_spend(
+    system_data: SystemData,
+    solar_per_watt: float,
+    bess_per_kwh: float,
+    generator_per_kw: float,
+    gas_turbine_per_kw: float,
+    system_integration_per_kw: float,
+) -> float:
+    """Applies per-unit capex rates to the system's sizes."""
+    spec = system_data.spec
+    solar_capex_spend = solar_per_watt * 1000000 * spec.solar_capacity_mw
+    bess_capex_spend = bess_per_kwh * 1000 * spec.bess_energy_capacity_mwh
+    generators_capex_spend = (
+        generator_per_kw * 1000 * spec.natural_gas_capacity_mw
+        if spec.nat_gas_type == NaturalGasType.GENERATOR
+        else 0
+    )
+    gas_turbine_capex_spend = (
+        gas_turbine_per_kw * 1000 * spec.natural_gas_capacity_mw
+        if spec.nat_gas_type == NaturalGasType.GAS_TURBINE
+        else 0
+    )
+    system_integration_capex_spend = system_integration_per_kw * 1000 * spec.load_mw
+    return (
+        solar_capex_spend
+        + bess_capex_spend
+        + generators_capex_spend
+        + gas_turbine_capex_spend
+        + system_integration_capex_spend
+    )
+
+
+def _production_years(system_data: SystemData):
+    """The year of each production row."""
+    if isinstance(system_data, SystemRecord):
+        return system_data.year
+    return [production.year for production in system_data.production]
+
+
+def _production_rows(system_data: SystemData, field: str):
+    """(year, value of field) for each production row, read from a SystemRecord's
+    arrays without building a row per year.
+    """
+    if isinstance(system_data, SystemRecord):
+        return zip(system_data.year, system_data.column(field))
+    return map(attrgetter("year", field), system_data.production)
+
+
+def _escalation(escalation_factors: tuple, escalator: float, year: int) -> float:
+    """Escalation factor for an operating year, from the precomputed table when the
+    year is within the project horizon.
+    """
+    if 1 <= year <= len(escalation_factors):
+        return escalation_factors[year - 1]
+    return (1 + escalator) ** (year - 1)
+
+
+def _discount_factor(year: int, financial_inputs: CompiledFinancialInputs) -> float:
+    """Discount factor for a cash flow in the given year, as in calc_npv."""
+    index = year + financial_inputs.construction_time
+    if 0 <= index < len(financial_inputs.discount_factors):
+        return financial_inputs.discount_factors[index]
+    return (1 + financial_inputs.cost_of_equity) ** -index
+
+
+def _npv(time_series, financial_inputs: CompiledFinancialInputs) -> float:
+    """Equivalent of calc_npv using the precomputed discount factors."""
+    npv = 0
+    for entry in time_series:
+        npv += entry[1] * _discount_factor(entry[0], financial_inputs)
+    return npv
+
+
+class _ProductionNpvs(NamedTuple):
+    """The sums over the production rows which evaluate_lcoe needs, none of which
+    depend on the system spec.
+    """
+
+    production_npv: float
+    fuel_cost: float
+    om_escalation_npv: float
+    generator_output_npv: float
+
+
+def _production_npvs(
+    system_data: SystemData, financial_inputs: CompiledFinancialInputs
+) -> _ProductionNpvs:
+    production_npv = 0
+    fuel_cost = 0
+    om_escalation_npv = 0
+    generator_output_npv = 0
+    if isinstance(system_data, SystemRecord):
+        rows = zip(
+            system_data.year,
+            system_data.column("load_served_mwh"),
+            system_data.column("generator_fuel_mmbtu"),
+            system_data.column("generator_output_mwh"),
+        )
+    else:
+        rows = (
+            (
+                production.year,
+                production.load_served_mwh,
+                production.generator_fuel_mmbtu,
+                production.generator_output_mwh,
+            )
+            for production in system_data.production
+        )
+    for year, load_served_mwh, generator_fuel_mmbtu, generator_output_mwh in rows:
+        discount_factor = _discount_factor(year, financial_inputs)
+        production_npv += (
+            load_served_mwh
+            * _escalation(
+                financial_inputs.lcoe_escalation, financial_inputs.lcoe_escalator, year
+            )
+            * discount_factor
+        )
+        fuel_cost -= (
+            generator_fuel_mmbtu
+            * _escalation(
+                financial_inputs.fuel_escalation, financial_inputs.fuel_escalator, year
+            )
+            * discount_factor
+        )
+        om_escalation = _escalation(
+            financial_inputs.om_escalation, financial_inputs.om_escalator, year
+        )
+        om_escalation_npv += om_escalation * discount_factor
+        generator_output_npv += (
+            generator_output_mwh * 1000 * om_escalation * discount_factor
+        )
+    return _ProductionNpvs(
+        production_npv, fuel_cost, om_escalation_npv, generator_output_npv
+    )
+
+
+def _evaluate_production_npvs(
+    spec: SystemSpec,
+    production_npvs: _ProductionNpvs,
+    financial_inputs: CompiledFinancialInputs,
+) -> LcoeBreakdown:
+    is_gas_turbine = spec.nat_gas_type == NaturalGasType.GAS_TURBINE
+    system_data = SystemDataView(spec, ())
+    hard_capex_spend = hard_capex(system_data, financial_inputs)
+    total_capex_spend = hard_capex_spend * financial_inputs.soft_cost_multiplier
+    itc = (
+        hard_capex_itc_applicable(system_data, financial_inputs)
+        * financial_inputs.soft_cost_multiplier
+        * financial_inputs.investment_tax_credit
+    )
+    production_npv, fuel_cost, om_escalation_npv, generator_output_npv = (
+        production_npvs
+    )
+
+    fuel_cost_npv = fuel_cost * financial_inputs.fuel_price_mmbtu
+    if is_gas_turbine:
+        fuel_cost_npv *= financial_inputs.turbine_vs_generator_fuel_consumption_ratio
+
+    gas_fixed_om_kw = (
+        financial_inputs.gas_turbines_fixed_om_kw
+        if is_gas_turbine
+        else financial_inputs.generators_fixed_om_kw
+    )
+    gas_variable_om_kwh = (
+        financial_inputs.gas_turbines_variable_om_kwh
+        if is_gas_turbine
+        else financial_inputs.generators_variable_om_kwh
+    )
+    annual_fixed_om = (
+        financial_inputs.solar_fixed_om_kw * spec.solar_capacity_mw * 1000
+        + financial_inputs.bess_fixed_om_kw * spec.bess_max_power_mw * 1000
+        + gas_fixed_om_kw * spec.natural_gas_capacity_mw * 1000
+        + financial_inputs.bos_fixed_om_kw * spec.load_mw * 1000
+        + financial_inputs.soft_costs * hard_capex_spend
+    )
+    fixed_om_npv = -annual_fixed_om * om_escalation_npv
+    variable_om_npv = -gas_variable_om_kwh * generator_output_npv
+
+    starting_balance = total_capex_spend * financial_inputs.leverage
+    annual_payment = starting_balance * financial_inputs.debt_annuity_factor
+    debt_service_npv = 0
+    interest_expense_npv = 0
+    for year, interest_fraction in enumerate(
+        financial_inputs.interest_fractions, start=1
+    ):
+        discount_factor = _discount_factor(year, financial_inputs)
+        debt_service_npv -= annual_payment * discount_factor
+        interest_expense_npv -= starting_balance * interest_fraction * discount_factor
+
+    depreciable_amount = -(total_capex_spend - itc * 0.5)
+    depreciation_npv = _npv(
+        [
+            (year, depreciable_amount * depreciation)
+            for year, depreciation in enumerate(
+                financial_inputs.depreciation_schedule, start=1
+            )
+        ],
+        financial_inputs,
+    )
+    federal_itc_npv = itc * _discount_factor(1, financial_inputs)
+    equity_capex_per_year = (
+        total_capex_spend
+        * (1 - financial_inputs.leverage)
+        / financial_inputs.construction_time
+    )
+    equity_capex_npv = _npv(
+        [
+            (year, -equity_capex_per_year)
+            for year in range(0, -financial_inputs.construction_time, -1)
+        ],
+        financial_inputs,
+    )
+
+    combined_tax_rate = financial_inputs.combined_tax_rate
+    operating_costs_npv = fuel_cost_npv + fixed_om_npv + variable_om_npv
+    incremental_after_tax_equity_npv = production_npv * (1 - combined_tax_rate)
+    zero_lcoe_tax_benefit_npv = (
+        -combined_tax_rate
+        * (operating_costs_npv + depreciation_npv + interest_expense_npv)
+        + federal_itc_npv
+    )
+    lcoe = -(
+        operating_costs_npv
+        + debt_service_npv
+        + zero_lcoe_tax_benefit_npv
+        + equity_capex_npv
+    ) / incremental_after_tax_equity_npv
+
+    ebitda_npv = lcoe * production_npv + operating_costs_npv
+    tax_benefit_npv = (
+        -combined_tax_rate * (ebitda_npv + depreciation_npv + interest_expense_npv)
+        + federal_itc_npv
+    )
+    total_costs_npv = -(
+        equity_capex_npv
+        + debt_service_npv
+        + tax_benefit_npv
+        + variable_om_npv
+        + fixed_om_npv
+        + fuel_cost_npv
+    )
+    return LcoeBreakdown(
+        lcoe=lcoe,
+        ebitda_npv=ebitda_npv,
+        fuel_cost_npv=fuel_cost_npv,
+        fixed_om_npv=fixed_om_npv,
+        variable_om_npv=variable_om_npv,
+        debt_service_npv=debt_service_npv,
+        depreciation_npv=depreciation_npv,
+        interest_expense_npv=interest_expense_npv,
+        federal_itc_npv=federal_itc_npv,
+        tax_benefit_npv=tax_benefit_npv,
+        equity_capex_npv=equity_capex_npv,
+        incremental_after_tax_equity_npv=incremental_after_tax_equity_npv,
+        equity_capex_per_mwh=-equity_capex_npv / total_costs_npv * lcoe,
+        debt_service_per_mwh=-debt_service_npv / total_costs_npv * lcoe,
+        tax_benefit_per_mwh=-tax_benefit_npv / total_costs_npv * lcoe,
+        fixed_om_per_mwh=-fixed_om_npv / total_costs_npv * lcoe,
+        variable_om_per_mwh=-variable_om_npv / total_costs_npv * lcoe,
+        fuel_cost_per_mwh=-fuel_cost_npv / total_costs_npv * lcoe,
+    )
+
+
+class _OverriddenFields:
+    """Reads the fields of a message and its sub-messages, returning the value in
+    overrides instead for any field whose dotted path is there.
+    """
+
+    def __init__(self, message: Message, overrides: dict, prefix: str = ""):
+        self._message = message
+        self._overrides = overrides
+        self._prefix = prefix
+
+    def __getattr__(self, name: str):
+        field_path = self._prefix + name
+        if field_path in self._overrides:
+            return self._overrides[field_path]
+        value = getattr(self._message, name)
+        if isinstance(value, Message):
+            return _OverriddenFields(value, self._overrides, field_path + ".")
+        return value
+
+
+# Opt-in instrumentation, see offgrid_ai_profile.py. This runs last so that every
+# function exists when it is wrapped.
+if os.environ.get("OFFGRID_AI_PROFILE"):
+    import offgrid_ai_profile
+
+    offgrid_ai_profile.enable_from_environment()
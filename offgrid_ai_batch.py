@@ -0,0 +1,586 @@
+import numpy as np
+
+from offgrid_ai import CompiledFinancialInputs, compile_financial_inputs
+from offgrid_ai_pb2 import DataFile, FinancialInputs, NaturalGasType, SystemData
+
+SPEC_FIELDS = [
+    "load_mw",
+    "solar_capacity_mw",
+    "bess_max_power_mw",
+    "bess_energy_capacity_mwh",
+    "natural_gas_capacity_mw",
+]
+PRODUCTION_FIELDS = [
+    "solar_output_raw_mwh",
+    "solar_output_net_mwh",
+    "bess_throughput_mwh",
+    "bess_net_output_mwh",
+    "generator_output_mwh",
+    "generator_fuel_mmbtu",
+    "load_served_mwh",
+]
+# The float32 breakeven LCOE is within the larger of these of the float64 one: a
+# relative error from rounding the NPVs, and an absolute one ($/MWh) for LCOEs near
+# zero where the NPVs cancel. Checked by test_offgrid_ai.verify_float32_lcoe_values
+# over randomized inputs, against which they have a margin of about ten.
+FLOAT32_RELATIVE_ERROR = 1e-5
+FLOAT32_ABSOLUTE_ERROR = 0.01
+
+
+class SystemArrays:
+    """Column-oriented view of a set of systems. Spec fields are arrays of shape
+    (systems,) and production fields are matrices of shape (systems, years) so the
+    LCOE components can be computed for every system at once.
+    """
+
+    def __init__(self, location, nat_gas_type, year, **columns):
+        self.location = location
+        self.nat_gas_type = nat_gas_type
+        self.year = year
+        for field in SPEC_FIELDS + PRODUCTION_FIELDS:
+            setattr(self, field, columns[field])
+
+    @classmethod
+    def from_system_data(cls, systems) -> "SystemArrays":
+        """Build the arrays from a DataFile or any iterable of SystemData."""
+        if isinstance(systems, DataFile):
+            systems = systems.system_data
+        systems = list(systems)
+        num_years = len(systems[0].production) if systems else 0
+        for system_data in systems:
+            if len(system_data.production) != num_years:
+                raise ValueError("All systems must have the same number of years")
+
+        spec_columns = {field: [] for field in SPEC_FIELDS}
+        production_columns = {field: [] for field in PRODUCTION_FIELDS}
+        locations = []
+        nat_gas_types = []
+        years = []
+        for system_data in systems:
+            spec = system_data.spec
+            locations.append(spec.location)
+            nat_gas_types.append(spec.nat_gas_type)
+            for field in SPEC_FIELDS:
+                spec_columns[field].append(getattr(spec, field))
+            years.append([production.year for production in system_data.production])
+            for field in PRODUCTION_FIELDS:
+                production_columns[field].append(
+                    [getattr(production, field) for production in system_data.production]
+                )
+
+        columns = {
+            field: np.array(values, dtype=np.float64)
+            for field, values in spec_columns.items()
+        }
+        for field, values in production_columns.items():
+            columns[field] = np.array(values, dtype=np.float64).reshape(
+                len(systems), num_years
+            )
+        return cls(
+            np.array(locations, dtype=str),
+            np.array(nat_gas_types, dtype=np.int32),
+            np.array(years, dtype=np.int32).reshape(len(systems), num_years),
+            **columns,
+        )
+
+    def __len__(self) -> int:
+        return len(self.location)
+
+    def subset(self, selection) -> "SystemArrays":
+        """Returns the systems selected by a boolean mask or an array of indices."""
+        columns = {
+            field: getattr(self, field)[selection]
+            for field in SPEC_FIELDS + PRODUCTION_FIELDS
+        }
+        return SystemArrays(
+            self.location[selection],
+            self.nat_gas_type[selection],
+            self.year[selection],
+            **columns,
+        )
+
+    def with_nat_gas_type(self, nat_gas_type: int) -> "SystemArrays":
+        """Returns the same systems evaluated with the given natural gas type. The
+        production arrays are shared rather than copied.
+        """
+        columns = {field: getattr(self, field) for field in SPEC_FIELDS + PRODUCTION_FIELDS}
+        return SystemArrays(
+            self.location,
+            np.full(len(self), nat_gas_type, dtype=np.int32),
+            self.year,
+            **columns,
+        )
+
+    @classmethod
+    def concatenate(cls, system_arrays_list) -> "SystemArrays":
+        """Joins several SystemArrays into one, in order."""
+        columns = {
+            field: np.concatenate(
+                [getattr(system_arrays, field) for system_arrays in system_arrays_list]
+            )
+            for field in ["location", "nat_gas_type", "year"]
+            + SPEC_FIELDS
+            + PRODUCTION_FIELDS
+        }
+        return cls(**columns)
+
+    def astype(self, dtype) -> "SystemArrays":
+        """Returns the systems with the spec and production columns in the given
+        floating point dtype, e.g. np.float32 to halve the memory of a large sweep.
+        Columns already of that dtype are shared rather than copied.
+        """
+        columns = {
+            field: np.asarray(getattr(self, field), dtype=dtype)
+            for field in SPEC_FIELDS + PRODUCTION_FIELDS
+        }
+        return SystemArrays(self.location, self.nat_gas_type, self.year, **columns)
+
+    def to_system_data(self, index: int) -> SystemData:
+        """Rebuilds the SystemData message for the system at the given index."""
+        system_data = SystemData()
+        system_data.spec.location = str(self.location[index])
+        system_data.spec.nat_gas_type = int(self.nat_gas_type[index])
+        for field in SPEC_FIELDS:
+            setattr(system_data.spec, field, float(getattr(self, field)[index]))
+        for year_index, year in enumerate(self.year[index]):
+            production = system_data.production.add()
+            production.year = int(year)
+            for field in PRODUCTION_FIELDS:
+                setattr(production, field, float(getattr(self, field)[index, year_index]))
+        return system_data
+
+
+def after_tax_equity_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, lcoe
+) -> np.ndarray:
+    """Computer the after-tax equity NPV for every system, costs and LCOE."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return (
+        ebitda_npv(system_arrays, financial_inputs, lcoe)
+        + debt_service_npv(system_arrays, financial_inputs)
+        + tax_benefit_npv(system_arrays, financial_inputs, lcoe)
+        + equity_capex_npv(system_arrays, financial_inputs)
+    )
+
+
+def ebitda_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, lcoe
+) -> np.ndarray:
+    """Computes the NPV of the EBITDA over the project lifetime for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    revenue_npv = np.multiply(lcoe, production_npv(system_arrays, financial_inputs))
+    return (
+        revenue_npv
+        + fuel_cost_npv(system_arrays, financial_inputs)
+        + fixed_om_npv(system_arrays, financial_inputs)
+        + variable_om_npv(system_arrays, financial_inputs)
+    )
+
+
+def production_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Computes the NPV of the load served, escalated by the LCOE escalator."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    escalation = _escalation(
+        financial_inputs.lcoe_escalation,
+        financial_inputs.lcoe_escalator,
+        system_arrays.year,
+    )
+    return _npv(
+        system_arrays.load_served_mwh * escalation, system_arrays.year, financial_inputs
+    )
+
+
+def fuel_cost_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Computes the NPV of the fuel cost over the project lifetime for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    escalation = _escalation(
+        financial_inputs.fuel_escalation,
+        financial_inputs.fuel_escalator,
+        system_arrays.year,
+    )
+    fuel_cost = (
+        -system_arrays.generator_fuel_mmbtu * financial_inputs.fuel_price_mmbtu * escalation
+    )
+    consumption_ratio = np.where(
+        system_arrays.nat_gas_type == NaturalGasType.GAS_TURBINE,
+        financial_inputs.turbine_vs_generator_fuel_consumption_ratio,
+        1.0,
+    )
+    return _npv(fuel_cost, system_arrays.year, financial_inputs) * consumption_ratio
+
+
+def fixed_om_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    hard_capex_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Computes the NPV of the fixed O&M expenses over the project lifetime for every
+    system. Like the other functions here taking intermediate results, it computes
+    hard_capex_spend itself unless given it.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if hard_capex_spend is None:
+        hard_capex_spend = hard_capex(system_arrays, financial_inputs)
+    is_generator, is_gas_turbine = _gas_type_masks(system_arrays)
+    annual_fixed_om = -(
+        financial_inputs.solar_fixed_om_kw * system_arrays.solar_capacity_mw * 1000
+        + financial_inputs.bess_fixed_om_kw * system_arrays.bess_max_power_mw * 1000
+        + financial_inputs.generators_fixed_om_kw
+        * system_arrays.natural_gas_capacity_mw
+        * 1000
+        * is_generator
+        + financial_inputs.gas_turbines_fixed_om_kw
+        * system_arrays.natural_gas_capacity_mw
+        * 1000
+        * is_gas_turbine
+        + financial_inputs.bos_fixed_om_kw * system_arrays.load_mw * 1000
+        + financial_inputs.soft_costs * hard_capex_spend
+    )
+    escalation = _escalation(
+        financial_inputs.om_escalation, financial_inputs.om_escalator, system_arrays.year
+    )
+    return annual_fixed_om * _npv(escalation, system_arrays.year, financial_inputs)
+
+
+def variable_om_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Computes the NPV of the variable O&M expenses over the project lifetime for
+    every system.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    is_generator, is_gas_turbine = _gas_type_masks(system_arrays)
+    variable_om_kwh = (
+        financial_inputs.generators_variable_om_kwh * is_generator
+        + financial_inputs.gas_turbines_variable_om_kwh * is_gas_turbine
+    )
+    escalation = _escalation(
+        financial_inputs.om_escalation, financial_inputs.om_escalator, system_arrays.year
+    )
+    variable_om = -system_arrays.generator_output_mwh * 1000 * escalation
+    return variable_om_kwh * _npv(variable_om, system_arrays.year, financial_inputs)
+
+
+def total_capex(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    hard_capex_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the total capital expenditures that every project requires."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if hard_capex_spend is None:
+        hard_capex_spend = hard_capex(system_arrays, financial_inputs)
+    return hard_capex_spend * financial_inputs.soft_cost_multiplier
+
+
+def hard_capex(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Compute the hard capital expenditures for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return _capex_spend(
+        system_arrays,
+        financial_inputs.solar_capex_per_watt,
+        financial_inputs.bess_capex_per_kwh,
+        financial_inputs.generator_capex_per_kw,
+        financial_inputs.gas_turbine_capex_per_kw,
+        financial_inputs.system_integration_capex_per_kw,
+    )
+
+
+def federal_itc_applicable_spend(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Compute those expenditures which are eligible for the federal investment tax
+    credit for every system.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    hard_capex_spend_itc_applicable = _capex_spend(
+        system_arrays,
+        financial_inputs.solar_itc_applicable_per_watt,
+        financial_inputs.bess_itc_applicable_per_kwh,
+        financial_inputs.generator_itc_applicable_per_kw,
+        financial_inputs.gas_turbine_itc_applicable_per_kw,
+        financial_inputs.system_integration_itc_applicable_per_kw,
+    )
+    # Soft costs are eligible in the same proportion as the hard costs they are
+    # levied on, which is the total / hard capex ratio used in offgrid_ai.
+    return hard_capex_spend_itc_applicable * financial_inputs.soft_cost_multiplier
+
+
+def federal_itc(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    itc_applicable_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the amount of the federal investment tax credit for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if itc_applicable_spend is None:
+        itc_applicable_spend = federal_itc_applicable_spend(
+            system_arrays, financial_inputs
+        )
+    return itc_applicable_spend * financial_inputs.investment_tax_credit
+
+
+def federal_itc_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    itc: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the NPV of the federal investment tax credit for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if itc is None:
+        itc = federal_itc(system_arrays, financial_inputs)
+    return itc * _discount_factor(1, financial_inputs)
+
+
+def debt_service_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    total_capex_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the NPV of the debt service payments for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if total_capex_spend is None:
+        total_capex_spend = total_capex(system_arrays, financial_inputs)
+    starting_balance = total_capex_spend * financial_inputs.leverage
+    annual_payment = starting_balance * financial_inputs.debt_annuity_factor
+    years = np.arange(1, financial_inputs.debt_term + 1)
+    return -annual_payment * _discount_factor(years, financial_inputs).sum()
+
+
+def depreciation_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    total_capex_spend: np.ndarray = None,
+    itc: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the NPV of the depreciation for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if total_capex_spend is None:
+        total_capex_spend = total_capex(system_arrays, financial_inputs)
+    if itc is None:
+        itc = federal_itc(system_arrays, financial_inputs)
+    depreciable_amount = -(total_capex_spend - itc * 0.5)
+    depreciation_schedule = np.array(financial_inputs.depreciation_schedule)
+    years = np.arange(1, len(depreciation_schedule) + 1)
+    return depreciable_amount * np.dot(
+        depreciation_schedule, _discount_factor(years, financial_inputs)
+    )
+
+
+def interest_expense_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    total_capex_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the NPV of the interest expense for every system. This is the interest
+    only, not including principal payments as this is needed to calculate tax due.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if total_capex_spend is None:
+        total_capex_spend = total_capex(system_arrays, financial_inputs)
+    starting_balance = total_capex_spend * financial_inputs.leverage
+    interest_fractions = np.array(financial_inputs.interest_fractions)
+    years = np.arange(1, len(interest_fractions) + 1)
+    return -starting_balance * np.dot(
+        interest_fractions, _discount_factor(years, financial_inputs)
+    )
+
+
+def tax_benefit_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, lcoe
+) -> np.ndarray:
+    """Compute the NPV of federal income tax payments including the federal investment
+    tax credit for every system.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return -financial_inputs.combined_tax_rate * (
+        ebitda_npv(system_arrays, financial_inputs, lcoe)
+        + depreciation_npv(system_arrays, financial_inputs)
+        + interest_expense_npv(system_arrays, financial_inputs)
+    ) + federal_itc_npv(system_arrays, financial_inputs)
+
+
+def equity_capex_npv(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    total_capex_spend: np.ndarray = None,
+) -> np.ndarray:
+    """Compute the NPV of the capital expenditures funded by equity for every system."""
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    if total_capex_spend is None:
+        total_capex_spend = total_capex(system_arrays, financial_inputs)
+    equity_capex = total_capex_spend * (1 - financial_inputs.leverage)
+    construction_time = financial_inputs.construction_time
+    years = np.arange(0, -construction_time, -1)
+    return (
+        -equity_capex
+        / construction_time
+        * _discount_factor(years, financial_inputs).sum()
+    )
+
+
+def incremental_after_tax_equity_npv(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> np.ndarray:
+    """Compute the increase in after-tax equity NPV that results from a $1/MWh increase
+    in the LCOE for every system.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return production_npv(system_arrays, financial_inputs) * (
+        1 - financial_inputs.combined_tax_rate
+    )
+
+
+def breakeven_lcoe(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, dtype=None
+) -> np.ndarray:
+    """Computes the breakeven LCOE of every system. This matches
+    offgrid_ai.breakeven_lcoe up to floating point rounding.
+
+    With dtype=np.float32 the whole evaluation runs in single precision, halving the
+    memory and bandwidth, to within FLOAT32_RELATIVE_ERROR or FLOAT32_ABSOLUTE_ERROR
+    of the float64 LCOE. Pass systems already converted with SystemArrays.astype to
+    avoid a conversion on every call.
+    """
+    if dtype is not None:
+        system_arrays = system_arrays.astype(dtype)
+        financial_inputs = cast_financial_inputs(financial_inputs, dtype)
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return -after_tax_equity_npv(
+        system_arrays, financial_inputs, 0
+    ) / incremental_after_tax_equity_npv(system_arrays, financial_inputs)
+
+
+def lowest_lcoe(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    float32_arrays: SystemArrays = None,
+) -> tuple:
+    """Returns the index and LCOE of the lowest LCOE system, exactly as np.nanargmin
+    of the float64 breakeven_lcoe would give them. Every system is screened in float32
+    (using float32_arrays, the same systems converted with astype, if given) and only
+    those which could be the lowest within the float32 error bound are re-evaluated
+    in float64 from system_arrays.
+
+    Systems whose LCOE is NaN, such as those serving no load, are skipped; those
+    screened as NaN are re-evaluated too, in case only float32 left them undefined.
+    Raises ValueError if no system has a defined LCOE.
+    """
+    if float32_arrays is None:
+        float32_arrays = system_arrays.astype(np.float32)
+    lcoes = breakeven_lcoe(float32_arrays, financial_inputs, np.float32).astype(
+        np.float64
+    )
+    # Infinite LCOEs, of systems with no production, are screened as they are.
+    tolerance = np.where(
+        np.isinf(lcoes),
+        0.0,
+        np.maximum(FLOAT32_RELATIVE_ERROR * np.abs(lcoes), FLOAT32_ABSOLUTE_ERROR),
+    )
+    undefined = np.isnan(lcoes)
+    if undefined.all():
+        candidates = np.flatnonzero(undefined)
+    else:
+        bound = np.min((lcoes + tolerance)[~undefined])
+        candidates = np.flatnonzero(undefined | (lcoes - tolerance <= bound))
+    exact_lcoes = breakeven_lcoe(system_arrays.subset(candidates), financial_inputs)
+    if np.isnan(exact_lcoes).all():
+        raise ValueError("No system has a defined LCOE")
+    best = int(np.nanargmin(exact_lcoes))
+    return int(candidates[best]), float(exact_lcoes[best])
+
+
+def cast_financial_inputs(
+    financial_inputs: FinancialInputs, dtype
+) -> CompiledFinancialInputs:
+    """Compiles financial_inputs with every rate and table in the given floating
+    point dtype, so that evaluating float32 SystemArrays stays in float32.
+    """
+    financial_inputs = compile_financial_inputs(financial_inputs)
+    return financial_inputs._replace(
+        **{
+            field: np.asarray(value, dtype=dtype)
+            if isinstance(value, tuple)
+            else dtype(value)
+            for field, value in financial_inputs._asdict().items()
+            if isinstance(value, (float, tuple))
+        }
+    )
+
+
+def lifetime_renewable_percentage(system_arrays: SystemArrays) -> np.ndarray:
+    """Computes the lifetime renewable percentage of every system."""
+    return 1.0 - (
+        system_arrays.generator_output_mwh.sum(axis=1)
+        / system_arrays.load_served_mwh.sum(axis=1)
+    )
+
+
+def breakeven_lcoes(systems, financial_inputs: FinancialInputs) -> np.ndarray:
+    """Computes the breakeven LCOE for a DataFile, an iterable of SystemData or a
+    SystemArrays, returned in the same order as the systems.
+    """
+    if not isinstance(systems, SystemArrays):
+        systems = SystemArrays.from_system_data(systems)
+    return breakeven_lcoe(systems, financial_inputs)
+
+
+def _capex_spend(
+    system_arrays: SystemArrays,
+    solar_per_watt,
+    bess_per_kwh,
+    generator_per_kw,
+    gas_turbine_per_kw,
+    system_integration_per_kw,
+) -> np.ndarray:
+    """Applies per-unit capex rates to the system sizes."""
+    is_generator, is_gas_turbine = _gas_type_masks(system_arrays)
+    return (
+        solar_per_watt * 1000000 * system_arrays.solar_capacity_mw
+        + bess_per_kwh * 1000 * system_arrays.bess_energy_capacity_mwh
+        + generator_per_kw * 1000 * system_arrays.natural_gas_capacity_mw * is_generator
+        + gas_turbine_per_kw
+        * 1000
+        * system_arrays.natural_gas_capacity_mw
+        * is_gas_turbine
+        + system_integration_per_kw * 1000 * system_arrays.load_mw
+    )
+
+
+def _gas_type_masks(system_arrays: SystemArrays):
+    return (
+        system_arrays.nat_gas_type == NaturalGasType.GENERATOR,
+        system_arrays.nat_gas_type == NaturalGasType.GAS_TURBINE,
+    )
+
+
+def _escalation(escalation_factors: tuple, escalator, years: np.ndarray):
+    """Escalation factors for an array of operating years, from the precomputed table
+    when every year is within the project horizon.
+    """
+    years = np.asarray(years)
+    if years.size and 1 <= years.min() and years.max() <= len(escalation_factors):
+        return np.asarray(escalation_factors)[years - 1]
+    return (1 + escalator) ** (years - 1)
+
+
+def _discount_factor(years, financial_inputs: CompiledFinancialInputs):
+    """Discount factors matching offgrid_ai.calc_npv, i.e. as of the start of
+    construction.
+    """
+    indices = np.asarray(years) + financial_inputs.construction_time
+    discount_factors = financial_inputs.discount_factors
+    if indices.size and 0 <= indices.min() and indices.max() < len(discount_factors):
+        return np.asarray(discount_factors)[indices]
+    return (1 + financial_inputs.cost_of_equity) ** -indices
+
+
+def _npv(cash_flows: np.ndarray, years: np.ndarray, financial_inputs: CompiledFinancialInputs):
+    """NPV of a (systems, years) matrix of cash flows, one value per system."""
+    return (cash_flows * _discount_factor(years, financial_inputs)).sum(axis=-1)
@@ -0,0 +1,312 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_index import SpecIndex
+from offgrid_ai_parameter_sensitivity import compute_lcoes, get_lowest_lcoe_system
+from offgrid_ai_pb2 import DataFile, NaturalGasType
+from offgrid_ai_price_coefficients import compute_price_coefficients
+
+# Approximate dimensions of the workbook's data sheet. Larger scales add synthetic
+# locations, which is how the dataset is expected to grow.
+LOCATIONS = [
+    "Amarillo, TX",
+    "Beryl Junction, UT",
+    "El Paso, TX",
+    "Lovelock, NV",
+    "North Komelik, AZ",
+    "Trinidad, CO",
+    "Willcox, NM",
+    "Yuma, AZ",
+]
+SOLAR_CAPACITIES_MW = list(range(0, 501, 50))
+BESS_MAX_POWERS_MW = list(range(0, 401, 50))
+NATURAL_GAS_CAPACITIES_MW = [100, 125, 150]
+BESS_DURATION_HOURS = 4
+LOAD_MW = 100
+NUM_YEARS = 20
+SCALES = [1, 10, 100]
+
+# Synthetic production model.
+SOLAR_CAPACITY_FACTOR_RANGE = (0.19, 0.29)
+SOLAR_DEGRADATION = 0.005
+SOLAR_NET_FRACTION = 0.97
+# Share of the load which falls in daylight hours and can be served directly by solar.
+DAYTIME_LOAD_FRACTION = 0.5
+BESS_ROUND_TRIP_EFFICIENCY = 0.87
+BESS_CYCLES_PER_YEAR = 350
+GENERATOR_HEAT_RATE_MMBTU_PER_MWH = 8.989
+WEATHER_VARIABILITY = 0.03
+
+BENCHMARKS = [
+    "load",
+    "breakeven_lcoe",
+    "batch_breakeven_lcoe",
+    "location_optimization",
+    "pareto_frontier",
+    "price_sweep",
+]
+
+
+def generate_data_file(scale: int = 1, seed: int = 0) -> DataFile:
+    """Generates a synthetic DataFile with scale times as many locations as the
+    workbook and the same grid of solar, BESS and gas sizes at each. Every location
+    has its own solar resource and every year its own weather, and the BESS shifts
+    surplus solar into the night, so LCOEs and optimal systems vary realistically.
+    """
+    rng = np.random.default_rng(seed)
+    solar = np.array(SOLAR_CAPACITIES_MW, dtype=float)[:, None, None]
+    bess = np.array(BESS_MAX_POWERS_MW, dtype=float)[None, :, None]
+    years = np.arange(1, NUM_YEARS + 1)
+    load = LOAD_MW * 8760.0
+
+    data_file = DataFile()
+    for location in _locations(scale):
+        capacity_factor = rng.uniform(*SOLAR_CAPACITY_FACTOR_RANGE)
+        weather = 1 + WEATHER_VARIABILITY * rng.standard_normal(NUM_YEARS)
+        solar_output_raw = (
+            solar
+            * 8760
+            * capacity_factor
+            * weather
+            * (1 - SOLAR_DEGRADATION) ** (years - 1)
+        )
+        solar_output_net = solar_output_raw * SOLAR_NET_FRACTION
+        direct_solar = np.minimum(solar_output_net, load * DAYTIME_LOAD_FRACTION)
+        bess_throughput = np.minimum(
+            solar_output_net - direct_solar,
+            bess * BESS_DURATION_HOURS * BESS_CYCLES_PER_YEAR,
+        )
+        bess_net_output = np.minimum(
+            bess_throughput * BESS_ROUND_TRIP_EFFICIENCY,
+            load * (1 - DAYTIME_LOAD_FRACTION),
+        )
+        generator_output = load - direct_solar - bess_net_output
+        for natural_gas_capacity_mw in NATURAL_GAS_CAPACITIES_MW:
+            for i, solar_capacity_mw in enumerate(SOLAR_CAPACITIES_MW):
+                for j, bess_max_power_mw in enumerate(BESS_MAX_POWERS_MW):
+                    system_data = data_file.system_data.add()
+                    spec = system_data.spec
+                    spec.location = location
+                    spec.load_mw = LOAD_MW
+                    spec.solar_capacity_mw = solar_capacity_mw
+                    spec.bess_max_power_mw = bess_max_power_mw
+                    spec.bess_energy_capacity_mwh = (
+                        bess_max_power_mw * BESS_DURATION_HOURS
+                    )
+                    spec.natural_gas_capacity_mw = natural_gas_capacity_mw
+                    spec.nat_gas_type = NaturalGasType.GENERATOR
+                    for k, year in enumerate(years):
+                        production = system_data.production.add()
+                        production.year = int(year)
+                        production.solar_output_raw_mwh = solar_output_raw[i, 0, k]
+                        production.solar_output_net_mwh = solar_output_net[i, 0, k]
+                        production.bess_throughput_mwh = bess_throughput[i, j, k]
+                        production.bess_net_output_mwh = bess_net_output[i, j, k]
+                        production.generator_output_mwh = generator_output[i, j, k]
+                        production.generator_fuel_mmbtu = (
+                            generator_output[i, j, k]
+                            * GENERATOR_HEAT_RATE_MMBTU_PER_MWH
+                        )
+                        production.load_served_mwh = load
+    return data_file
+
+
+def write_synthetic_data(output_file: str, scale: int = 1, seed: int = 0):
+    with open(output_file, "wb") as f:
+        f.write(generate_data_file(scale, seed).SerializeToString())
+
+
+def run_benchmarks(
+    output_file: str,
+    data_dir: str,
+    scales=SCALES,
+    benchmarks=BENCHMARKS,
+    max_systems: int = 1000,
+):
+    """Runs every benchmark at every scale and writes the results as JSON. Each
+    benchmark runs in a fresh process so its peak RSS is not inflated by the others;
+    synthetic data files are generated into data_dir once and reused. Per system
+    scalar benchmarks time at most max_systems systems.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scale in scales:
+        input_file = os.path.join(data_dir, f"offgrid_ai_synthetic_{scale}x.binarypb")
+        if not os.path.exists(input_file):
+            write_synthetic_data(input_file, scale)
+        for benchmark in benchmarks:
+            with context.Pool(1) as pool:
+                result = pool.apply(_run_benchmark, (benchmark, input_file, max_systems))
+            result.update(scale=scale, data_file_bytes=os.path.getsize(input_file))
+            results.append(result)
+            print(
+                f"{scale}x {benchmark}: {result['wall_time_s']:.3f}s, "
+                f"{result['throughput_per_s']:.1f} {result['unit']}/s, "
+                f"peak RSS {result['peak_rss_mb']:.1f}MB"
+            )
+    report = {
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the LCOE calculations on synthetic datasets."
+    )
+    parser.add_argument("output", help="JSON results file")
+    parser.add_argument(
+        "--data-dir", default="benchmark_data", help="Where to keep synthetic data"
+    )
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=SCALES, help="Dataset scales to run"
+    )
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS
+    )
+    parser.add_argument("--max-systems", type=int, default=1000)
+    args = parser.parse_args()
+    run_benchmarks(
+        args.output, args.data_dir, args.scales, args.benchmarks, args.max_systems
+    )
+
+
+def _run_benchmark(benchmark: str, input_file: str, max_systems: int) -> dict:
+    start = time.perf_counter()
+    data_file = _load(input_file)
+    load_time = time.perf_counter() - start
+    num_systems = len(data_file.system_data)
+    if benchmark == "load":
+        wall_time, items, unit = load_time, num_systems, "systems"
+    elif benchmark == "breakeven_lcoe":
+        systems = data_file.system_data[:max_systems]
+        financial_inputs = offgrid_ai.build_standard_financial_inputs()
+        start = time.perf_counter()
+        for system_data in systems:
+            offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
+        wall_time, items, unit = time.perf_counter() - start, len(systems), "systems"
+    elif benchmark == "batch_breakeven_lcoe":
+        start = time.perf_counter()
+        system_arrays = SystemArrays.from_system_data(data_file)
+        offgrid_ai_batch.breakeven_lcoe(
+            system_arrays, offgrid_ai.build_standard_financial_inputs()
+        )
+        wall_time, items, unit = time.perf_counter() - start, num_systems, "systems"
+    elif benchmark == "location_optimization":
+        # As in the parameter sensitivity example: the lowest LCOE system of every
+        # location, with generators and with turbines.
+        financial_inputs = offgrid_ai.build_standard_financial_inputs()
+        start = time.perf_counter()
+        spec_index = SpecIndex(data_file)
+        items = 0
+        for location, natural_gas_capacity_mw in _location_keys(spec_index):
+            get_lowest_lcoe_system(
+                spec_index, financial_inputs, location, natural_gas_capacity_mw, True
+            )
+            items += 2 * len(
+                spec_index.lookup(
+                    location=location, natural_gas_capacity_mw=natural_gas_capacity_mw
+                )
+            )
+        wall_time, unit = time.perf_counter() - start, "systems"
+    elif benchmark == "pareto_frontier":
+        spec_index = SpecIndex(data_file)
+        financial_inputs = offgrid_ai.build_standard_financial_inputs()
+        system_data_with_lcoes = [
+            compute_lcoes(spec_index, financial_inputs, *key, False)
+            for key in _location_keys(spec_index)
+        ]
+        start = time.perf_counter()
+        for system_data_with_lcoe in system_data_with_lcoes:
+            offgrid_ai.find_pareto_frontier(system_data_with_lcoe)
+        wall_time, unit = time.perf_counter() - start, "systems"
+        items = sum(len(systems) for systems in system_data_with_lcoes)
+    elif benchmark == "price_sweep":
+        # The module price x BESS price grid of the parameter sensitivity example, for
+        # every location.
+        spec_index = SpecIndex(data_file)
+        start = time.perf_counter()
+        num_points = 0
+        for key in _location_keys(spec_index):
+            num_points += _price_sweep(
+                spec_index.lookup(location=key[0], natural_gas_capacity_mw=key[1])
+            )
+        wall_time, items, unit = time.perf_counter() - start, num_points, "points"
+    else:
+        raise ValueError(f"Unknown benchmark {benchmark}")
+    return {
+        "benchmark": benchmark,
+        "num_systems": num_systems,
+        "wall_time_s": wall_time,
+        "items": items,
+        "unit": unit,
+        "throughput_per_s": items / wall_time if wall_time > 0 else float("inf"),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _locations(scale: int) -> list:
+    locations = list(LOCATIONS)
+    for i in range(len(LOCATIONS) * (scale - 1)):
+        locations.append(f"Synthetic Site {i + 1}")
+    return locations
+
+
+def _load(input_file: str) -> DataFile:
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    return data_file
+
+
+def _location_keys(spec_index: SpecIndex) -> list:
+    return [
+        key
+        for key, _ in spec_index.group_by("location", "natural_gas_capacity_mw")
+        if key[1] == NATURAL_GAS_CAPACITIES_MW[1]
+    ]
+
+
+def _price_sweep(systems) -> int:
+    system_arrays = SystemArrays.from_system_data(systems)
+    price_coefficients = compute_price_coefficients(
+        system_arrays, offgrid_ai.build_standard_financial_inputs()
+    )
+    num_points = 0
+    for module_price_cents in range(22, 1, -1):
+        for bess_price in range(200, 90, -10):
+            financial_inputs = offgrid_ai.build_standard_financial_inputs()
+            financial_inputs.capex_inputs.bess_capex.bess_units = bess_price
+            financial_inputs.capex_inputs.solar_capex.modules = module_price_cents / 100.0
+            np.argmin(price_coefficients.reprice(financial_inputs))
+            num_points += 1
+    return num_points
+
+
+def _peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    if sys.platform == "darwin":
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+
+import offgrid_ai
+from offgrid_ai import CompiledFinancialInputs, LcoeBreakdown, SpecRecord, SystemRecord
+from offgrid_ai_pb2 import FinancialInputs, SystemData
+
+# Bump when the LCOE calculation or the key changes so older results are not reused.
+CACHE_VERSION = 3
+DEFAULT_MAX_ENTRIES = 1000000
+# Eviction needs a count of the entries, so it runs after this many insertions rather
+# than after every one. The cache can exceed max_entries by up to this much.
+EVICTION_INTERVAL = 1000
+# A hit only records its use time if the recorded one is older than this many
+# seconds, so that reads rarely need SQLite's write lock. Eviction is least recently
+# used to within this resolution.
+LAST_USED_RESOLUTION = 3600.0
+# The number of SystemData digests kept in memory, keyed by the message's
+# serialization, so repeated lookups of a system don't convert it each time.
+SYSTEM_DIGEST_CACHE_SIZE = 32768
+
+_BREAKDOWN_FORMAT = struct.Struct(f"<{len(LcoeBreakdown._fields)}d")
+
+
+class LcoeCache:
+    """An on-disk cache of LcoeBreakdowns in a SQLite database, keyed by a SHA-256 of
+    the FinancialInputs and the system's spec and production data, so the same
+    evaluation is found again by any process or notebook using the same file.
+
+    The database is in WAL mode, so any number of processes can read and write it
+    concurrently; each process opens its own connection. Hits refresh the entry's
+    last use time when it is older than LAST_USED_RESOLUTION and the least recently
+    used entries beyond max_entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection = None
+        self._connection_pid = None
+        self._insertions = 0
+        self._connect()
+
+    def __enter__(self) -> "LcoeCache":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, system_data: SystemData, financial_inputs: FinancialInputs):
+        """Returns the cached LcoeBreakdown, or None if there is none."""
+        key = cache_key(system_data, financial_inputs)
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT breakdown, last_used FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        breakdown, last_used = row
+        now = time.time()
+        if now - last_used > LAST_USED_RESOLUTION:
+            self.touch(key, now)
+        return LcoeBreakdown(*_BREAKDOWN_FORMAT.unpack(breakdown))
+
+    def put(
+        self,
+        system_data: SystemData,
+        financial_inputs: FinancialInputs,
+        lcoe_breakdown: LcoeBreakdown,
+    ):
+        key = cache_key(system_data, financial_inputs)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO results (key, breakdown, last_used) VALUES (?, ?, ?)",
+            (key, _BREAKDOWN_FORMAT.pack(*lcoe_breakdown), time.time()),
+        )
+        self._insertions += 1
+        if self._insertions >= EVICTION_INTERVAL:
+            self.evict()
+
+    def touch(self, key: bytes, last_used: float = None):
+        """Sets the last use time of the entry with the given cache_key, now by
+        default. Entries are evicted in order of last use.
+        """
+        if last_used is None:
+            last_used = time.time()
+        self._connect().execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (last_used, key)
+        )
+
+    def evaluate_lcoe(
+        self, system_data: SystemData, financial_inputs: FinancialInputs
+    ) -> LcoeBreakdown:
+        """offgrid_ai.evaluate_lcoe, computed only if it is not already cached."""
+        lcoe_breakdown = self.get(system_data, financial_inputs)
+        if lcoe_breakdown is None:
+            lcoe_breakdown = offgrid_ai.evaluate_lcoe(system_data, financial_inputs)
+            self.put(system_data, financial_inputs, lcoe_breakdown)
+        return lcoe_breakdown
+
+    def breakeven_lcoe(
+        self, system_data: SystemData, financial_inputs: FinancialInputs
+    ) -> float:
+        return self.evaluate_lcoe(system_data, financial_inputs).lcoe
+
+    def evict(self):
+        """Deletes the least recently used entries beyond max_entries."""
+        self._insertions = 0
+        connection = self._connect()
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM results")
+
+    def close(self):
+        if self._connection is not None:
+            self.evict()
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared with forked worker processes, so each
+        # process opens its own.
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key BLOB PRIMARY KEY, breakdown BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+            )
+            self._connection = connection
+            self._connection_pid = os.getpid()
+            self._insertions = 0
+        return self._connection
+
+
+def cache_key(system_data: SystemData, financial_inputs: FinancialInputs) -> bytes:
+    """A SHA-256 of everything the LCOE of system_data depends on, equal across
+    processes and runs for equal inputs. The financial inputs are keyed by their
+    deterministic serialization whether given as a proto or compiled, and the system
+    by its spec fields and production arrays whether given as a SystemData, a
+    SystemDataView or a SystemRecord, so every form of the same evaluation shares
+    one entry.
+    """
+    if isinstance(financial_inputs, CompiledFinancialInputs):
+        if financial_inputs.source is None:
+            raise ValueError(
+                "Financial inputs compiled with overrides can't be cached"
+            )
+        source = financial_inputs.source
+    else:
+        source = financial_inputs.SerializeToString(deterministic=True)
+    if isinstance(system_data, SystemData):
+        system_digest = _serialized_system_digest(
+            system_data.SerializeToString(deterministic=True)
+        )
+    else:
+        if not isinstance(system_data, SystemRecord):
+            system_data = SystemRecord.from_system_data(system_data)
+        system_digest = _system_record_digest(system_data)
+    digest = _financial_inputs_digest(source).copy()
+    _update_field(digest, system_digest)
+    return digest.digest()
+
+
+@functools.lru_cache(maxsize=16)
+def _financial_inputs_digest(source: bytes):
+    # The hash state after the financial inputs, computed once per set of inputs
+    # rather than once per system and copied for each.
+    digest = hashlib.sha256()
+    digest.update(struct.pack("<I", CACHE_VERSION))
+    _update_field(digest, source)
+    return digest
+
+
+@functools.lru_cache(maxsize=SYSTEM_DIGEST_CACHE_SIZE)
+def _serialized_system_digest(serialized: bytes) -> bytes:
+    # Reading a SystemData's production rows costs more than the cache lookup it keys,
+    # so the digest is computed once per distinct message.
+    return _system_record_digest(
+        SystemRecord.from_system_data(SystemData.FromString(serialized))
+    )
+
+
+def _system_record_digest(system_data: SystemRecord) -> bytes:
+    digest = hashlib.sha256()
+    spec = system_data.spec
+    spec_fields = tuple(getattr(spec, field) for field in SpecRecord.__slots__)
+    _update_field(digest, repr(spec_fields).encode())
+    _update_field(digest, system_data.year.tobytes())
+    _update_field(digest, system_data.values.tobytes())
+    return digest.digest()
+
+
+def _update_field(digest, data: bytes):
+    # Length prefixes keep the boundaries between the hashed messages unambiguous.
+    digest.update(struct.pack("<Q", len(data)))
+    digest.update(data)
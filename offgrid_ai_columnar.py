@@ -0,0 +1,130 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from offgrid_ai_batch import PRODUCTION_FIELDS, SPEC_FIELDS, SystemArrays
+from offgrid_ai_pb2 import DataFile
+
+FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+# Names the version directory holding the current columns.
+CURRENT_FILE_NAME = "current"
+LOCK_FILE_NAME = "lock"
+_VERSION_PREFIX = "version-"
+_TEMP_PREFIX = ".tmp-"
+COLUMNS = ["location", "nat_gas_type", "year"] + SPEC_FIELDS + PRODUCTION_FIELDS
+
+
+def write_columnar_cache(data_file: DataFile, cache_dir: str):
+    """Writes every SystemSpec field and every per-year SystemProduction field of the
+    data file as its own .npy file in a new version directory of cache_dir.
+    Production fields are stored as (systems, years) matrices so they can be
+    memory-mapped directly.
+
+    Each write makes a complete new version, which is switched to by atomically
+    replacing the file naming the current version. Older versions are deleted under
+    an exclusive lock, which load_columnar_cache holds shared while opening a version,
+    so a reader opens all of its columns from one version and processes which have
+    the old version memory-mapped keep reading it.
+    """
+    system_arrays = SystemArrays.from_system_data(data_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=_TEMP_PREFIX, dir=cache_dir)
+    try:
+        _write_version(system_arrays, temp_dir)
+        with _locked(cache_dir, fcntl.LOCK_EX):
+            version = _VERSION_PREFIX + os.path.basename(temp_dir)[len(_TEMP_PREFIX) :]
+            os.replace(temp_dir, os.path.join(cache_dir, version))
+            current_path = os.path.join(cache_dir, CURRENT_FILE_NAME)
+            with open(current_path + ".new", "w") as f:
+                f.write(version)
+            os.replace(current_path + ".new", current_path)
+            for entry in os.listdir(cache_dir):
+                path = os.path.join(cache_dir, entry)
+                if entry.startswith(_VERSION_PREFIX) and entry != version:
+                    shutil.rmtree(path, ignore_errors=True)
+                elif entry == MANIFEST_FILE_NAME or entry.endswith(".npy"):
+                    # A cache written before versions were introduced.
+                    os.remove(path)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+
+def load_columnar_cache(cache_dir: str) -> SystemArrays:
+    """Opens the current version of a cache written by write_columnar_cache. Columns
+    are memory-mapped read-only, so opening is near instant and worker processes
+    loading the same cache share the underlying pages. Use
+    SystemArrays.to_system_data to rebuild individual SystemData messages.
+    """
+    with _locked(cache_dir, fcntl.LOCK_SH):
+        try:
+            with open(os.path.join(cache_dir, CURRENT_FILE_NAME)) as f:
+                version_dir = os.path.join(cache_dir, f.read())
+        except FileNotFoundError:
+            # A cache written before versions were introduced.
+            version_dir = cache_dir
+        with open(os.path.join(version_dir, MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+        if manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported columnar cache version {manifest['format_version']}"
+            )
+        columns = {
+            column: np.load(os.path.join(version_dir, column + ".npy"), mmap_mode="r")
+            for column in COLUMNS
+        }
+    return SystemArrays(**columns)
+
+
+def convert(input_file: str, cache_dir: str):
+    """One-time conversion of a binarypb DataFile to the columnar cache format."""
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    write_columnar_cache(data_file, cache_dir)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(
+            "Usage: python offgrid_ai_columnar.py offgrid_ai_data.binarypb offgrid_ai_data.columns"
+        )
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
+
+
+def _write_version(system_arrays: SystemArrays, version_dir: str):
+    for column in COLUMNS:
+        np.save(
+            os.path.join(version_dir, column + ".npy"),
+            np.ascontiguousarray(getattr(system_arrays, column)),
+        )
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "num_systems": len(system_arrays),
+        "num_years": system_arrays.year.shape[1],
+        "columns": COLUMNS,
+    }
+    with open(os.path.join(version_dir, MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+@contextlib.contextmanager
+def _locked(cache_dir: str, operation: int):
+    with open(os.path.join(cache_dir, LOCK_FILE_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+if __name__ == "__main__":
+    main()
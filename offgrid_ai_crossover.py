@@ -0,0 +1,282 @@
+from typing import NamedTuple
+
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_envelope import RELATIVE_TOLERANCE, EnvelopeSegment, lower_envelope
+from offgrid_ai_gradients import lcoe_gradients, numeric_fields
+from offgrid_ai_pb2 import FinancialInputs
+
+# The floating point fields the LCOE is not affine in: they discount, escalate or
+# scale the production NPV. In every other one, prices, the ITC, leverage and the
+# depreciation schedule included, the LCOE of each system is a line.
+NONLINEAR_FIELDS = [
+    "cost_of_equity",
+    "cost_of_debt",
+    "combined_tax_rate",
+    "om_escalator",
+    "fuel_escalator",
+    "lcoe_escalator",
+]
+# Number of points at which the LCOEs are sampled to bracket the crossovers in a
+# nonlinear field.
+DEFAULT_NUM_SAMPLES = 65
+MAX_ITERATIONS = 100
+
+
+class Crossover(NamedTuple):
+    """A value of the field at which two systems have the same LCOE."""
+
+    value: float
+    lcoe: float
+    # The system with the lower LCOE just below value, and the one just above it.
+    lower_system: int
+    upper_system: int
+
+
+def crossovers(
+    systems,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    start: float,
+    end: float,
+    num_samples: int = DEFAULT_NUM_SAMPLES,
+) -> list:
+    """Returns every value of field_path in [start, end] at which two of the systems
+    (a SystemArrays or SystemData, in any number) have the same LCOE, with every other
+    input taken from financial_inputs, in increasing order.
+
+    For fields the LCOE is affine in, each system's LCOE line comes from one exact
+    derivative and the crossovers are their intersections. For NONLINEAR_FIELDS the
+    LCOE differences are sampled at num_samples points and every sign change is
+    solved to machine precision with Brent's method; two crossovers of the same pair
+    between adjacent samples can be missed.
+    """
+    system_arrays = _system_arrays(systems)
+    _check_field(field_path, start, end)
+    num_systems = len(system_arrays)
+    pairs = [(i, j) for i in range(num_systems) for j in range(i + 1, num_systems)]
+    found = []
+    if field_path not in NONLINEAR_FIELDS:
+        intercepts, slopes = _lines(system_arrays, financial_inputs, field_path)
+        for i, j in pairs:
+            if slopes[i] == slopes[j]:
+                continue
+            value = (intercepts[j] - intercepts[i]) / (slopes[i] - slopes[j])
+            if start <= value <= end:
+                lower, upper = (i, j) if slopes[i] > slopes[j] else (j, i)
+                lcoe = intercepts[i] + slopes[i] * value
+                found.append(Crossover(float(value), float(lcoe), lower, upper))
+    else:
+        values = np.linspace(start, end, num_samples)
+        sampled_lcoes = np.array(
+            [
+                _lcoes(system_arrays, financial_inputs, field_path, value)
+                for value in values
+            ]
+        )
+        for i, j in pairs:
+            differences = sampled_lcoes[:, i] - sampled_lcoes[:, j]
+            difference = _difference(system_arrays, financial_inputs, field_path, i, j)
+            for sample in np.flatnonzero(differences[:-1] * differences[1:] < 0):
+                value = _brent(
+                    difference,
+                    values[sample],
+                    values[sample + 1],
+                    differences[sample],
+                    differences[sample + 1],
+                )
+                lcoe = _lcoes(
+                    system_arrays.subset([i]), financial_inputs, field_path, value
+                )[0]
+                lower, upper = (j, i) if differences[sample] > 0 else (i, j)
+                found.append(Crossover(value, float(lcoe), lower, upper))
+    found.sort()
+    return found
+
+
+def lowest_lcoe_segments(
+    systems,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    start: float,
+    end: float,
+    num_samples: int = DEFAULT_NUM_SAMPLES,
+) -> list:
+    """Returns the intervals of field_path over [start, end] in which each system has
+    the lowest LCOE, as EnvelopeSegments in increasing order. Unlike
+    offgrid_ai_envelope.lowest_lcoe_breakpoints this accepts any floating point field;
+    for NONLINEAR_FIELDS the lowest system is found at num_samples points and the
+    changes between them are solved exactly, so a system which is lowest only between
+    two adjacent samples can be missed.
+    """
+    system_arrays = _system_arrays(systems)
+    _check_field(field_path, start, end)
+    if field_path not in NONLINEAR_FIELDS:
+        intercepts, slopes = _lines(system_arrays, financial_inputs, field_path)
+        return lower_envelope(intercepts, slopes, start, end)
+
+    def lowest(value):
+        lcoes = _lcoes(system_arrays, financial_inputs, field_path, value)
+        return lcoes, int(np.argmin(lcoes))
+
+    def split(left, left_system, right, right_system, breakpoints):
+        # The lowest system changes somewhere in (left, right): find where the two
+        # systems cross, and if a third is lower there, split again on either side.
+        difference = _difference(
+            system_arrays, financial_inputs, field_path, left_system, right_system
+        )
+        value = _brent(difference, left, right, difference(left), difference(right))
+        lcoes, system = lowest(value)
+        tolerance = RELATIVE_TOLERANCE * max(1.0, abs(lcoes[system]))
+        if lcoes[left_system] <= lcoes[system] + tolerance or value in (left, right):
+            breakpoints.append((value, right_system))
+            return
+        split(left, left_system, value, system, breakpoints)
+        split(value, system, right, right_system, breakpoints)
+
+    values = np.linspace(start, end, num_samples)
+    systems_at = [lowest(value)[1] for value in values]
+    breakpoints = []
+    for sample in range(num_samples - 1):
+        if systems_at[sample] != systems_at[sample + 1]:
+            split(
+                values[sample],
+                systems_at[sample],
+                values[sample + 1],
+                systems_at[sample + 1],
+                breakpoints,
+            )
+
+    segments = []
+    segment_start, current = start, systems_at[0]
+    for value, system in breakpoints:
+        segments.append(EnvelopeSegment(current, segment_start, float(value)))
+        segment_start, current = float(value), system
+    segments.append(EnvelopeSegment(current, segment_start, end))
+    return segments
+
+
+def optimal_entry_values(
+    systems,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    start: float,
+    end: float,
+    num_samples: int = DEFAULT_NUM_SAMPLES,
+) -> np.ndarray:
+    """For each system, the lowest value of field_path in [start, end] at which it
+    becomes the lowest LCOE system, or NaN if it never does. Pass the systems of one
+    location to find the value at which each becomes the location's optimum.
+    """
+    system_arrays = _system_arrays(systems)
+    entry_values = np.full(len(system_arrays), np.nan)
+    for segment in reversed(
+        lowest_lcoe_segments(
+            system_arrays, financial_inputs, field_path, start, end, num_samples
+        )
+    ):
+        entry_values[segment.system_index] = segment.start
+    return entry_values
+
+
+def _system_arrays(systems) -> SystemArrays:
+    if isinstance(systems, SystemArrays):
+        return systems
+    return SystemArrays.from_system_data(systems)
+
+
+def _check_field(field_path: str, start: float, end: float):
+    if field_path not in numeric_fields():
+        raise ValueError(f"{field_path} is not a floating point FinancialInputs field")
+    if not start < end:
+        raise ValueError("start must be less than end")
+
+
+def _lines(system_arrays: SystemArrays, financial_inputs: FinancialInputs, field_path):
+    """The intercept and slope of every system's LCOE as a function of field_path."""
+    gradients = lcoe_gradients(system_arrays, financial_inputs, [field_path])
+    slopes = gradients.gradients[:, 0]
+    value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+    return gradients.lcoe - slopes * value, slopes
+
+
+def _lcoes(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    value: float,
+) -> np.ndarray:
+    return offgrid_ai_batch.breakeven_lcoe(
+        system_arrays,
+        offgrid_ai.compile_financial_inputs(
+            financial_inputs, overrides={field_path: float(value)}
+        ),
+    )
+
+
+def _difference(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    i: int,
+    j: int,
+):
+    """Returns the function of the field value giving LCOE i - LCOE j."""
+    pair = system_arrays.subset([i, j])
+
+    def difference(value: float) -> float:
+        lcoes = _lcoes(pair, financial_inputs, field_path, value)
+        return float(lcoes[0] - lcoes[1])
+
+    return difference
+
+
+def _brent(function, a: float, b: float, fa: float, fb: float) -> float:
+    """Finds a root of function in [a, b], given fa and fb of opposite signs (or one
+    of them zero), by Brent's method: inverse quadratic interpolation or secant steps
+    when they make progress, bisection when they do not.
+    """
+    if fa == 0:
+        return float(a)
+    if fb == 0:
+        return float(b)
+    c, fc = a, fa
+    d = e = b - a
+    for _ in range(MAX_ITERATIONS):
+        if fb * fc > 0:
+            c, fc = a, fa
+            d = e = b - a
+        if abs(fc) < abs(fb):
+            a, b, c = b, c, b
+            fa, fb, fc = fb, fc, fb
+        tolerance = 2 * np.finfo(float).eps * abs(b)
+        middle = (c - b) / 2
+        if abs(middle) <= tolerance or fb == 0:
+            return float(b)
+        if abs(e) >= tolerance and abs(fa) > abs(fb):
+            s = fb / fa
+            if a == c:
+                p = 2 * middle * s
+                q = 1 - s
+            else:
+                q = fa / fc
+                r = fb / fc
+                p = s * (2 * middle * q * (q - r) - (b - a) * (r - 1))
+                q = (q - 1) * (r - 1) * (s - 1)
+            if p > 0:
+                q = -q
+            else:
+                p = -p
+            if 2 * p < min(3 * middle * q - abs(tolerance * q), abs(e * q)):
+                e, d = d, p / q
+            else:
+                d = e = middle
+        else:
+            d = e = middle
+        a, fa = b, fb
+        b += d if abs(d) > tolerance else np.copysign(tolerance, middle)
+        fb = function(b)
+    return float(b)
@@ -0,0 +1,290 @@
+import argparse
+from typing import NamedTuple
+
+import numpy as np
+
+from offgrid_ai import PROJECT_HORIZON_YEARS
+from offgrid_ai_batch import PRODUCTION_FIELDS, SystemArrays
+from offgrid_ai_pb2 import DataFile, NaturalGasType
+
+HOURS_PER_YEAR = 8760
+# Irradiance at which a module produces its rated power.
+STANDARD_IRRADIANCE_W_PER_M2 = 1000.0
+# The generator heat rate the workbook's turbine_vs_generator_fuel_consumption_ratio
+# is relative to, so generator_fuel_mmbtu is always for generators.
+GENERATOR_HEAT_RATE_MMBTU_PER_MWH = 8.9893
+
+# The workbook's grid of sizes at each location.
+SOLAR_CAPACITIES_MW = list(range(0, 501, 50))
+BESS_MAX_POWERS_MW = list(range(0, 401, 50))
+NATURAL_GAS_CAPACITIES_MW = [100, 125, 150]
+BESS_DURATION_HOURS = 4
+
+
+class DispatchParameters(NamedTuple):
+    bess_round_trip_efficiency: float = 0.87
+    # Annual fractional loss of BESS energy capacity and of solar output.
+    bess_degradation: float = 0.02
+    solar_degradation: float = 0.005
+    heat_rate_mmbtu_per_mwh: float = GENERATOR_HEAT_RATE_MMBTU_PER_MWH
+    num_years: int = PROJECT_HORIZON_YEARS
+
+
+def capacity_factors_from_irradiance(
+    irradiance_w_per_m2, performance_ratio: float = 0.8
+) -> np.ndarray:
+    """Converts hourly plane-of-array irradiance to the output per MW of solar
+    capacity, derated by the performance ratio and clipped at the rated power.
+    """
+    irradiance = np.asarray(irradiance_w_per_m2, dtype=float)
+    return np.clip(
+        irradiance / STANDARD_IRRADIANCE_W_PER_M2 * performance_ratio, 0.0, 1.0
+    )
+
+
+def dispatch(
+    solar_capacity_factors,
+    load_mw,
+    solar_capacities_mw,
+    bess_max_powers_mw,
+    bess_energy_capacities_mwh,
+    natural_gas_capacities_mw,
+    parameters: DispatchParameters = DispatchParameters(),
+) -> dict:
+    """Simulates every hour of every year for many candidate systems at once and
+    returns each of PRODUCTION_FIELDS as a (gas sizes, candidates, years) array.
+
+    solar_capacity_factors holds the output per MW of solar for each hour, either
+    one (8760,) series used for every year or a (years, 8760) series with its own
+    weather each year. load_mw is a constant or an (8760,) hourly profile. The
+    candidates are given by the aligned solar_capacities_mw, bess_max_powers_mw and
+    bess_energy_capacities_mwh arrays and each is simulated with every one of
+    natural_gas_capacities_mw.
+
+    Each hour solar serves the load first, the surplus charges the BESS (with all of
+    the round trip losses taken on charging) up to its power and remaining energy
+    capacity and the rest is curtailed. A deficit is met by discharging the BESS,
+    then by gas up to its capacity; anything left is unserved. Every year starts
+    with an empty BESS, whose energy capacity fades by bess_degradation a year, and
+    solar output fades by solar_degradation a year.
+
+    The fields are filled as follows: solar_output_raw_mwh is all solar produced and
+    solar_output_net_mwh the part of it used, directly or to charge the BESS;
+    bess_throughput_mwh is the energy charged and bess_net_output_mwh that
+    discharged; generator_output_mwh is the gas output, burning
+    heat_rate_mmbtu_per_mwh; load_served_mwh is the load less the unserved energy.
+    """
+    capacity_factors = _yearly_series(
+        solar_capacity_factors, parameters.num_years, "solar_capacity_factors"
+    )
+    loads = np.broadcast_to(np.asarray(load_mw, dtype=float), (HOURS_PER_YEAR,))
+    solar_capacities, bess_powers, bess_energies = np.broadcast_arrays(
+        *(
+            np.asarray(values, dtype=float)
+            for values in (
+                solar_capacities_mw,
+                bess_max_powers_mw,
+                bess_energy_capacities_mwh,
+            )
+        )
+    )
+    gas_capacities = np.asarray(natural_gas_capacities_mw, dtype=float)
+    if solar_capacities.ndim != 1 or gas_capacities.ndim != 1:
+        raise ValueError("Candidate sizes must be one dimensional")
+    if not 0 < parameters.bess_round_trip_efficiency <= 1:
+        raise ValueError("bess_round_trip_efficiency must be in (0, 1]")
+
+    # State and totals are (candidates, years), with the hourly capacity factors of
+    # every year in the last axis of capacity_factors.
+    age = np.arange(parameters.num_years)
+    solar_scale = solar_capacities[:, None] * (1 - parameters.solar_degradation) ** age
+    energy_capacity = bess_energies[:, None] * (1 - parameters.bess_degradation) ** age
+    power = bess_powers[:, None]
+    efficiency = parameters.bess_round_trip_efficiency
+    shape = solar_scale.shape
+    state_of_charge = np.zeros(shape)
+    direct_total = np.zeros(shape)
+    charged_total = np.zeros(shape)
+    discharged_total = np.zeros(shape)
+    gas_total = np.zeros((len(gas_capacities),) + shape)
+    gas_limits = gas_capacities[:, None, None]
+    solar = np.empty(shape)
+    surplus = np.empty(shape)
+    deficit = np.empty(shape)
+    flow = np.empty(shape)
+    for hour in range(HOURS_PER_YEAR):
+        load = loads[hour]
+        np.multiply(solar_scale, capacity_factors[:, hour], out=solar)
+        np.subtract(solar, load, out=surplus)
+        np.negative(surplus, out=deficit)
+        np.maximum(surplus, 0.0, out=surplus)
+        np.maximum(deficit, 0.0, out=deficit)
+        direct_total += solar
+        direct_total -= surplus
+        # Charge from the surplus; a surplus and a deficit never share an hour.
+        np.subtract(energy_capacity, state_of_charge, out=flow)
+        flow /= efficiency
+        np.minimum(flow, surplus, out=flow)
+        np.minimum(flow, power, out=flow)
+        charged_total += flow
+        flow *= efficiency
+        state_of_charge += flow
+        # Discharge into the deficit and cover the rest with gas.
+        np.minimum(state_of_charge, deficit, out=flow)
+        np.minimum(flow, power, out=flow)
+        state_of_charge -= flow
+        discharged_total += flow
+        deficit -= flow
+        gas_total += np.minimum(deficit, gas_limits)
+
+    solar_output_raw = solar_scale * capacity_factors.sum(axis=1)
+    total_load = loads.sum()
+    num_gas = len(gas_capacities)
+    production = {
+        "solar_output_raw_mwh": solar_output_raw,
+        # Clipped as the hourly sums can round above the closed form raw output.
+        "solar_output_net_mwh": np.minimum(
+            direct_total + charged_total, solar_output_raw
+        ),
+        "bess_throughput_mwh": charged_total,
+        "bess_net_output_mwh": discharged_total,
+    }
+    production = {
+        field: np.broadcast_to(values, (num_gas,) + shape).copy()
+        for field, values in production.items()
+    }
+    production["generator_output_mwh"] = gas_total
+    production["generator_fuel_mmbtu"] = gas_total * parameters.heat_rate_mmbtu_per_mwh
+    unserved = total_load - direct_total - discharged_total - gas_total
+    production["load_served_mwh"] = total_load - np.maximum(unserved, 0.0)
+    return production
+
+
+def simulate_location(
+    location: str,
+    solar_capacity_factors,
+    load_mw,
+    solar_capacities_mw=SOLAR_CAPACITIES_MW,
+    bess_max_powers_mw=BESS_MAX_POWERS_MW,
+    natural_gas_capacities_mw=NATURAL_GAS_CAPACITIES_MW,
+    bess_duration_hours: float = BESS_DURATION_HOURS,
+    nat_gas_type: int = NaturalGasType.GENERATOR,
+    parameters: DispatchParameters = DispatchParameters(),
+) -> SystemArrays:
+    """Simulates every combination of the solar, BESS and gas sizes at one location
+    and returns them as SystemArrays ordered by gas size, then solar, then BESS, as
+    in the workbook's data sheet. The spec's load_mw is the peak of the load.
+    """
+    solar, bess = np.meshgrid(
+        np.asarray(solar_capacities_mw, dtype=float),
+        np.asarray(bess_max_powers_mw, dtype=float),
+        indexing="ij",
+    )
+    solar, bess = solar.ravel(), bess.ravel()
+    gas_capacities = np.asarray(natural_gas_capacities_mw, dtype=float)
+    production = dispatch(
+        solar_capacity_factors,
+        load_mw,
+        solar,
+        bess,
+        bess * bess_duration_hours,
+        gas_capacities,
+        parameters,
+    )
+    num_gas, num_candidates = len(gas_capacities), len(solar)
+    num_systems = num_gas * num_candidates
+    columns = {
+        "load_mw": np.full(num_systems, float(np.max(load_mw))),
+        "solar_capacity_mw": np.tile(solar, num_gas),
+        "bess_max_power_mw": np.tile(bess, num_gas),
+        "bess_energy_capacity_mwh": np.tile(bess * bess_duration_hours, num_gas),
+        "natural_gas_capacity_mw": np.repeat(gas_capacities, num_candidates),
+    }
+    for field in PRODUCTION_FIELDS:
+        columns[field] = production[field].reshape(num_systems, parameters.num_years)
+    years = np.arange(1, parameters.num_years + 1, dtype=np.int32)
+    return SystemArrays(
+        np.full(num_systems, location),
+        np.full(num_systems, nat_gas_type, dtype=np.int32),
+        np.tile(years, (num_systems, 1)),
+        **columns,
+    )
+
+
+def to_data_file(system_arrays: SystemArrays, data_file: DataFile = None) -> DataFile:
+    """Appends every system to data_file (a new one by default) and returns it."""
+    if data_file is None:
+        data_file = DataFile()
+    for index in range(len(system_arrays)):
+        data_file.system_data.append(system_arrays.to_system_data(index))
+    return data_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulates hourly dispatch over the workbook's grid of system "
+        "sizes for each location and writes the production as a DataFile."
+    )
+    parser.add_argument(
+        "solar",
+        nargs="+",
+        help="LOCATION=FILE pairs, each file holding 8760 hourly solar capacity "
+        "factors (or irradiance with --irradiance), one per line",
+    )
+    parser.add_argument("--output", required=True, help="DataFile to write")
+    parser.add_argument(
+        "--load_mw", type=float, default=100.0, help="Constant load in MW"
+    )
+    parser.add_argument(
+        "--load_profile", help="File of 8760 hourly loads in MW, overrides --load_mw"
+    )
+    parser.add_argument("--irradiance", action="store_true")
+    parser.add_argument(
+        "--bess_duration_hours", type=float, default=BESS_DURATION_HOURS
+    )
+    parser.add_argument(
+        "--nat_gas_type",
+        choices=NaturalGasType.keys(),
+        default="GENERATOR",
+    )
+    args = parser.parse_args()
+
+    load_mw = args.load_mw
+    if args.load_profile:
+        load_mw = np.loadtxt(args.load_profile)
+    data_file = DataFile()
+    for location_file in args.solar:
+        location, _, path = location_file.rpartition("=")
+        if not location:
+            raise ValueError(f"Expected LOCATION=FILE, got {location_file}")
+        solar = np.loadtxt(path)
+        if args.irradiance:
+            solar = capacity_factors_from_irradiance(solar)
+        system_arrays = simulate_location(
+            location,
+            solar,
+            load_mw,
+            bess_duration_hours=args.bess_duration_hours,
+            nat_gas_type=NaturalGasType.Value(args.nat_gas_type),
+        )
+        to_data_file(system_arrays, data_file)
+    with open(args.output, "wb") as f:
+        f.write(data_file.SerializeToString())
+    print(f"Wrote {len(data_file.system_data)} systems to {args.output}")
+
+
+def _yearly_series(series, num_years: int, name: str) -> np.ndarray:
+    """Returns an hourly series as a (years, 8760) array."""
+    series = np.asarray(series, dtype=float)
+    if series.shape == (HOURS_PER_YEAR,):
+        return np.broadcast_to(series, (num_years, HOURS_PER_YEAR))
+    if series.shape != (num_years, HOURS_PER_YEAR):
+        raise ValueError(
+            f"{name} must have shape ({HOURS_PER_YEAR},) or "
+            f"({num_years}, {HOURS_PER_YEAR}), got {series.shape}"
+        )
+    return series
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+from offgrid_ai_price_coefficients import (
+    PRICE_FIELDS,
+    compute_price_coefficients,
+    price_vector,
+)
+
+# LCOEs within this relative tolerance of each other are treated as equal.
+RELATIVE_TOLERANCE = 1e-9
+
+
+class EnvelopeSegment(NamedTuple):
+    """A price interval over which one system has the lowest LCOE."""
+
+    system_index: int
+    start: float
+    end: float
+
+
+class EnvelopeRegion(NamedTuple):
+    """A convex polygon of (x, y) prices over which one system has the lowest LCOE."""
+
+    system_index: int
+    vertices: list
+    area: float
+
+
+def lower_envelope(intercepts, slopes, start: float, end: float) -> list:
+    """Computes the lower envelope of the lines intercepts[i] + slopes[i] * x over
+    [start, end], returned as the segments in increasing x order. Ties go to the line
+    which stays lowest to the right, then to the lowest index.
+    """
+    intercepts = np.asarray(intercepts, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    segments = []
+    x = start
+    current = _lowest_line(intercepts, slopes, x)
+    while True:
+        # Only lines with a lower slope can overtake the current one to the right.
+        overtaking = np.flatnonzero(slopes < slopes[current])
+        crossings = (intercepts[overtaking] - intercepts[current]) / (
+            slopes[current] - slopes[overtaking]
+        )
+        crossings = crossings[crossings > x]
+        next_x = crossings.min() if len(crossings) else end
+        if next_x >= end:
+            segments.append(EnvelopeSegment(int(current), x, end))
+            return segments
+        segments.append(EnvelopeSegment(int(current), x, float(next_x)))
+        x = float(next_x)
+        current = _lowest_line(intercepts, slopes, x)
+
+
+def lower_envelope_regions(intercepts, x_slopes, y_slopes, x_range, y_range) -> list:
+    """Computes the lower envelope of the planes
+    intercepts[i] + x_slopes[i] * x + y_slopes[i] * y over the rectangle
+    x_range x y_range, returned as one convex region per plane which is lowest
+    somewhere in the rectangle, ordered by index. Ties go to the lowest index.
+    """
+    intercepts = np.asarray(intercepts, dtype=float)
+    x_slopes = np.asarray(x_slopes, dtype=float)
+    y_slopes = np.asarray(y_slopes, dtype=float)
+    (x_start, x_end), (y_start, y_end) = x_range, y_range
+    rectangle = [(x_start, y_start), (x_end, y_start), (x_end, y_end), (x_start, y_end)]
+    corners_x = np.array([x for x, _ in rectangle])
+    corners_y = np.array([y for _, y in rectangle])
+    corner_values = (
+        intercepts[:, None]
+        + x_slopes[:, None] * corners_x[None, :]
+        + y_slopes[:, None] * corners_y[None, :]
+    )
+    tolerance = RELATIVE_TOLERANCE * max(1.0, np.abs(corner_values).max())
+    min_area = RELATIVE_TOLERANCE * (x_end - x_start) * (y_end - y_start)
+
+    regions = []
+    for i in range(len(intercepts)):
+        # Plane i is lowest where (plane i - plane j) <= 0 for every other plane j.
+        # Differences are linear, so their values at the corners bound them over the
+        # whole rectangle.
+        differences = corner_values[i] - corner_values
+        differences[i] = -np.inf
+        if (differences.min(axis=1) > tolerance).any():
+            continue
+        identical = (np.abs(differences).max(axis=1) <= tolerance).nonzero()[0]
+        if len(identical) and identical[0] < i:
+            continue
+        cutting = np.flatnonzero(differences.max(axis=1) > 0)
+        polygon = rectangle
+        for j in cutting:
+            if j in identical:
+                continue
+            polygon = _clip(
+                polygon,
+                x_slopes[i] - x_slopes[j],
+                y_slopes[i] - y_slopes[j],
+                intercepts[j] - intercepts[i],
+            )
+            if not polygon:
+                break
+        area = _area(polygon)
+        if area > min_area:
+            regions.append(EnvelopeRegion(i, polygon, area))
+    return regions
+
+
+def lowest_lcoe_breakpoints(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    field_path: str,
+    start: float,
+    end: float,
+) -> list:
+    """Returns the exact intervals of the price field_path over [start, end] in which
+    each system has the lowest LCOE, with every other input taken from
+    financial_inputs. Segment boundaries are the prices at which the lowest LCOE
+    system changes.
+    """
+    intercepts, (slopes,) = _price_planes(system_arrays, financial_inputs, [field_path])
+    return lower_envelope(intercepts, slopes, start, end)
+
+
+def lowest_lcoe_regions(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    x_field_path: str,
+    x_range,
+    y_field_path: str,
+    y_range,
+) -> list:
+    """Returns the exact polygons of the (x_field_path, y_field_path) price rectangle
+    in which each system has the lowest LCOE, with every other input taken from
+    financial_inputs.
+    """
+    intercepts, (x_slopes, y_slopes) = _price_planes(
+        system_arrays, financial_inputs, [x_field_path, y_field_path]
+    )
+    return lower_envelope_regions(intercepts, x_slopes, y_slopes, x_range, y_range)
+
+
+def _price_planes(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, field_paths
+):
+    """Splits every system's LCOE into the part which is constant in the given price
+    fields and the slope with respect to each of them.
+    """
+    for field_path in field_paths:
+        if field_path not in PRICE_FIELDS:
+            raise ValueError(f"The LCOE is not linear in {field_path}")
+    coefficients = compute_price_coefficients(
+        system_arrays, financial_inputs
+    ).coefficients
+    columns = [PRICE_FIELDS.index(field_path) for field_path in field_paths]
+    prices = price_vector(financial_inputs)
+    prices[columns] = 0
+    return coefficients @ prices, [coefficients[:, column] for column in columns]
+
+
+def _lowest_line(intercepts: np.ndarray, slopes: np.ndarray, x: float) -> int:
+    values = intercepts + slopes * x
+    lowest_value = values.min()
+    tied = np.flatnonzero(
+        values <= lowest_value + RELATIVE_TOLERANCE * max(1.0, abs(lowest_value))
+    )
+    return tied[np.argmin(slopes[tied])]
+
+
+def _clip(polygon: list, a: float, b: float, c: float) -> list:
+    """Clips a convex polygon to the half-plane a * x + b * y <= c."""
+    clipped = []
+    for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+        side1 = a * x1 + b * y1 - c
+        side2 = a * x2 + b * y2 - c
+        if side1 <= 0:
+            clipped.append((x1, y1))
+        if (side1 < 0 < side2) or (side2 < 0 < side1):
+            t = side1 / (side1 - side2)
+            clipped.append((x1 + t * (x2 - x1), y1 + t * (y2 - y1)))
+    return clipped
+
+
+def _area(polygon: list) -> float:
+    if len(polygon) < 3:
+        return 0.0
+    return 0.5 * abs(
+        sum(
+            x1 * y2 - x2 * y1
+            for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1])
+        )
+    )
@@ -0,0 +1,118 @@
+from typing import NamedTuple
+
+import numpy as np
+from google.protobuf.descriptor import FieldDescriptor
+
+import offgrid_ai
+import offgrid_ai_batch
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+
+# The imaginary step used for complex-step differentiation. There is no subtraction,
+# so unlike finite differences the step can be tiny and the derivatives are accurate
+# to machine precision.
+COMPLEX_STEP = 1e-30
+
+
+class LcoeGradients(NamedTuple):
+    # The breakeven LCOE of every system.
+    lcoe: np.ndarray
+    field_paths: list
+    # (systems, fields) array of the derivatives of the LCOE with respect to each
+    # field, in $/MWh per unit of the field.
+    gradients: np.ndarray
+
+
+class TornadoBar(NamedTuple):
+    field_path: str
+    value: float
+    # The LCOE with the field decreased and increased by the relative change.
+    low_lcoe: float
+    high_lcoe: float
+    swing: float
+
+
+def numeric_fields(message_descriptor=FinancialInputs.DESCRIPTOR, prefix="") -> list:
+    """Returns the dotted paths of every floating point field of FinancialInputs,
+    including those of its sub-messages. The integer fields debt_term and
+    construction_time are left out as the LCOE is only defined for whole years.
+    """
+    field_paths = []
+    for field in message_descriptor.fields:
+        if field.type == FieldDescriptor.TYPE_MESSAGE:
+            field_paths += numeric_fields(field.message_type, prefix + field.name + ".")
+        elif field.type in (FieldDescriptor.TYPE_DOUBLE, FieldDescriptor.TYPE_FLOAT):
+            field_paths.append(prefix + field.name)
+    return field_paths
+
+
+def lcoe_gradients(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs, field_paths=None
+) -> LcoeGradients:
+    """Computes the derivatives of the breakeven LCOE of every system with respect to
+    every field in field_paths (by default, all of numeric_fields()).
+
+    Each derivative is the imaginary part of the LCOE with a tiny imaginary step added
+    to the field, which the batch engine carries through unchanged, so one batch
+    evaluation over all systems gives the exact derivative with respect to one field.
+    """
+    if field_paths is None:
+        field_paths = numeric_fields()
+    lcoe = offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+    gradients = np.empty((len(system_arrays), len(field_paths)))
+    for column, field_path in enumerate(field_paths):
+        value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+        stepped_inputs = offgrid_ai.compile_financial_inputs(
+            financial_inputs, overrides={field_path: value + COMPLEX_STEP * 1j}
+        )
+        stepped_lcoe = offgrid_ai_batch.breakeven_lcoe(system_arrays, stepped_inputs)
+        gradients[:, column] = np.imag(stepped_lcoe) / COMPLEX_STEP
+    return LcoeGradients(lcoe, list(field_paths), gradients)
+
+
+def tornado(
+    gradients: LcoeGradients,
+    financial_inputs: FinancialInputs,
+    relative_change: float = 0.1,
+    system_index: int = 0,
+) -> list:
+    """Returns a TornadoBar for every field, largest swing first, giving the LCOE of
+    one system with the field decreased and increased by relative_change (e.g. 0.1
+    for +/-10%). The LCOEs are first order estimates from the gradients: exact for
+    prices, in which the LCOE is linear, and close for small changes in the rest.
+    """
+    lcoe = gradients.lcoe[system_index]
+    bars = []
+    for field_path, gradient in zip(
+        gradients.field_paths, gradients.gradients[system_index]
+    ):
+        value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+        change = gradient * value * relative_change
+        bars.append(
+            TornadoBar(
+                field_path=field_path,
+                value=value,
+                low_lcoe=float(lcoe - change),
+                high_lcoe=float(lcoe + change),
+                swing=float(abs(2 * change)),
+            )
+        )
+    bars.sort(key=lambda bar: bar.swing, reverse=True)
+    return bars
+
+
+def format_tornado(bars: list, limit: int = None) -> str:
+    """Formats TornadoBars as a text table, skipping fields which do not move the
+    LCOE.
+    """
+    lines = [
+        f"{'field':<80}{'value':>12}{'low LCOE':>12}{'high LCOE':>12}{'swing':>10}"
+    ]
+    for bar in bars[:limit]:
+        if bar.swing == 0:
+            continue
+        lines.append(
+            f"{bar.field_path:<80}{bar.value:>12.6g}{bar.low_lcoe:>12.4f}"
+            f"{bar.high_lcoe:>12.4f}{bar.swing:>10.4f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,303 @@
+from typing import NamedTuple
+
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+from offgrid_ai import CompiledFinancialInputs, compile_financial_inputs
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+
+# The compiled fields every NPV reads through the discount factors.
+_DISCOUNTING = ("cost_of_equity", "construction_time", "discount_factors")
+
+
+class Node(NamedTuple):
+    """An intermediate quantity of the LCOE, computed for every system."""
+
+    name: str
+    # The CompiledFinancialInputs fields the node reads itself.
+    fields: tuple
+    # The nodes whose values it is computed from.
+    dependencies: tuple
+    # function(system_arrays, compiled_financial_inputs, *dependency_values).
+    function: object
+
+
+# The LCOE dependency graph, in topological order. Most nodes are computed with the
+# offgrid_ai_batch function of the same name from the cached values of the nodes they
+# depend on, so the LCOEs match offgrid_ai_batch.breakeven_lcoe to rounding error.
+NODES = [
+    Node(
+        "hard_capex",
+        (
+            "solar_capex_per_watt",
+            "bess_capex_per_kwh",
+            "generator_capex_per_kw",
+            "gas_turbine_capex_per_kw",
+            "system_integration_capex_per_kw",
+        ),
+        (),
+        offgrid_ai_batch.hard_capex,
+    ),
+    Node(
+        "total_capex",
+        ("soft_cost_multiplier",),
+        ("hard_capex",),
+        offgrid_ai_batch.total_capex,
+    ),
+    Node(
+        "federal_itc_applicable_spend",
+        (
+            "solar_itc_applicable_per_watt",
+            "bess_itc_applicable_per_kwh",
+            "generator_itc_applicable_per_kw",
+            "gas_turbine_itc_applicable_per_kw",
+            "system_integration_itc_applicable_per_kw",
+            "soft_cost_multiplier",
+        ),
+        (),
+        offgrid_ai_batch.federal_itc_applicable_spend,
+    ),
+    Node(
+        "federal_itc",
+        ("investment_tax_credit",),
+        ("federal_itc_applicable_spend",),
+        offgrid_ai_batch.federal_itc,
+    ),
+    Node(
+        "federal_itc_npv",
+        _DISCOUNTING,
+        ("federal_itc",),
+        offgrid_ai_batch.federal_itc_npv,
+    ),
+    Node(
+        "production_npv",
+        _DISCOUNTING + ("lcoe_escalation", "lcoe_escalator"),
+        (),
+        offgrid_ai_batch.production_npv,
+    ),
+    # The fuel cost NPV at $1/MMBtu, so that a fuel price change costs one product
+    # per system rather than a pass over the production years.
+    Node(
+        "unit_fuel_cost_npv",
+        _DISCOUNTING
+        + (
+            "fuel_escalation",
+            "fuel_escalator",
+            "turbine_vs_generator_fuel_consumption_ratio",
+        ),
+        (),
+        lambda system_arrays, financial_inputs: offgrid_ai_batch.fuel_cost_npv(
+            system_arrays,
+            financial_inputs._replace(fuel_price_mmbtu=1.0, source=None),
+        ),
+    ),
+    Node(
+        "fuel_cost_npv",
+        ("fuel_price_mmbtu",),
+        ("unit_fuel_cost_npv",),
+        lambda system_arrays, financial_inputs, unit_fuel_cost_npv: (
+            unit_fuel_cost_npv * financial_inputs.fuel_price_mmbtu
+        ),
+    ),
+    Node(
+        "fixed_om_npv",
+        _DISCOUNTING
+        + (
+            "om_escalation",
+            "om_escalator",
+            "solar_fixed_om_kw",
+            "bess_fixed_om_kw",
+            "generators_fixed_om_kw",
+            "gas_turbines_fixed_om_kw",
+            "bos_fixed_om_kw",
+            "soft_costs",
+        ),
+        ("hard_capex",),
+        offgrid_ai_batch.fixed_om_npv,
+    ),
+    Node(
+        "variable_om_npv",
+        _DISCOUNTING
+        + (
+            "om_escalation",
+            "om_escalator",
+            "generators_variable_om_kwh",
+            "gas_turbines_variable_om_kwh",
+        ),
+        (),
+        offgrid_ai_batch.variable_om_npv,
+    ),
+    Node(
+        "debt_service_npv",
+        _DISCOUNTING + ("leverage", "debt_term", "debt_annuity_factor"),
+        ("total_capex",),
+        offgrid_ai_batch.debt_service_npv,
+    ),
+    Node(
+        "depreciation_npv",
+        _DISCOUNTING + ("depreciation_schedule",),
+        ("total_capex", "federal_itc"),
+        offgrid_ai_batch.depreciation_npv,
+    ),
+    Node(
+        "interest_expense_npv",
+        _DISCOUNTING + ("leverage", "interest_fractions"),
+        ("total_capex",),
+        offgrid_ai_batch.interest_expense_npv,
+    ),
+    Node(
+        "equity_capex_npv",
+        _DISCOUNTING + ("leverage",),
+        ("total_capex",),
+        offgrid_ai_batch.equity_capex_npv,
+    ),
+    Node(
+        "lcoe",
+        ("combined_tax_rate",),
+        (
+            "production_npv",
+            "fuel_cost_npv",
+            "fixed_om_npv",
+            "variable_om_npv",
+            "debt_service_npv",
+            "depreciation_npv",
+            "interest_expense_npv",
+            "federal_itc_npv",
+            "equity_capex_npv",
+        ),
+        lambda system_arrays, financial_inputs, *npvs: _breakeven_lcoe(
+            financial_inputs, *npvs
+        ),
+    ),
+]
+
+
+class IncrementalEvaluator:
+    """Keeps every intermediate of the breakeven LCOE of a set of systems and, when
+    the financial inputs change, recomputes only the nodes of NODES which read a
+    changed field and those downstream of them. Changing fuel_price_mmbtu, for
+    example, recomputes fuel_cost_npv and the LCOE, and reuses the capex, ITC,
+    depreciation, debt, O&M and production NPVs.
+
+    The changed fields are found by compiling the new inputs and comparing them with
+    the old, so an edit to any FinancialInputs field, including those compiled into
+    sums such as the capex rates, dirties exactly the nodes which depend on it.
+    """
+
+    def __init__(
+        self, system_arrays: SystemArrays, financial_inputs: FinancialInputs
+    ):
+        self.system_arrays = system_arrays
+        self.financial_inputs = FinancialInputs()
+        self.financial_inputs.CopyFrom(financial_inputs)
+        self._compiled = compile_financial_inputs(self.financial_inputs)
+        self._values = {}
+        # The names of the nodes computed by the last evaluation.
+        self.recomputed = self._recompute(set(CompiledFinancialInputs._fields))
+
+    @property
+    def lcoe(self) -> np.ndarray:
+        """The breakeven LCOE of every system under the current inputs."""
+        return self._values["lcoe"]
+
+    def value(self, name: str) -> np.ndarray:
+        """Returns the current value of a node for every system."""
+        if name not in self._values:
+            raise ValueError(f"Unknown node: {name}")
+        return self._values[name]
+
+    def set(self, field_path: str, value) -> np.ndarray:
+        """Changes one field of the financial inputs and returns the new LCOEs."""
+        financial_inputs = FinancialInputs()
+        financial_inputs.CopyFrom(self.financial_inputs)
+        offgrid_ai.set_financial_input(financial_inputs, field_path, value)
+        return self.update(financial_inputs)
+
+    def update(self, financial_inputs: FinancialInputs) -> np.ndarray:
+        """Replaces the financial inputs, which may differ in any number of fields,
+        and returns the new LCOEs.
+        """
+        compiled = compile_financial_inputs(financial_inputs)
+        changed = _changed_fields(self._compiled, compiled)
+        self.financial_inputs = FinancialInputs()
+        self.financial_inputs.CopyFrom(financial_inputs)
+        self._compiled = compiled
+        self.recomputed = self._recompute(changed)
+        return self.lcoe
+
+    def _recompute(self, changed_fields: set) -> list:
+        dirty = _dirty_nodes(changed_fields)
+        for node in dirty:
+            dependency_values = [self._values[name] for name in node.dependencies]
+            self._values[node.name] = node.function(
+                self.system_arrays, self._compiled, *dependency_values
+            )
+        return [node.name for node in dirty]
+
+
+def dependent_nodes(field_path: str, financial_inputs: FinancialInputs) -> list:
+    """Returns the names of the nodes which a change to field_path dirties, found by
+    perturbing the field in a copy of financial_inputs.
+    """
+    value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+    perturbed = compile_financial_inputs(
+        financial_inputs, overrides={field_path: value + 1}
+    )
+    compiled = compile_financial_inputs(financial_inputs)
+    return [node.name for node in _dirty_nodes(_changed_fields(compiled, perturbed))]
+
+
+def _changed_fields(
+    old: CompiledFinancialInputs, new: CompiledFinancialInputs
+) -> set:
+    return {
+        field
+        for field in CompiledFinancialInputs._fields
+        if getattr(old, field) != getattr(new, field)
+    }
+
+
+def _dirty_nodes(changed_fields: set) -> list:
+    """The nodes which read a changed field or depend on such a node, in NODES
+    order.
+    """
+    dirty = []
+    dirty_names = set()
+    for node in NODES:
+        if changed_fields.intersection(node.fields) or dirty_names.intersection(
+            node.dependencies
+        ):
+            dirty.append(node)
+            dirty_names.add(node.name)
+    return dirty
+
+
+def _breakeven_lcoe(
+    financial_inputs: CompiledFinancialInputs,
+    production_npv,
+    fuel_cost_npv,
+    fixed_om_npv,
+    variable_om_npv,
+    debt_service_npv,
+    depreciation_npv,
+    interest_expense_npv,
+    federal_itc_npv,
+    equity_capex_npv,
+) -> np.ndarray:
+    """offgrid_ai_batch.breakeven_lcoe from its component NPVs, in the same order of
+    operations.
+    """
+    combined_tax_rate = financial_inputs.combined_tax_rate
+    ebitda_npv = (
+        np.multiply(0, production_npv) + fuel_cost_npv + fixed_om_npv + variable_om_npv
+    )
+    tax_benefit_npv = (
+        -combined_tax_rate * (ebitda_npv + depreciation_npv + interest_expense_npv)
+        + federal_itc_npv
+    )
+    after_tax_equity_npv = (
+        ebitda_npv + debt_service_npv + tax_benefit_npv + equity_capex_npv
+    )
+    return -after_tax_equity_npv / (production_npv * (1 - combined_tax_rate))
@@ -0,0 +1,139 @@
+from bisect import bisect_left, bisect_right
+
+from offgrid_ai_pb2 import DataFile, SystemData
+
+KEY_FIELDS = [
+    "location",
+    "nat_gas_type",
+    "natural_gas_capacity_mw",
+    "solar_capacity_mw",
+    "bess_max_power_mw",
+    "bess_energy_capacity_mwh",
+]
+# Key field combinations used by the parameter sensitivity helpers, indexed up front.
+EAGER_KEYS = [
+    ("location", "natural_gas_capacity_mw"),
+    ("location", "natural_gas_capacity_mw", "solar_capacity_mw", "bess_max_power_mw"),
+]
+RANGE_FIELDS = [
+    "load_mw",
+    "natural_gas_capacity_mw",
+    "solar_capacity_mw",
+    "bess_max_power_mw",
+    "bess_energy_capacity_mwh",
+]
+
+
+class SpecIndex:
+    """Index over the SystemSpec of every system in a DataFile, built once at load
+    time. Exact lookups on the key fields compare sizes rounded to the nearest MW/MWh,
+    as the rest of the code does, and cost O(matches) rather than a scan of the whole
+    dataset.
+    """
+
+    def __init__(self, data_file):
+        if isinstance(data_file, DataFile):
+            data_file = data_file.system_data
+        self.systems = list(data_file)
+        self._positions = {}
+        for fields in EAGER_KEYS:
+            self._positions_by(fields)
+        self._sorted = {}
+        for field in RANGE_FIELDS:
+            values = sorted(
+                (getattr(system_data.spec, field), position)
+                for position, system_data in enumerate(self.systems)
+            )
+            self._sorted[field] = (
+                [value for value, _ in values],
+                [position for _, position in values],
+            )
+
+    def __len__(self) -> int:
+        return len(self.systems)
+
+    def lookup(self, **key) -> list:
+        """Returns the systems, in data file order, whose spec matches every given key
+        field, e.g. lookup(location="El Paso, TX", natural_gas_capacity_mw=125).
+        """
+        return [self._system(position) for position in self._lookup_positions(key)]
+
+    def positions(self, **key) -> list:
+        """Returns the positions in the data file of the systems lookup would return."""
+        # A copy, as the index's own lists are reused by later lookups.
+        return list(self._lookup_positions(key))
+
+    def get(self, **key) -> SystemData:
+        """Returns the single system matching the key fields."""
+        systems = self.lookup(**key)
+        if not systems:
+            raise ValueError(f"No system matches {key}")
+        if len(systems) > 1:
+            raise ValueError(f"Multiple matching systems for {key}")
+        return systems[0]
+
+    def range_query(self, field: str, low=None, high=None, **key) -> list:
+        """Returns the systems, in data file order, with low <= spec.field <= high that
+        also match any exact key fields. Either bound may be omitted.
+        """
+        if field not in self._sorted:
+            raise ValueError(f"Range queries are not supported on {field}")
+        values, positions = self._sorted[field]
+        start = 0 if low is None else bisect_left(values, low)
+        end = len(values) if high is None else bisect_right(values, high)
+        in_range = positions[start:end]
+        if key:
+            matching = set(self._lookup_positions(key))
+            in_range = [position for position in in_range if position in matching]
+        return [self._system(position) for position in sorted(in_range)]
+
+    def group_by(self, *fields):
+        """Iterates over (key, systems) for every distinct combination of the given key
+        fields, in order of first appearance in the data file.
+        """
+        for key, positions in self._positions_by(fields).items():
+            yield key, [self._system(position) for position in positions]
+
+    def _system(self, position: int) -> SystemData:
+        return self.systems[position]
+
+    def _lookup_positions(self, key) -> list:
+        if not key:
+            return list(range(len(self.systems)))
+        fields = tuple(sorted(key, key=_field_order))
+        value = tuple(
+            key[field] if field in ("location", "nat_gas_type") else round(key[field])
+            for field in fields
+        )
+        return self._positions_by(fields).get(value, [])
+
+    def _positions_by(self, fields) -> dict:
+        """Returns a dict from key values to system positions for a combination of key
+        fields. Each combination is indexed on first use and reused afterwards.
+        """
+        for field in fields:
+            _check_key_field(field)
+        if fields not in self._positions:
+            positions = {}
+            for position, system_data in enumerate(self.systems):
+                key = tuple(_key_value(system_data, field) for field in fields)
+                positions.setdefault(key, []).append(position)
+            self._positions[fields] = positions
+        return self._positions[fields]
+
+
+def _field_order(field: str) -> int:
+    _check_key_field(field)
+    return KEY_FIELDS.index(field)
+
+
+def _check_key_field(field: str):
+    if field not in KEY_FIELDS:
+        raise ValueError(f"{field} is not an indexed SystemSpec field")
+
+
+def _key_value(system_data: SystemData, field: str):
+    value = getattr(system_data.spec, field)
+    if field in ("location", "nat_gas_type"):
+        return value
+    return round(value)
@@ -0,0 +1,351 @@
+import math
+from itertools import islice
+
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+import offgrid_ai_parallel
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+from offgrid_ai_price_coefficients import (
+    PRICE_FIELDS,
+    compute_price_coefficients,
+    price_vector,
+)
+
+DEFAULT_NUM_BINS = 1024
+# Upper bound on the number of LCOEs (samples x systems) held in memory at once.
+DEFAULT_CHUNK_ELEMENTS = 1 << 22
+
+
+class Normal:
+    def __init__(self, mean: float, std: float):
+        self.mean = mean
+        self.std = std
+
+    def from_standard_normal(self, z: np.ndarray) -> np.ndarray:
+        return self.mean + self.std * z
+
+
+class Triangular:
+    def __init__(self, low: float, mode: float, high: float):
+        if not low <= mode <= high or low == high:
+            raise ValueError("Triangular distribution needs low <= mode <= high")
+        self.low = low
+        self.mode = mode
+        self.high = high
+
+    def from_standard_normal(self, z: np.ndarray) -> np.ndarray:
+        u = _standard_normal_cdf(z)
+        width = self.high - self.low
+        split = (self.mode - self.low) / width
+        return np.where(
+            u < split,
+            self.low + np.sqrt(u * width * (self.mode - self.low)),
+            self.high - np.sqrt((1 - u) * width * (self.high - self.mode)),
+        )
+
+
+class Empirical:
+    """Resamples from observed values, e.g. historical fuel prices."""
+
+    def __init__(self, values):
+        self.values = np.sort(np.asarray(values, dtype=float))
+        if len(self.values) == 0:
+            raise ValueError("Empirical distribution needs at least one value")
+
+    def from_standard_normal(self, z: np.ndarray) -> np.ndarray:
+        u = _standard_normal_cdf(z)
+        indices = np.minimum((u * len(self.values)).astype(int), len(self.values) - 1)
+        return self.values[indices]
+
+
+class HistogramSketch:
+    """Streaming quantile sketch for many series at once, in fixed memory: a histogram
+    of num_bins equal bins per series. A series' range starts at the spread of its
+    first values and doubles, merging pairs of bins, whenever a value falls outside
+    it, so quantiles are within one bin width (the series' range / num_bins) of the
+    exact sample quantile, the smallest value with at least that fraction of values at
+    or below it.
+    The exact minimum, maximum and mean are tracked as well.
+    """
+
+    def __init__(self, num_series: int, num_bins: int = DEFAULT_NUM_BINS):
+        if num_bins < 2 or num_bins % 2:
+            raise ValueError("num_bins must be an even number of at least 2")
+        self.num_bins = num_bins
+        self.counts = np.zeros((num_series, num_bins), dtype=np.int64)
+        self.low = None
+        self.bin_width = None
+        self.count = 0
+        self.total = np.zeros(num_series)
+        self.minimum = np.full(num_series, np.inf)
+        self.maximum = np.full(num_series, -np.inf)
+
+    def update(self, values: np.ndarray):
+        """Adds a (samples, series) array of values."""
+        if len(values) == 0:
+            return
+        chunk_minimum = values.min(axis=0)
+        chunk_maximum = values.max(axis=0)
+        if self.low is None:
+            spread = chunk_maximum - chunk_minimum
+            self.low = chunk_minimum.astype(float)
+            self.bin_width = np.where(
+                spread > 0,
+                spread / (self.num_bins - 1),
+                np.maximum(np.abs(chunk_minimum), 1.0) * 1e-9,
+            )
+        for series in np.flatnonzero(chunk_minimum < self.low):
+            while chunk_minimum[series] < self.low[series]:
+                self._extend_down(series)
+        high = self.low + self.num_bins * self.bin_width
+        for series in np.flatnonzero(chunk_maximum >= high):
+            while chunk_maximum[series] >= self.low[series] + (
+                self.num_bins * self.bin_width[series]
+            ):
+                self._extend_up(series)
+
+        bins = ((values - self.low) / self.bin_width).astype(np.int64)
+        np.clip(bins, 0, self.num_bins - 1, out=bins)
+        bins += np.arange(self.counts.shape[0]) * self.num_bins
+        self.counts += np.bincount(bins.ravel(), minlength=self.counts.size).reshape(
+            self.counts.shape
+        )
+        self.count += len(values)
+        self.total += values.sum(axis=0)
+        np.minimum(self.minimum, chunk_minimum, out=self.minimum)
+        np.maximum(self.maximum, chunk_maximum, out=self.maximum)
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Returns a (series, len(qs)) array of approximate quantiles."""
+        qs = np.asarray(qs, dtype=float)
+        cumulative = np.cumsum(self.counts, axis=1)
+        result = np.empty((self.counts.shape[0], len(qs)))
+        for series in range(self.counts.shape[0]):
+            targets = qs * self.count
+            bins = np.searchsorted(cumulative[series], targets, side="left")
+            bins = np.minimum(bins, self.num_bins - 1)
+            below = np.where(bins > 0, cumulative[series][bins - 1], 0)
+            in_bin = self.counts[series][bins]
+            fraction = np.where(in_bin > 0, (targets - below) / np.maximum(in_bin, 1), 0)
+            result[series] = self.low[series] + self.bin_width[series] * (
+                bins + np.clip(fraction, 0, 1)
+            )
+        return np.clip(result, self.minimum[:, None], self.maximum[:, None])
+
+    def mean(self) -> np.ndarray:
+        return self.total / self.count
+
+    def _extend_up(self, series: int):
+        merged = self.counts[series].reshape(-1, 2).sum(axis=1)
+        self.counts[series] = 0
+        self.counts[series, : self.num_bins // 2] = merged
+        self.bin_width[series] *= 2
+
+    def _extend_down(self, series: int):
+        merged = self.counts[series].reshape(-1, 2).sum(axis=1)
+        self.counts[series] = 0
+        self.counts[series, self.num_bins // 2 :] = merged
+        self.low[series] -= self.num_bins * self.bin_width[series]
+        self.bin_width[series] *= 2
+
+
+class MonteCarloResult:
+    """LCOE distributions of every system over the Monte Carlo samples, and how often
+    each system was the lowest LCOE one.
+    """
+
+    def __init__(self, sketch: HistogramSketch, optimal_counts: np.ndarray):
+        self.sketch = sketch
+        self.optimal_counts = optimal_counts
+
+    @property
+    def num_samples(self) -> int:
+        return self.sketch.count
+
+    def lcoe_quantiles(self, qs=(0.05, 0.5, 0.95)) -> np.ndarray:
+        """Returns a (systems, len(qs)) array of LCOE quantiles."""
+        return self.sketch.quantiles(qs)
+
+    def mean_lcoe(self) -> np.ndarray:
+        return self.sketch.mean()
+
+    def optimal_frequency(self) -> np.ndarray:
+        """The fraction of samples in which each system had the lowest LCOE."""
+        return self.optimal_counts / self.num_samples
+
+
+def sample_inputs(
+    distributions: dict, num_samples: int, correlation=None, rng=None
+) -> np.ndarray:
+    """Draws a (num_samples, fields) array of values for the fields of distributions,
+    in their order. Fields are joined by a Gaussian copula with the given correlation
+    matrix (independent if None), so each field keeps its own distribution.
+    """
+    rng = rng or np.random.default_rng()
+    z = rng.standard_normal((num_samples, len(distributions)))
+    if correlation is not None:
+        correlation = np.asarray(correlation, dtype=float)
+        if correlation.shape != (len(distributions), len(distributions)):
+            raise ValueError("The correlation matrix must have a row per distribution")
+        z = z @ np.linalg.cholesky(correlation).T
+    return np.column_stack(
+        [
+            distribution.from_standard_normal(z[:, column])
+            for column, distribution in enumerate(distributions.values())
+        ]
+    )
+
+
+def run_monte_carlo(
+    system_arrays: SystemArrays,
+    financial_inputs: FinancialInputs,
+    distributions: dict,
+    num_samples: int,
+    correlation=None,
+    seed: int = 0,
+    processes: int = None,
+    num_bins: int = DEFAULT_NUM_BINS,
+    chunk_size: int = None,
+) -> MonteCarloResult:
+    """Evaluates every system under num_samples draws of the FinancialInputs fields in
+    distributions (dotted paths to distributions), with every other field taken from
+    financial_inputs.
+
+    Samples are drawn and evaluated in chunks, each with its own random stream spawned
+    from seed, so results depend only on seed and chunk_size, not on processes, and
+    memory use does not grow with num_samples. When every field is a price the LCOEs
+    of a chunk are one matrix product with precomputed price coefficients; otherwise
+    each sample is a batch evaluation, spread over a process pool if processes is
+    given.
+    """
+    field_paths = list(distributions)
+    if chunk_size is None:
+        chunk_size = max(1, DEFAULT_CHUNK_ELEMENTS // max(len(system_arrays), 1))
+    chunk_sizes = [
+        min(chunk_size, num_samples - start) for start in range(0, num_samples, chunk_size)
+    ]
+    sample_chunks = (
+        sample_inputs(
+            distributions,
+            num_chunk_samples,
+            correlation,
+            np.random.default_rng(chunk_seed),
+        )
+        for num_chunk_samples, chunk_seed in zip(
+            chunk_sizes, np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+        )
+    )
+
+    if all(field_path in PRICE_FIELDS for field_path in field_paths):
+        price_coefficients = compute_price_coefficients(system_arrays, financial_inputs)
+        base_prices = price_vector(financial_inputs)
+        columns = [PRICE_FIELDS.index(field_path) for field_path in field_paths]
+        lcoe_chunks = (
+            price_coefficients.reprice_many(
+                _replace_columns(base_prices, columns, samples)
+            )
+            for samples in sample_chunks
+        )
+    else:
+        scenarios = (
+            _apply_sample(financial_inputs, field_paths, sample)
+            for samples in sample_chunks
+            for sample in samples
+        )
+        if processes is None:
+            sample_lcoes = (
+                offgrid_ai_batch.breakeven_lcoe(system_arrays, scenario)
+                for scenario in scenarios
+            )
+        else:
+            sample_lcoes = offgrid_ai_parallel.iter_sweep(
+                system_arrays,
+                scenarios,
+                evaluate=offgrid_ai_batch.breakeven_lcoe,
+                processes=processes,
+            )
+        lcoe_chunks = (
+            np.array(list(islice(sample_lcoes, num_chunk_samples)))
+            for num_chunk_samples in chunk_sizes
+        )
+
+    sketch = HistogramSketch(len(system_arrays), num_bins)
+    optimal_counts = np.zeros(len(system_arrays), dtype=np.int64)
+    for lcoes in lcoe_chunks:
+        sketch.update(lcoes)
+        optimal_counts += np.bincount(
+            np.argmin(lcoes, axis=1), minlength=len(system_arrays)
+        )
+    return MonteCarloResult(sketch, optimal_counts)
+
+
+def _replace_columns(base: np.ndarray, columns: list, values: np.ndarray):
+    replaced = np.tile(base, (len(values), 1))
+    replaced[:, columns] = values
+    return replaced
+
+
+def _apply_sample(
+    financial_inputs: FinancialInputs, field_paths: list, sample
+) -> FinancialInputs:
+    sampled_inputs = FinancialInputs()
+    sampled_inputs.CopyFrom(financial_inputs)
+    for field_path, value in zip(field_paths, sample.tolist()):
+        if isinstance(offgrid_ai.get_financial_input(sampled_inputs, field_path), int):
+            value = round(value)
+        offgrid_ai.set_financial_input(sampled_inputs, field_path, value)
+    return sampled_inputs
+
+
+# Hart's double precision rational approximation of the normal tail (from West, "Better
+# approximations to cumulative normal functions", 2005), highest order first.
+_HART_NUMERATOR = (
+    3.52624965998911e-02,
+    0.700383064443688,
+    6.37396220353165,
+    33.912866078383,
+    112.079291497871,
+    221.213596169931,
+    220.206867912376,
+)
+_HART_DENOMINATOR = (
+    8.83883476483184e-02,
+    1.75566716318264,
+    16.064177579207,
+    86.7807322029461,
+    296.564248779674,
+    637.333633378831,
+    793.826512519948,
+    440.413735824752,
+)
+# Beyond this |z| the tail is computed with a continued fraction instead.
+_HART_SWITCH = 5 * math.sqrt(2)
+
+
+def _standard_normal_cdf(z: np.ndarray) -> np.ndarray:
+    # NumPy has no erfc, so the CDF is vectorized with Hart's approximation, which is
+    # within 1e-15 of 0.5 * math.erfc(-z / sqrt(2)) everywhere.
+    z = np.asarray(z, dtype=float)
+    x = np.abs(z)
+    tail = _horner(_HART_NUMERATOR, x)
+    tail /= _horner(_HART_DENOMINATOR, x)
+    far = x >= _HART_SWITCH
+    if far.any():
+        x_far = x[far]
+        fraction = x_far + 0.65
+        for k in (4, 3, 2, 1):
+            fraction = x_far + k / fraction
+        tail[far] = 1 / (fraction * math.sqrt(2 * math.pi))
+    tail *= np.exp(-0.5 * x * x)
+    return np.where(z > 0, 1 - tail, tail)
+
+
+def _horner(coefficients, x: np.ndarray) -> np.ndarray:
+    result = np.full_like(x, coefficients[0])
+    for coefficient in coefficients[1:]:
+        result *= x
+        result += coefficient
+    return result
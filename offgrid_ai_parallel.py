@@ -0,0 +1,126 @@
+import multiprocessing
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import offgrid_ai_batch
+from offgrid_ai_batch import PRODUCTION_FIELDS, SPEC_FIELDS, SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+
+COLUMNS = ["location", "nat_gas_type", "year"] + SPEC_FIELDS + PRODUCTION_FIELDS
+
+# Set in each worker process by _init_worker.
+_worker_system_arrays = None
+_worker_evaluate = None
+_worker_shared_memory = []
+
+
+class SharedSystemArrays:
+    """Copies the columns of a SystemArrays into shared memory blocks once, so that
+    worker processes can attach to them without pickling or copying the dataset. Use
+    as a context manager so the blocks are released afterwards.
+    """
+
+    def __init__(self, system_arrays: SystemArrays):
+        self._blocks = []
+        self.layout = {}
+        for column in COLUMNS:
+            values = np.ascontiguousarray(getattr(system_arrays, column))
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=block.buf)[...] = values
+            self._blocks.append(block)
+            self.layout[column] = (block.name, values.shape, values.dtype.str)
+
+    def __enter__(self) -> "SharedSystemArrays":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach_system_arrays(layout: dict):
+    """Returns a SystemArrays whose columns are views of the shared memory blocks
+    described by layout, together with the blocks, which must be kept open for as long
+    as the arrays are used.
+    """
+    blocks = []
+    columns = {}
+    for column, (name, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        columns[column] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return SystemArrays(**columns), blocks
+
+
+def lowest_lcoe(system_arrays: SystemArrays, financial_inputs: FinancialInputs):
+    """Default sweep evaluation: the index and LCOE of the lowest LCOE system."""
+    lcoes = offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+    lowest = int(np.argmin(lcoes))
+    return lowest, float(lcoes[lowest])
+
+
+def run_sweep(
+    system_arrays: SystemArrays,
+    scenarios,
+    evaluate=lowest_lcoe,
+    processes: int = None,
+    chunksize: int = 16,
+) -> list:
+    """Evaluates every FinancialInputs in scenarios against the systems using a pool of
+    worker processes and returns the results in the same order as the scenarios.
+
+    evaluate is called as evaluate(system_arrays, financial_inputs) in the workers, so
+    it must be a module level function. The systems are placed in shared memory once
+    and every worker attaches to the same copy; only the serialized FinancialInputs
+    and the results are sent between processes.
+    """
+    return list(iter_sweep(system_arrays, scenarios, evaluate, processes, chunksize))
+
+
+def iter_sweep(
+    system_arrays: SystemArrays,
+    scenarios,
+    evaluate=lowest_lcoe,
+    processes: int = None,
+    chunksize: int = 16,
+    max_pending: int = 4096,
+):
+    """Like run_sweep, but yields the results in scenario order as they complete. At
+    most max_pending scenarios are in flight at once, so scenarios may be a lazy
+    iterator of any length.
+    """
+    scenarios = iter(scenarios)
+    with SharedSystemArrays(system_arrays) as shared_system_arrays:
+        with multiprocessing.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(shared_system_arrays.layout, evaluate),
+        ) as pool:
+            while True:
+                serialized_scenarios = [
+                    financial_inputs.SerializeToString()
+                    for financial_inputs in islice(scenarios, max_pending)
+                ]
+                if not serialized_scenarios:
+                    return
+                yield from pool.imap(
+                    _evaluate_scenario, serialized_scenarios, chunksize=chunksize
+                )
+
+
+def _init_worker(layout: dict, evaluate):
+    global _worker_system_arrays, _worker_evaluate, _worker_shared_memory
+    _worker_system_arrays, _worker_shared_memory = attach_system_arrays(layout)
+    _worker_evaluate = evaluate
+
+
+def _evaluate_scenario(serialized_financial_inputs: bytes):
+    financial_inputs = FinancialInputs.FromString(serialized_financial_inputs)
+    return _worker_evaluate(_worker_system_arrays, financial_inputs)
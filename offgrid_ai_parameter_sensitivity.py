@@ -1,95 +1,123 @@
 import sys
+import numpy as np
 import offgrid_ai
 
 from operator import itemgetter
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_cache import LcoeCache
+from offgrid_ai_envelope import lowest_lcoe_breakpoints
+from offgrid_ai_gradients import format_tornado, lcoe_gradients, tornado
+from offgrid_ai_index import SpecIndex
 from offgrid_ai_pb2 import DataFile, FinancialInputs, SystemData, NaturalGasType
+from offgrid_ai_price_coefficients import compute_price_coefficients
+from offgrid_ai_topk import format_summary, top_k_by_group
+
+
+def spec_index(data_file) -> SpecIndex:
+    """Returns an index over the systems in data_file. Passing the index returned here
+    instead of the DataFile to the helpers below avoids rebuilding it on every call.
+    """
+    if isinstance(data_file, SpecIndex):
+        return data_file
+    return SpecIndex(data_file)
 
 
 def get_system(
-    data_file: DataFile,
+    data_file,
     location,
     solar_capacity_mw,
     bess_max_power_mw,
     natural_gas_capacity_mw,
 ) -> SystemData:
-    systems = []
-    for system_data in data_file.system_data:
-        if (
-            system_data.spec.location == location
-            and round(system_data.spec.solar_capacity_mw) == solar_capacity_mw
-            and round(system_data.spec.bess_max_power_mw) == bess_max_power_mw
-            and round(system_data.spec.natural_gas_capacity_mw)
-            == natural_gas_capacity_mw
-        ):
-            systems.append(system_data)
-    if len(systems) != 1:
-        raise ValueError("Multiple matching systems")
-    return systems[0]
+    return spec_index(data_file).get(
+        location=location,
+        solar_capacity_mw=solar_capacity_mw,
+        bess_max_power_mw=bess_max_power_mw,
+        natural_gas_capacity_mw=natural_gas_capacity_mw,
+    )
 
 def compute_lcoes(
-    data_file: DataFile,
+    data_file,
     financial_inputs: FinancialInputs,
     location,
     natural_gas_capacity_mw,
     both_gas,
+    cache: LcoeCache = None,
 ):
-    system_data_with_lcoe = []
+    """Computes the LCOE of every system at the given location and natural gas size.
+    With both_gas, each system is also evaluated with gas turbines, from the same pass
+    over its production data; the turbine entries are SystemDataViews sharing the
+    production rows of the original system. Results are looked up in and added to the
+    cache, if one is given.
+    """
+    return list(
+        iter_lcoes(
+            spec_index(data_file).lookup(
+                location=location, natural_gas_capacity_mw=natural_gas_capacity_mw
+            ),
+            financial_inputs,
+            both_gas,
+            cache,
+        )
+    )
+
 
-    for system_data in data_file.system_data:
-        if (
-            system_data.spec.location == location
-            and round(system_data.spec.natural_gas_capacity_mw)
-            == natural_gas_capacity_mw
-        ):
-            lcoe = offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
-            system_data_with_lcoe.append((system_data, lcoe))
-            if both_gas:
-                turbine_system_data = SystemData()
-                turbine_system_data.CopyFrom(system_data)
-                turbine_system_data.spec.nat_gas_type = NaturalGasType.GAS_TURBINE
-                lcoe = offgrid_ai.breakeven_lcoe(turbine_system_data, financial_inputs)
-                system_data_with_lcoe.append((turbine_system_data, lcoe))
-    return system_data_with_lcoe
+def iter_lcoes(
+    systems, financial_inputs: FinancialInputs, both_gas, cache: LcoeCache = None
+):
+    """Yields (system_data, lcoe) for each of systems as compute_lcoes does, one
+    system at a time, so a reducer such as offgrid_ai_topk.top_k_by_group can consume
+    them in a single pass without holding them all.
+    """
+    financial_inputs = offgrid_ai.compile_financial_inputs(financial_inputs)
+    for system_data in systems:
+        if not both_gas:
+            yield system_data, offgrid_ai.breakeven_lcoe(
+                system_data, financial_inputs, cache
+            )
+            continue
+        turbine_system_data = offgrid_ai.override_spec(
+            system_data, nat_gas_type=NaturalGasType.GAS_TURBINE
+        )
+        if cache is None:
+            lcoe_breakdowns = offgrid_ai.evaluate_lcoe_by_nat_gas_type(
+                system_data,
+                financial_inputs,
+                [system_data.spec.nat_gas_type, NaturalGasType.GAS_TURBINE],
+            )
+        else:
+            lcoe_breakdowns = [
+                cache.evaluate_lcoe(system_data, financial_inputs),
+                cache.evaluate_lcoe(turbine_system_data, financial_inputs),
+            ]
+        yield system_data, lcoe_breakdowns[0].lcoe
+        yield turbine_system_data, lcoe_breakdowns[1].lcoe
 
 
 def get_lowest_lcoe_system(
-    data_file: DataFile,
+    data_file,
     financial_inputs: FinancialInputs,
     location,
     natural_gas_capacity_mw,
     both_gas,
+    cache: LcoeCache = None,
 ) -> SystemData:
     """Compute the lowest LCOE sytems for a given set of financial inputs, location and
     natural gas generator size.
     """
-    system_data_with_lcoe = []
-
-    for system_data in data_file.system_data:
-        if (
-            system_data.spec.location == location
-            and round(system_data.spec.natural_gas_capacity_mw)
-            == natural_gas_capacity_mw
-        ):
-            lcoe = offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
-            system_data_with_lcoe.append((system_data, lcoe))
-            if both_gas:
-                turbine_system_data = SystemData()
-                turbine_system_data.CopyFrom(system_data)
-                turbine_system_data.spec.nat_gas_type = NaturalGasType.GAS_TURBINE
-                lcoe = offgrid_ai.breakeven_lcoe(turbine_system_data, financial_inputs)
-                system_data_with_lcoe.append((turbine_system_data, lcoe))
-
-    system_data_with_lcoe.sort(key=itemgetter(1))
-    lowest_lcoe_system = system_data_with_lcoe[0][0]
+    system_data_with_lcoe = compute_lcoes(
+        data_file, financial_inputs, location, natural_gas_capacity_mw, both_gas, cache
+    )
+    lowest_lcoe_system, _ = min(system_data_with_lcoe, key=itemgetter(1))
     return lowest_lcoe_system
 
 
 def print_lcoe(
     system_data: SystemData, financial_inputs: FinancialInputs, components: bool
 ):
-    lcoe = offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
+    lcoe_breakdown = offgrid_ai.evaluate_lcoe(system_data, financial_inputs)
     digits_rounded = 4
-    lcoe_rounded = round(lcoe, digits_rounded)
+    lcoe_rounded = round(lcoe_breakdown.lcoe, digits_rounded)
     offgrid_ai.print_system_spec(system_data)
     lifetime_renewable = round(
         100 * offgrid_ai.lifetime_renewable_percentage(system_data), digits_rounded
@@ -97,50 +125,12 @@ def print_lcoe(
     print(f"Lifetime renewable percentage: {lifetime_renewable}%")
     print(f"LCOE: ${lcoe_rounded}")
     if components:
-        total_costs_npv = -(
-            offgrid_ai.equity_capex_npv(system_data, financial_inputs)
-            + offgrid_ai.debt_service_npv(system_data, financial_inputs)
-            + offgrid_ai.tax_benefit_npv(system_data, financial_inputs, lcoe)
-            + offgrid_ai.variable_om_npv(system_data, financial_inputs)
-            + offgrid_ai.fixed_om_npv(system_data, financial_inputs)
-            + offgrid_ai.fuel_cost_npv(system_data, financial_inputs)
-        )
-        equity_capex_per_mwh = round(
-            -offgrid_ai.equity_capex_npv(system_data, financial_inputs)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
-        debt_service_per_mwh = round(
-            -offgrid_ai.debt_service_npv(system_data, financial_inputs)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
-        tax_benefit_per_mwh = round(
-            -offgrid_ai.tax_benefit_npv(system_data, financial_inputs, lcoe)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
-        variable_om_per_mwh = round(
-            -offgrid_ai.variable_om_npv(system_data, financial_inputs)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
-        fixed_om_per_mwh = round(
-            -offgrid_ai.fixed_om_npv(system_data, financial_inputs)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
-        fuel_cost_per_mwh = round(
-            -offgrid_ai.fuel_cost_npv(system_data, financial_inputs)
-            / total_costs_npv
-            * lcoe,
-            digits_rounded,
-        )
+        equity_capex_per_mwh = round(lcoe_breakdown.equity_capex_per_mwh, digits_rounded)
+        debt_service_per_mwh = round(lcoe_breakdown.debt_service_per_mwh, digits_rounded)
+        tax_benefit_per_mwh = round(lcoe_breakdown.tax_benefit_per_mwh, digits_rounded)
+        variable_om_per_mwh = round(lcoe_breakdown.variable_om_per_mwh, digits_rounded)
+        fixed_om_per_mwh = round(lcoe_breakdown.fixed_om_per_mwh, digits_rounded)
+        fuel_cost_per_mwh = round(lcoe_breakdown.fuel_cost_per_mwh, digits_rounded)
         print("LCOE Components:")
         print(f"Equity capex/MWh: ${equity_capex_per_mwh}")
         print(f"Debt service/MWh: ${debt_service_per_mwh}")
@@ -159,15 +149,17 @@ def main():
     data_file = DataFile()
     with open(file_name, "rb") as f:
         data_file.ParseFromString(f.read())
+    # Index the systems once so each query below only visits the matching systems.
+    data_file = spec_index(data_file)
 
     # Basic example of using this to find the lowest cost system and calculate the LCOE for a specific system.
     lowest_lcoe_system = get_lowest_lcoe_system(
         data_file, offgrid_ai.build_standard_financial_inputs(), "El Paso, TX", 125, False
     )
     all_generators_system = get_system(data_file, "El Paso, TX", 0, 0, 125)
-    all_turbines_system = SystemData()
-    all_turbines_system.CopyFrom(all_generators_system)
-    all_turbines_system.spec.nat_gas_type = NaturalGasType.GAS_TURBINE
+    all_turbines_system = offgrid_ai.override_spec(
+        all_generators_system, nat_gas_type=NaturalGasType.GAS_TURBINE
+    )
 
     print("El Paso, TX Lowest LCOE system:")
     print_lcoe(lowest_lcoe_system, offgrid_ai.build_standard_financial_inputs(), True)
@@ -176,40 +168,24 @@ def main():
     print("All Generators System LCOE:")
     print_lcoe(all_turbines_system, offgrid_ai.build_standard_financial_inputs(), True)
 
-    # Example of computing results for many different potential system locations.
+    # Example of computing results for many different potential system locations, in
+    # one pass over every system with the 125MW generator.
     print("Lowest cost by location")
-    lowest_lcoe_amarillo = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Amarillo, TX", 125, False
-    )
-    print_lcoe(lowest_lcoe_amarillo, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_beryl = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Beryl Junction, UT", 125, False
-    )
-    print_lcoe(lowest_lcoe_beryl, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_el_paso = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "El Paso, TX", 125, False
-    )
-    print_lcoe(lowest_lcoe_el_paso, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_lovelock = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Lovelock, NV", 125, False
-    )
-    print_lcoe(lowest_lcoe_lovelock, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_komelik = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "North Komelik, AZ", 125, False
-    )
-    print_lcoe(lowest_lcoe_komelik, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_trinidad = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Trinidad, CO", 125, False
+    top_3_by_location = top_k_by_group(
+        iter_lcoes(
+            data_file.lookup(natural_gas_capacity_mw=125),
+            offgrid_ai.build_standard_financial_inputs(),
+            False,
+        ),
+        k=3,
     )
-    print_lcoe(lowest_lcoe_trinidad, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_willcox = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Willcox, NM", 125, False
-    )
-    print_lcoe(lowest_lcoe_willcox, offgrid_ai.build_standard_financial_inputs(), True)
-    lowest_lcoe_yuma = get_lowest_lcoe_system(
-        data_file, offgrid_ai.build_standard_financial_inputs(), "Yuma, AZ", 125, False
-    )
-    print_lcoe(lowest_lcoe_yuma, offgrid_ai.build_standard_financial_inputs(), True)
+    for group in sorted(top_3_by_location):
+        print_lcoe(
+            top_3_by_location[group][0].system_data,
+            offgrid_ai.build_standard_financial_inputs(),
+            True,
+        )
+    print(format_summary(top_3_by_location))
 
     # Examples of using this to print a Pareto frontier.
     normal_itc_pareto_frontier = offgrid_ai.find_pareto_frontier(compute_lcoes(data_file, offgrid_ai.build_standard_financial_inputs(), "El Paso, TX", 125, False))
@@ -229,33 +205,63 @@ def main():
         print(f"{lifetime_renewable},{lcoe},{system_data.spec.solar_capacity_mw},{system_data.spec.bess_max_power_mw}")
 
     # The below calculates the optimal system for a 2D grid of prices under different tax credit scenarios.
+    # As the LCOE is linear in prices, each grid point is a matrix-vector product with
+    # coefficients computed once per set of financing terms.
+    el_paso_systems = data_file.lookup(location="El Paso, TX", natural_gas_capacity_mw=125)
+    el_paso_system_arrays = SystemArrays.from_system_data(el_paso_systems)
     print("Lowest cost system for solar & battery price drop with normal ITC")
+    price_coefficients = compute_price_coefficients(
+        el_paso_system_arrays, offgrid_ai.build_standard_financial_inputs()
+    )
     for module_price_cents in range(22, 1, -1):
         for bess_price in range(200, 90, -10):
             financial_inputs = offgrid_ai.build_standard_financial_inputs()
             financial_inputs.capex_inputs.bess_capex.bess_units = bess_price
             financial_inputs.capex_inputs.solar_capex.modules = module_price_cents / 100.
-            lowest_lcoe_system = get_lowest_lcoe_system(
-                data_file, financial_inputs, "El Paso, TX", 125, False
-            )
-            lcoe = offgrid_ai.breakeven_lcoe(lowest_lcoe_system, financial_inputs)
+            lcoes = price_coefficients.reprice(financial_inputs)
+            lowest_lcoe_system = el_paso_systems[int(np.argmin(lcoes))]
+            lcoe = lcoes.min()
             lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(lowest_lcoe_system)
             print(f"{module_price_cents},{bess_price},{lifetime_renewable},{lcoe},{lowest_lcoe_system.spec.solar_capacity_mw},{lowest_lcoe_system.spec.bess_max_power_mw}")
 
     print("Lowest cost system for solar & battery price drop with energy community 40% ITC")
+    price_coefficients = compute_price_coefficients(
+        el_paso_system_arrays, energy_community_financial_inputs
+    )
     for module_price_cents in range(22, 1, -1):
         for bess_price in range(200, 90, -10):
             financial_inputs = offgrid_ai.build_standard_financial_inputs()
             financial_inputs.investment_tax_credit = 0.4
             financial_inputs.capex_inputs.bess_capex.bess_units = bess_price
             financial_inputs.capex_inputs.solar_capex.modules = module_price_cents / 100.
-            lowest_lcoe_system = get_lowest_lcoe_system(
-                data_file, financial_inputs, "El Paso, TX", 125, False
-            )
-            lcoe = offgrid_ai.breakeven_lcoe(lowest_lcoe_system, financial_inputs)
+            lcoes = price_coefficients.reprice(financial_inputs)
+            lowest_lcoe_system = el_paso_systems[int(np.argmin(lcoes))]
+            lcoe = lcoes.min()
             lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(lowest_lcoe_system)
             print(f"{module_price_cents},{bess_price},{lifetime_renewable},{lcoe},{lowest_lcoe_system.spec.solar_capacity_mw},{lowest_lcoe_system.spec.bess_max_power_mw}")
 
+    # Exact module prices at which the lowest cost system changes, rather than sampling a grid.
+    print("Lowest cost system by module price with normal ITC")
+    for segment in lowest_lcoe_breakpoints(
+        el_paso_system_arrays,
+        offgrid_ai.build_standard_financial_inputs(),
+        "capex_inputs.solar_capex.modules",
+        0.02,
+        0.22,
+    ):
+        system_data = el_paso_systems[segment.system_index]
+        print(f"{segment.start},{segment.end},{system_data.spec.solar_capacity_mw},{system_data.spec.bess_max_power_mw}")
+
+    # The inputs which move the LCOE of the lowest cost system most, from the LCOE
+    # gradients of every El Paso system with respect to every input.
+    print("Tornado of +/-10% input changes for the lowest cost El Paso system")
+    standard_financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    gradients = lcoe_gradients(el_paso_system_arrays, standard_financial_inputs)
+    bars = tornado(
+        gradients, standard_financial_inputs, 0.1, int(np.argmin(gradients.lcoe))
+    )
+    print(format_tornado(bars, limit=15))
+
 
 if __name__ == "__main__":
     main()
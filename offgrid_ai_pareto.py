@@ -0,0 +1,183 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+import offgrid_ai
+from offgrid_ai_pb2 import FinancialInputs, NaturalGasType
+
+MINIMIZE = 1
+MAXIMIZE = -1
+
+# Objective name to direction. The gas type is not an objective: to compare
+# generators and turbines, find the skyline of each separately.
+OBJECTIVES = {
+    "lcoe": MINIMIZE,
+    "lifetime_renewable": MAXIMIZE,
+    "total_capex": MINIMIZE,
+    "fuel_burn_mmbtu": MINIMIZE,
+}
+
+
+def system_metrics(
+    system_data_with_lcoe, financial_inputs: FinancialInputs = None
+) -> dict:
+    """Computes every objective in OBJECTIVES once per system, returning a dict of
+    arrays in the same order as system_data_with_lcoe. total_capex and fuel_burn_mmbtu
+    (which accounts for the turbine heat rate) need the financial inputs and are left
+    out when none are given.
+    """
+    metrics = {
+        "lcoe": np.array([lcoe for _, lcoe in system_data_with_lcoe], dtype=float),
+        "lifetime_renewable": np.array(
+            [
+                offgrid_ai.lifetime_renewable_percentage(system_data)
+                for system_data, _ in system_data_with_lcoe
+            ],
+            dtype=float,
+        ),
+    }
+    if financial_inputs is not None:
+        financial_inputs = offgrid_ai.compile_financial_inputs(financial_inputs)
+        metrics["total_capex"] = np.array(
+            [
+                offgrid_ai.total_capex(system_data, financial_inputs)
+                for system_data, _ in system_data_with_lcoe
+            ],
+            dtype=float,
+        )
+        metrics["fuel_burn_mmbtu"] = np.array(
+            [
+                _fuel_burn_mmbtu(system_data, financial_inputs)
+                for system_data, _ in system_data_with_lcoe
+            ],
+            dtype=float,
+        )
+    return metrics
+
+
+def skyline(metrics: dict, objectives) -> list:
+    """Returns the indices of the systems which no other system dominates on the given
+    objectives, ordered by the first objective. A system dominates another if it is at
+    least as good on every objective and better on one; of several systems with equal
+    metrics only the first is kept.
+
+    Systems are visited sorted by the objectives, so each can only be dominated by
+    the skyline found so far. Two objectives take O(n log n): a single sweep keeps
+    every system which improves on the best second objective so far. Three take
+    O(n log n) comparisons too, sweeping with the 2-D skyline of the last two
+    objectives as a sorted staircase. With more objectives each system is checked
+    against the whole skyline so far with one vectorized comparison, which is
+    O(n log n + n * skyline size).
+    """
+    for objective in objectives:
+        if objective not in metrics:
+            raise ValueError(f"No metric computed for objective {objective}")
+    return _skyline(
+        np.column_stack(
+            [OBJECTIVES[objective] * metrics[objective] for objective in objectives]
+        )
+    )
+
+
+def pareto_skyline(
+    system_data_with_lcoe,
+    objectives=("lcoe", "lifetime_renewable"),
+    financial_inputs: FinancialInputs = None,
+) -> list:
+    """Returns the (system_data, lcoe) pairs on the Pareto skyline of the given
+    objectives, ordered by the first objective. The input list is not modified.
+    """
+    metrics = system_metrics(system_data_with_lcoe, financial_inputs)
+    return [system_data_with_lcoe[index] for index in skyline(metrics, objectives)]
+
+
+class ConstrainedOptimum:
+    """Answers "cheapest system with constraint >= threshold" queries for any number
+    of thresholds from one precomputed frontier. cost is minimized and constraint
+    maximized, e.g. the lowest LCOE system with a lifetime renewable percentage of at
+    least X. Each query is a binary search over the frontier.
+    """
+
+    def __init__(self, metrics: dict, cost="lcoe", constraint="lifetime_renewable"):
+        # Along the frontier, ordered by increasing cost, the constraint increases, so
+        # the first frontier system meeting a threshold is the cheapest which does.
+        self.frontier = np.array(
+            _skyline(np.column_stack([metrics[cost], -metrics[constraint]])),
+            dtype=int,
+        )
+        self.constraint_values = metrics[constraint][self.frontier]
+
+    def query(self, threshold: float):
+        """Returns the index of the cheapest system meeting the threshold, or None."""
+        return self.query_many([threshold])[0]
+
+    def query_many(self, thresholds) -> list:
+        """Returns the index of the cheapest system meeting each threshold, or None."""
+        positions = np.searchsorted(self.constraint_values, thresholds, side="left")
+        return [
+            int(self.frontier[position]) if position < len(self.frontier) else None
+            for position in positions
+        ]
+
+
+def _skyline(values: np.ndarray) -> list:
+    """Skyline of a (systems, objectives) array in which every objective is minimized."""
+    # np.lexsort sorts by its last key first and is stable, so ties keep input order.
+    order = np.lexsort(values.T[::-1])
+    if values.shape[1] == 1:
+        return [int(order[0])] if len(order) else []
+    if values.shape[1] == 2:
+        frontier = []
+        best = np.inf
+        for index in order:
+            if values[index, 1] < best:
+                frontier.append(int(index))
+                best = values[index, 1]
+        return frontier
+
+    if values.shape[1] == 3:
+        return _skyline_3d(values, order)
+
+    frontier = []
+    frontier_values = np.empty_like(values)
+    for index in order:
+        candidate = values[index]
+        if (frontier_values[: len(frontier)] <= candidate).all(axis=1).any():
+            continue
+        frontier_values[len(frontier)] = candidate
+        frontier.append(int(index))
+    return frontier
+
+
+def _skyline_3d(values: np.ndarray, order: np.ndarray) -> list:
+    """Sweeps the systems in lexicographic order, keeping the 2-D skyline of the last
+    two objectives of the systems kept so far as a staircase: ys increasing and zs
+    decreasing. A system is dominated if and only if the staircase step at its y is
+    at or below its z.
+    """
+    frontier = []
+    ys = []
+    zs = []
+    for index in order:
+        y, z = values[index, 1], values[index, 2]
+        step = bisect_right(ys, y) - 1
+        if step >= 0 and zs[step] <= z:
+            continue
+        frontier.append(int(index))
+        # Drop the steps the new system dominates in 2-D, which follow it.
+        start = bisect_left(ys, y)
+        end = start
+        while end < len(zs) and zs[end] >= z:
+            end += 1
+        ys[start:end] = [y]
+        zs[start:end] = [z]
+    return frontier
+
+
+def _fuel_burn_mmbtu(system_data, financial_inputs) -> float:
+    fuel_burn = sum(
+        production.generator_fuel_mmbtu for production in system_data.production
+    )
+    if system_data.spec.nat_gas_type == NaturalGasType.GAS_TURBINE:
+        fuel_burn *= financial_inputs.turbine_vs_generator_fuel_consumption_ratio
+    return fuel_burn
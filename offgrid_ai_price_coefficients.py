@@ -0,0 +1,105 @@
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_pb2 import FinancialInputs
+
+# The LCOE is linear in each of these prices. Everything else in FinancialInputs,
+# including the soft cost percentages, the opex soft_costs rate and the ITC
+# applicability fractions (which multiply prices), is treated as a financing term.
+PRICE_FIELDS = [
+    "capex_inputs.solar_capex.modules",
+    "capex_inputs.solar_capex.inverters",
+    "capex_inputs.solar_capex.racking_and_foundations",
+    "capex_inputs.solar_capex.balance_of_system",
+    "capex_inputs.solar_capex.labor",
+    "capex_inputs.bess_capex.bess_units",
+    "capex_inputs.bess_capex.balance_of_system",
+    "capex_inputs.bess_capex.labor",
+    "capex_inputs.generator_capex.gensets",
+    "capex_inputs.generator_capex.balance_of_system",
+    "capex_inputs.generator_capex.labor",
+    "capex_inputs.gas_turbine_capex.gas_turbines",
+    "capex_inputs.gas_turbine_capex.balance_of_system",
+    "capex_inputs.gas_turbine_capex.labor",
+    "capex_inputs.system_integration_capex.microgrid_switchgear_transformers_etc",
+    "capex_inputs.system_integration_capex.controls",
+    "capex_inputs.system_integration_capex.labor",
+    "opex_inputs.solar_fixed_om_kw",
+    "opex_inputs.bess_fixed_om_kw",
+    "opex_inputs.generators_fixed_om_kw",
+    "opex_inputs.generators_variable_om_kwh",
+    "opex_inputs.gas_turbines_fixed_om_kw",
+    "opex_inputs.gas_turbines_variable_om_kwh",
+    "opex_inputs.bos_fixed_om_kw",
+    "fuel_price_mmbtu",
+]
+
+
+class PriceCoefficients:
+    """The LCOE sensitivity of every system to every price in PRICE_FIELDS for a fixed
+    set of financing terms. As the LCOE has no term which is independent of prices,
+    the LCOE of system i is exactly coefficients[i] @ price_vector(financial_inputs).
+    """
+
+    def __init__(self, coefficients: np.ndarray, financing_terms: bytes):
+        self.coefficients = coefficients
+        self.financing_terms = financing_terms
+
+    def reprice(self, financial_inputs: FinancialInputs) -> np.ndarray:
+        """Returns the LCOE of every system under the prices in financial_inputs, which
+        must have the same financing terms the coefficients were computed for.
+        """
+        if financing_terms(financial_inputs) != self.financing_terms:
+            raise ValueError(
+                "Financing terms differ from those the coefficients were computed for"
+            )
+        return self.coefficients @ price_vector(financial_inputs)
+
+    def reprice_many(self, price_vectors: np.ndarray) -> np.ndarray:
+        """Returns a (scenarios, systems) array of LCOEs for a (scenarios, prices)
+        array of price vectors ordered as PRICE_FIELDS.
+        """
+        return np.asarray(price_vectors) @ self.coefficients.T
+
+
+def price_vector(financial_inputs: FinancialInputs) -> np.ndarray:
+    """Returns the prices in financial_inputs, ordered as PRICE_FIELDS."""
+    return np.array(
+        [
+            offgrid_ai.get_financial_input(financial_inputs, field_path)
+            for field_path in PRICE_FIELDS
+        ]
+    )
+
+
+def compute_price_coefficients(
+    system_arrays: SystemArrays, financial_inputs: FinancialInputs
+) -> PriceCoefficients:
+    """Derives each system's LCOE coefficient for every price field by evaluating the
+    LCOE with one unit of that price and all other prices at zero.
+    """
+    coefficients = np.empty((len(system_arrays), len(PRICE_FIELDS)))
+    for column, field_path in enumerate(PRICE_FIELDS):
+        unit_price_inputs = _without_prices(financial_inputs)
+        offgrid_ai.set_financial_input(unit_price_inputs, field_path, 1.0)
+        coefficients[:, column] = offgrid_ai_batch.breakeven_lcoe(
+            system_arrays, unit_price_inputs
+        )
+    return PriceCoefficients(coefficients, financing_terms(financial_inputs))
+
+
+def financing_terms(financial_inputs: FinancialInputs) -> bytes:
+    """Returns financial_inputs serialized with every price zeroed, which is equal for
+    any two inputs that differ only in their prices.
+    """
+    return _without_prices(financial_inputs).SerializeToString(deterministic=True)
+
+
+def _without_prices(financial_inputs: FinancialInputs) -> FinancialInputs:
+    financing_inputs = FinancialInputs()
+    financing_inputs.CopyFrom(financial_inputs)
+    for field_path in PRICE_FIELDS:
+        offgrid_ai.set_financial_input(financing_inputs, field_path, 0.0)
+    return financing_inputs
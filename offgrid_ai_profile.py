@@ -0,0 +1,226 @@
+import atexit
+import functools
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Setting this environment variable to a file name profiles the whole run: the table
+# is printed to stderr at exit and the folded stacks are written to the file.
+PROFILE_ENV_VAR = "OFFGRID_AI_PROFILE"
+
+# The offgrid_ai functions which are instrumented. The per-year helpers _escalation
+# and _discount_factor are left out as timing them would cost more than they do.
+PROFILED_FUNCTIONS = [
+    "compile_financial_inputs",
+    "after_tax_equity_npv",
+    "ebitda_npv",
+    "fuel_cost_npv",
+    "fixed_om_npv",
+    "variable_om_npv",
+    "total_capex",
+    "soft_cost_percentage",
+    "hard_capex",
+    "federal_itc_applicable_spend",
+    "hard_capex_itc_applicable",
+    "federal_itc",
+    "federal_itc_npv",
+    "debt_service_npv",
+    "depreciation_npv",
+    "interest_expense_npv",
+    "tax_benefit_npv",
+    "equity_capex_npv",
+    "incremental_after_tax_equity_npv",
+    "breakeven_lcoe",
+    "evaluate_lcoe",
+    "evaluate_lcoe_by_nat_gas_type",
+    "lifetime_renewable_percentage",
+    "calc_npv",
+    "_capex_spend",
+    "_npv",
+    "_production_npvs",
+    "_evaluate_production_npvs",
+]
+# The functions which loop over system_data.production themselves.
+ROW_VISITING_FUNCTIONS = {
+    "ebitda_npv",
+    "fuel_cost_npv",
+    "fixed_om_npv",
+    "variable_om_npv",
+    "incremental_after_tax_equity_npv",
+    "lifetime_renewable_percentage",
+    "_production_npvs",
+}
+
+_active_profile = None
+
+
+class FunctionStats:
+    """Totals for one instrumented function. Times are in seconds; self_time excludes
+    the time spent in other instrumented functions it called.
+    """
+
+    __slots__ = ("calls", "cumulative_time", "self_time", "production_rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.cumulative_time = 0.0
+        self.self_time = 0.0
+        self.production_rows = 0
+
+
+class Profile:
+    """The results of an instrumented run: FunctionStats by function name, and the
+    self time of every distinct call stack of instrumented functions.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.stack_self_times = {}
+        self._stack = []
+        self._child_times = []
+        self._originals = {}
+
+    def table(self, sort_by: str = "self_time") -> str:
+        """Formats the stats as a text table, most expensive first."""
+        rows = sorted(
+            self.stats.items(), key=lambda item: getattr(item[1], sort_by), reverse=True
+        )
+        lines = [
+            f"{'function':<34}{'calls':>10}{'cumulative s':>14}{'self s':>12}"
+            f"{'self us/call':>14}{'rows':>12}"
+        ]
+        for name, stats in rows:
+            lines.append(
+                f"{name:<34}{stats.calls:>10}{stats.cumulative_time:>14.6f}"
+                f"{stats.self_time:>12.6f}{1e6 * stats.self_time / stats.calls:>14.2f}"
+                f"{stats.production_rows:>12}"
+            )
+        return "\n".join(lines)
+
+    def folded_stacks(self) -> str:
+        """Formats the self time of every call stack, in microseconds, in the folded
+        format read by flamegraph.pl, speedscope and similar tools.
+        """
+        return "\n".join(
+            f"{';'.join(stack)} {round(1e6 * self_time)}"
+            for stack, self_time in sorted(self.stack_self_times.items())
+        )
+
+    def write_folded_stacks(self, output_file: str):
+        with open(output_file, "w") as f:
+            f.write(self.folded_stacks() + "\n")
+
+    def _record(self, name: str, function, system_data, args, kwargs):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = FunctionStats()
+        stats.calls += 1
+        if system_data is not None:
+            stats.production_rows += len(system_data.production)
+        self._stack.append(name)
+        self._child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack = tuple(self._stack)
+            self._stack.pop()
+            self_time = elapsed - self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += elapsed
+            stats.cumulative_time += elapsed
+            stats.self_time += self_time
+            self.stack_self_times[stack] = (
+                self.stack_self_times.get(stack, 0.0) + self_time
+            )
+
+
+def enable() -> Profile:
+    """Instruments the offgrid_ai functions and returns the Profile they record to.
+    Until then, and after disable(), the original functions are in place, so the
+    instrumentation costs nothing when it is not enabled. Functions imported with
+    "from offgrid_ai import ..." before enabling are not instrumented.
+    """
+    global _active_profile
+    import offgrid_ai
+
+    if _active_profile is not None:
+        raise ValueError("Profiling is already enabled")
+    new_profile = Profile()
+    for name in PROFILED_FUNCTIONS:
+        function = getattr(offgrid_ai, name)
+        new_profile._originals[name] = function
+        setattr(
+            offgrid_ai,
+            name,
+            _instrument(new_profile, name, function, name in ROW_VISITING_FUNCTIONS),
+        )
+    _active_profile = new_profile
+    return new_profile
+
+
+def disable() -> Profile:
+    """Restores the original offgrid_ai functions and returns the finished Profile."""
+    global _active_profile
+    import offgrid_ai
+
+    if _active_profile is None:
+        raise ValueError("Profiling is not enabled")
+    finished_profile = _active_profile
+    for name, function in finished_profile._originals.items():
+        setattr(offgrid_ai, name, function)
+    _active_profile = None
+    return finished_profile
+
+
+@contextmanager
+def profile():
+    """Profiles the offgrid_ai functions called within the block, e.g.
+
+    with offgrid_ai_profile.profile() as p:
+        offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
+    print(p.table())
+    """
+    enabled_profile = enable()
+    try:
+        yield enabled_profile
+    finally:
+        disable()
+
+
+def enable_from_environment():
+    """Enables profiling for the rest of the process if PROFILE_ENV_VAR is set. Called
+    when offgrid_ai is imported.
+    """
+    output_file = os.environ.get(PROFILE_ENV_VAR)
+    if not output_file or _active_profile is not None:
+        return
+    enable()
+    atexit.register(_report_at_exit, output_file)
+
+
+def _instrument(target: Profile, name: str, function, visits_rows: bool):
+    if visits_rows:
+
+        @functools.wraps(function)
+        def instrumented(*args, **kwargs):
+            system_data = args[0] if args else kwargs["system_data"]
+            return target._record(name, function, system_data, args, kwargs)
+
+    else:
+
+        @functools.wraps(function)
+        def instrumented(*args, **kwargs):
+            return target._record(name, function, None, args, kwargs)
+
+    return instrumented
+
+
+def _report_at_exit(output_file: str):
+    if _active_profile is None:
+        return
+    finished_profile = disable()
+    print(finished_profile.table(), file=sys.stderr)
+    finished_profile.write_folded_stacks(output_file)
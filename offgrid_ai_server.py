@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+import offgrid_ai_batch
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_index import KEY_FIELDS, SpecIndex
+from offgrid_ai_pareto import skyline
+from offgrid_ai_pb2 import DataFile, FinancialInputs, NaturalGasType, SystemSpec
+from offgrid_ai_price_coefficients import (
+    compute_price_coefficients,
+    financing_terms,
+    price_vector,
+)
+
+# Request kinds.
+LCOES = 1
+OPTIMUM = 2
+FRONTIER = 3
+
+# Every message is preceded by its length. A request is a header with its kind and
+# the lengths of the serialized FinancialInputs and SystemSpec which follow it; the
+# response is JSON.
+_LENGTH = struct.Struct("<I")
+_REQUEST_HEADER = struct.Struct("<BII")
+
+DEFAULT_RELOAD_INTERVAL = 1.0
+# Number of sets of price coefficients kept, one per set of financing terms and gas
+# type.
+MAX_CACHED_COEFFICIENTS = 16
+
+
+class LcoeServer:
+    """A long-lived process holding a data file, its SpecIndex and its SystemArrays in
+    memory, answering LCOE requests over a Unix socket or localhost TCP.
+
+    A request is a FinancialInputs and a SystemSpec whose set fields filter the
+    systems: any of the SpecIndex key fields, with nat_gas_type evaluating the matching
+    systems with that gas type. The response is the LCOE of every matching system, the
+    lowest LCOE one, or the LCOE vs lifetime renewable Pareto frontier.
+
+    Requests which arrive together are evaluated as one micro-batch: requests with the
+    same FinancialInputs share a batch evaluation over all the systems they ask for,
+    and requests whose inputs differ only in prices are repriced together with one
+    matrix product, using price coefficients cached per set of financing terms. The
+    data file is reloaded whenever its modification time changes.
+    """
+
+    def __init__(
+        self, data_path: str, reload_interval: float = DEFAULT_RELOAD_INTERVAL
+    ):
+        self.data_path = data_path
+        self.reload_interval = reload_interval
+        self.dataset = _Dataset(data_path)
+        self._queue = None
+
+    async def serve(self, path: str = None, host: str = "127.0.0.1", port: int = None):
+        """Serves until cancelled, on the Unix socket path if given and otherwise on
+        host:port.
+        """
+        self._queue = asyncio.Queue()
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle_connection, path)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+        tasks = [
+            asyncio.create_task(self._batch_loop()),
+            asyncio.create_task(self._reload_loop()),
+        ]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def evaluate(self, requests: list) -> list:
+        """Answers a micro-batch of (kind, FinancialInputs, SystemSpec) requests,
+        returning a JSON-serializable response for each.
+        """
+        dataset = self.dataset
+        responses = [None] * len(requests)
+        groups = {}
+        for request_index, request in enumerate(requests):
+            try:
+                request = _parse_request(dataset, *request)
+            except ValueError as error:
+                responses[request_index] = {"error": str(error)}
+                continue
+            groups.setdefault(
+                (request.financing_terms, request.nat_gas_type), []
+            ).append((request_index, request))
+
+        for (terms, nat_gas_type), members in groups.items():
+            # An error evaluating one group, e.g. from inputs the LCOE is undefined
+            # for, is only returned to the requests in that group.
+            try:
+                requests_lcoes = _group_lcoes(
+                    dataset, terms, nat_gas_type, [request for _, request in members]
+                )
+            except Exception as error:
+                for request_index, _ in members:
+                    responses[request_index] = _error_response(error)
+                continue
+            for (request_index, request), lcoes in zip(members, requests_lcoes):
+                try:
+                    responses[request_index] = _respond(dataset, request, lcoes)
+                except Exception as error:
+                    responses[request_index] = _error_response(error)
+        return responses
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    message = await _read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                future = asyncio.get_running_loop().create_future()
+                await self._queue.put((message, future))
+                _write_message(writer, json.dumps(await future).encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _batch_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Let the other connections with a request ready queue it, so that
+            # concurrent requests are evaluated together.
+            await asyncio.sleep(0)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            requests = []
+            for message, future in batch:
+                try:
+                    requests.append(_decode_request(message))
+                except ValueError as error:
+                    requests.append(None)
+                    future.set_result({"error": str(error)})
+            valid = [
+                index for index, request in enumerate(requests) if request is not None
+            ]
+            try:
+                responses = self.evaluate([requests[index] for index in valid])
+            except Exception as error:
+                responses = [_error_response(error)] * len(valid)
+            for index, response in zip(valid, responses):
+                batch[index][1].set_result(response)
+
+    async def _reload_loop(self):
+        loop = asyncio.get_running_loop()
+        attempted = self.dataset.modified
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                modified = os.stat(self.data_path).st_mtime_ns
+            except OSError:
+                continue
+            # A file which failed to load is retried once it changes again.
+            if modified == attempted:
+                continue
+            attempted = modified
+            try:
+                # Requests keep being answered from the old dataset meanwhile.
+                self.dataset = await loop.run_in_executor(
+                    None, _Dataset, self.data_path
+                )
+            except Exception as error:
+                print(f"Failed to reload {self.data_path}: {error}", file=sys.stderr)
+
+
+class LcoeClient:
+    """A blocking client for LcoeServer. address is a Unix socket path or a
+    (host, port) tuple. Filters are SystemSpec fields, e.g.
+
+    client.optimum(
+        financial_inputs, location="El Paso, TX", natural_gas_capacity_mw=125
+    )
+    """
+
+    def __init__(self, address):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rb")
+
+    def __enter__(self) -> "LcoeClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lcoes(self, financial_inputs: FinancialInputs, **filters) -> list:
+        """Returns every matching system's spec, LCOE and lifetime renewable share."""
+        return self.request(LCOES, financial_inputs, SystemSpec(**filters))["systems"]
+
+    def optimum(self, financial_inputs: FinancialInputs, **filters) -> dict:
+        return self.request(OPTIMUM, financial_inputs, SystemSpec(**filters))["system"]
+
+    def frontier(self, financial_inputs: FinancialInputs, **filters) -> list:
+        return self.request(FRONTIER, financial_inputs, SystemSpec(**filters))[
+            "systems"
+        ]
+
+    def request(
+        self, kind: int, financial_inputs: FinancialInputs, spec_filter: SystemSpec
+    ) -> dict:
+        message = _encode_request(kind, financial_inputs, spec_filter)
+        self._socket.sendall(_LENGTH.pack(len(message)) + message)
+        (length,) = _LENGTH.unpack(self._file.read(_LENGTH.size))
+        response = json.loads(self._file.read(length))
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class _Request(NamedTuple):
+    kind: int
+    financial_inputs: FinancialInputs
+    financing_terms: bytes
+    nat_gas_type: int
+    positions: np.ndarray
+
+
+class _Dataset:
+    """A loaded data file and everything derived from it."""
+
+    def __init__(self, data_path: str):
+        self.modified = os.stat(data_path).st_mtime_ns
+        data_file = DataFile()
+        with open(data_path, "rb") as f:
+            data_file.ParseFromString(f.read())
+        self.index = SpecIndex(data_file)
+        self.system_arrays = SystemArrays.from_system_data(data_file)
+        self.lifetime_renewable = offgrid_ai_batch.lifetime_renewable_percentage(
+            self.system_arrays
+        )
+        self._coefficients = OrderedDict()
+
+    def cached_coefficients(self, terms: bytes, nat_gas_type: int):
+        coefficients = self._coefficients.get((terms, nat_gas_type))
+        if coefficients is not None:
+            self._coefficients.move_to_end((terms, nat_gas_type))
+        return coefficients
+
+    def coefficients(
+        self, financial_inputs: FinancialInputs, terms: bytes, nat_gas_type: int
+    ):
+        system_arrays = self.system_arrays
+        if nat_gas_type is not None:
+            system_arrays = system_arrays.with_nat_gas_type(nat_gas_type)
+        coefficients = compute_price_coefficients(system_arrays, financial_inputs)
+        self._coefficients[(terms, nat_gas_type)] = coefficients
+        if len(self._coefficients) > MAX_CACHED_COEFFICIENTS:
+            self._coefficients.popitem(last=False)
+        return coefficients
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves LCOE requests for the systems in a data file."
+    )
+    parser.add_argument("data_file", help="Path to offgrid_ai_data.binarypb")
+    parser.add_argument("--socket", help="Unix socket path to listen on")
+    parser.add_argument("--port", type=int, help="Localhost TCP port to listen on")
+    parser.add_argument(
+        "--reload_interval",
+        type=float,
+        default=DEFAULT_RELOAD_INTERVAL,
+        help="Seconds between checks for changes to the data file",
+    )
+    args = parser.parse_args()
+    if (args.socket is None) == (args.port is None):
+        parser.error("Give exactly one of --socket and --port")
+    server = LcoeServer(args.data_file, args.reload_interval)
+    asyncio.run(server.serve(path=args.socket, port=args.port))
+
+
+def _parse_request(
+    dataset: _Dataset,
+    kind: int,
+    financial_inputs: FinancialInputs,
+    spec_filter: SystemSpec,
+) -> _Request:
+    if kind not in (LCOES, OPTIMUM, FRONTIER):
+        raise ValueError(f"Unknown request kind {kind}")
+    key = {
+        field: getattr(spec_filter, field)
+        for field in KEY_FIELDS
+        if field != "nat_gas_type" and spec_filter.HasField(field)
+    }
+    if spec_filter.HasField("load_mw"):
+        raise ValueError("Filtering on load_mw is not supported")
+    nat_gas_type = (
+        spec_filter.nat_gas_type if spec_filter.HasField("nat_gas_type") else None
+    )
+    return _Request(
+        kind,
+        financial_inputs,
+        financing_terms(financial_inputs),
+        nat_gas_type,
+        np.array(dataset.index.positions(**key), dtype=np.int64),
+    )
+
+
+def _group_lcoes(
+    dataset: _Dataset, terms: bytes, nat_gas_type: int, requests: list
+) -> list:
+    """Evaluates requests with the same financing terms and gas type together,
+    returning the LCOEs of the systems each asked for.
+    """
+    positions = np.unique(np.concatenate([request.positions for request in requests]))
+    rows = {}
+    distinct_inputs = []
+    for request in requests:
+        serialized = request.financial_inputs.SerializeToString(deterministic=True)
+        if serialized not in rows:
+            rows[serialized] = len(distinct_inputs)
+            distinct_inputs.append(request.financial_inputs)
+
+    coefficients = dataset.cached_coefficients(terms, nat_gas_type)
+    if coefficients is None and len(distinct_inputs) > 1:
+        coefficients = dataset.coefficients(distinct_inputs[0], terms, nat_gas_type)
+    if len(positions) == 0:
+        lcoes = np.empty((len(distinct_inputs), 0))
+    elif coefficients is not None:
+        prices = np.array([price_vector(inputs) for inputs in distinct_inputs])
+        lcoes = prices @ coefficients.coefficients[positions].T
+    else:
+        # A single set of inputs, which is cheaper to evaluate directly than to
+        # compute price coefficients for.
+        system_arrays = dataset.system_arrays.subset(positions)
+        if nat_gas_type is not None:
+            system_arrays = system_arrays.with_nat_gas_type(nat_gas_type)
+        lcoes = offgrid_ai_batch.breakeven_lcoe(system_arrays, distinct_inputs[0])
+        lcoes = lcoes[None, :]
+    return [
+        lcoes[
+            rows[request.financial_inputs.SerializeToString(deterministic=True)],
+            np.searchsorted(positions, request.positions),
+        ]
+        for request in requests
+    ]
+
+
+def _respond(dataset: _Dataset, request: _Request, lcoes: np.ndarray) -> dict:
+    if request.kind == LCOES:
+        order = np.arange(len(lcoes))
+    elif len(lcoes) == 0:
+        raise ValueError("No systems match the filter")
+    elif request.kind == OPTIMUM:
+        return {
+            "system": _system_json(dataset, request, int(np.argmin(lcoes)), lcoes)
+        }
+    else:
+        order = skyline(
+            {
+                "lcoe": lcoes,
+                "lifetime_renewable": dataset.lifetime_renewable[request.positions],
+            },
+            ["lcoe", "lifetime_renewable"],
+        )
+    return {"systems": [_system_json(dataset, request, i, lcoes) for i in order]}
+
+
+def _error_response(error: Exception) -> dict:
+    # ValueErrors describe a bad request; anything else is unexpected and reported
+    # with its type.
+    if isinstance(error, ValueError):
+        return {"error": str(error)}
+    return {"error": repr(error)}
+
+
+def _system_json(dataset: _Dataset, request: _Request, i: int, lcoes) -> dict:
+    system_arrays = dataset.system_arrays
+    position = request.positions[i]
+    nat_gas_type = request.nat_gas_type
+    if nat_gas_type is None:
+        nat_gas_type = system_arrays.nat_gas_type[position]
+    return {
+        "location": str(system_arrays.location[position]),
+        "load_mw": float(system_arrays.load_mw[position]),
+        "solar_capacity_mw": float(system_arrays.solar_capacity_mw[position]),
+        "bess_max_power_mw": float(system_arrays.bess_max_power_mw[position]),
+        "bess_energy_capacity_mwh": float(
+            system_arrays.bess_energy_capacity_mwh[position]
+        ),
+        "natural_gas_capacity_mw": float(
+            system_arrays.natural_gas_capacity_mw[position]
+        ),
+        "nat_gas_type": NaturalGasType.Name(int(nat_gas_type)),
+        "lcoe": float(lcoes[i]),
+        "lifetime_renewable": float(dataset.lifetime_renewable[position]),
+    }
+
+
+def _encode_request(
+    kind: int, financial_inputs: FinancialInputs, spec_filter: SystemSpec
+) -> bytes:
+    financial_inputs = financial_inputs.SerializeToString()
+    spec_filter = spec_filter.SerializeToString()
+    return (
+        _REQUEST_HEADER.pack(kind, len(financial_inputs), len(spec_filter))
+        + financial_inputs
+        + spec_filter
+    )
+
+
+def _decode_request(message: bytes):
+    if len(message) < _REQUEST_HEADER.size:
+        raise ValueError("Truncated request")
+    kind, inputs_length, filter_length = _REQUEST_HEADER.unpack_from(message)
+    start = _REQUEST_HEADER.size
+    if len(message) != start + inputs_length + filter_length:
+        raise ValueError("Request length does not match its header")
+    try:
+        financial_inputs = FinancialInputs.FromString(
+            message[start : start + inputs_length]
+        )
+        spec_filter = SystemSpec.FromString(message[start + inputs_length :])
+    except Exception as error:
+        raise ValueError(f"Malformed request: {error}")
+    return kind, financial_inputs, spec_filter
+
+
+async def _read_message(reader) -> bytes:
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def _write_message(writer, message: bytes):
+    writer.write(_LENGTH.pack(len(message)) + message)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import mmap
+import os
+
+from offgrid_ai_index import SpecIndex
+from offgrid_ai_pb2 import SystemData, SystemSpec
+
+# Protocol buffer wire types.
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+# Field numbers of DataFile.system_data and SystemData.spec.
+SYSTEM_DATA_FIELD = 1
+SPEC_FIELD = 1
+
+
+def iter_system_data(input_file: str):
+    """Yields the SystemData records of a binarypb DataFile one at a time, in file
+    order. The file is memory mapped and only the record being yielded is decoded, so
+    memory use does not grow with the size of the file.
+    """
+    with open(input_file, "rb") as f:
+        buffer = _map_file(f)
+        try:
+            for start, end in _iter_records(buffer):
+                yield SystemData.FromString(buffer[start:end])
+        finally:
+            buffer.close()
+
+
+class DataFileReader(SpecIndex):
+    """Reads a binarypb DataFile without decoding it as a whole. Opening the file scans
+    it once, decoding only the SystemSpec of every record and skipping over the
+    production rows, and keeps the byte range of each record. Queries then have the
+    same interface as SpecIndex (lookup, get, range_query, group_by), but seek to and
+    decode only the matching records, so a query for one location never touches the
+    production data of the others.
+
+    systems holds spec-only SystemData headers; the full records are decoded afresh
+    by every query and are not kept. Use as a context manager, or call close(), to
+    release the file.
+    """
+
+    def __init__(self, input_file: str):
+        self._file = open(input_file, "rb")
+        self._buffer = _map_file(self._file)
+        self.record_ranges = []
+        headers = []
+        for start, end in _iter_records(self._buffer):
+            self.record_ranges.append((start, end))
+            headers.append(SystemData(spec=_read_spec(self._buffer, start, end)))
+        super().__init__(headers)
+
+    def __enter__(self) -> "DataFileReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yields every full SystemData record in file order, decoding one at a time."""
+        for position in range(len(self)):
+            yield self._system(position)
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def _system(self, position: int) -> SystemData:
+        start, end = self.record_ranges[position]
+        return SystemData.FromString(self._buffer[start:end])
+
+
+def _map_file(f):
+    # mmap cannot map an empty file, which is a valid, empty DataFile.
+    if os.fstat(f.fileno()).st_size == 0:
+        return _EmptyBuffer()
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _EmptyBuffer(bytes):
+    def close(self):
+        pass
+
+
+def _iter_records(buffer):
+    """Yields the (start, end) byte range of every DataFile.system_data record."""
+    for field_number, wire_type, start, end in _iter_fields(buffer, 0, len(buffer)):
+        if field_number == SYSTEM_DATA_FIELD and wire_type == WIRETYPE_LENGTH_DELIMITED:
+            yield start, end
+
+
+def _read_spec(buffer, start: int, end: int) -> SystemSpec:
+    """Decodes the SystemSpec of the SystemData record at buffer[start:end], skipping
+    its production rows. Repeated spec fields are merged as the full decoder would.
+    """
+    spec = SystemSpec()
+    for field_number, wire_type, field_start, field_end in _iter_fields(
+        buffer, start, end
+    ):
+        if field_number == SPEC_FIELD and wire_type == WIRETYPE_LENGTH_DELIMITED:
+            spec.MergeFromString(buffer[field_start:field_end])
+    return spec
+
+
+def _iter_fields(buffer, position: int, end: int):
+    """Yields (field_number, wire_type, start, end) for every field of the message at
+    buffer[position:end], where start:end is the field's value, without decoding it.
+    """
+    while position < end:
+        tag, position = _read_varint(buffer, position)
+        field_number, wire_type = tag >> 3, tag & 7
+        if wire_type == WIRETYPE_VARINT:
+            _, value_end = _read_varint(buffer, position)
+        elif wire_type == WIRETYPE_FIXED64:
+            value_end = position + 8
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, position = _read_varint(buffer, position)
+            value_end = position + length
+        elif wire_type == WIRETYPE_FIXED32:
+            value_end = position + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} at byte {position}")
+        if value_end > end:
+            raise ValueError(f"Truncated field {field_number} at byte {position}")
+        yield field_number, wire_type, position, value_end
+        position = value_end
+
+
+def _read_varint(buffer, position: int):
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(buffer):
+            raise ValueError("Truncated varint")
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
@@ -0,0 +1,285 @@
+from typing import NamedTuple
+
+import numpy as np
+
+import offgrid_ai_batch
+from offgrid_ai_batch import PRODUCTION_FIELDS, SystemArrays
+from offgrid_ai_pb2 import FinancialInputs, SystemData
+
+# Nelder-Mead coefficients.
+REFLECTION = 1.0
+EXPANSION = 2.0
+CONTRACTION = 0.5
+SHRINK = 0.5
+
+
+class ProductionSurrogate:
+    """Interpolates the per-year production of the systems at one location and gas
+    size over their (solar_capacity_mw, bess_max_power_mw) grid, so systems of any
+    size within the grid can be evaluated without rerunning the simulation. Every
+    production field, and the BESS energy capacity, is interpolated with monotone
+    piecewise cubics along each axis: the data is reproduced exactly at grid points
+    and never overshoots between them, and unlike bilinear interpolation the LCOE
+    surface can have its minimum between grid points.
+    """
+
+    def __init__(self, systems):
+        system_arrays = SystemArrays.from_system_data(systems)
+        if len(system_arrays) == 0:
+            raise ValueError("No systems to build a surrogate from")
+        for field in ["location", "natural_gas_capacity_mw", "load_mw"]:
+            if len(np.unique(getattr(system_arrays, field))) != 1:
+                raise ValueError(f"All systems must have the same {field}")
+        self.solar_capacities_mw = np.unique(np.round(system_arrays.solar_capacity_mw))
+        self.bess_max_powers_mw = np.unique(np.round(system_arrays.bess_max_power_mw))
+        grid_shape = (len(self.solar_capacities_mw), len(self.bess_max_powers_mw))
+        if len(system_arrays) != grid_shape[0] * grid_shape[1]:
+            raise ValueError("Systems must form a full solar x BESS grid")
+        solar_indices = np.searchsorted(
+            self.solar_capacities_mw, np.round(system_arrays.solar_capacity_mw)
+        )
+        bess_indices = np.searchsorted(
+            self.bess_max_powers_mw, np.round(system_arrays.bess_max_power_mw)
+        )
+        order = np.lexsort((bess_indices, solar_indices))
+        self._template = system_arrays.subset(order[:1])
+        # Each field as a (BESS, solar, ...) grid, with its slopes along the BESS axis,
+        # which do not depend on the sizes evaluated.
+        self._grid = {}
+        for field in PRODUCTION_FIELDS + ["bess_energy_capacity_mwh"]:
+            values = getattr(system_arrays, field)[order]
+            grid = np.swapaxes(values.reshape(grid_shape + values.shape[1:]), 0, 1)
+            self._grid[field] = (grid, _pchip_slopes(self.bess_max_powers_mw, grid))
+
+    def system_arrays(self, solar_capacities_mw, bess_max_powers_mw) -> SystemArrays:
+        """Returns interpolated systems for the given arrays of sizes, which must lie
+        within the grid.
+        """
+        solar_capacities_mw = np.atleast_1d(
+            np.asarray(solar_capacities_mw, dtype=float)
+        )
+        bess_max_powers_mw = np.atleast_1d(np.asarray(bess_max_powers_mw, dtype=float))
+        _check_bounds(self.solar_capacities_mw, solar_capacities_mw)
+        _check_bounds(self.bess_max_powers_mw, bess_max_powers_mw)
+        columns = {}
+        for field, (grid, bess_slopes) in self._grid.items():
+            # Interpolate along the BESS axis for every solar grid value, then along
+            # the solar axis, giving (solar, systems, ...) and then (systems, ...).
+            by_solar = np.swapaxes(
+                _hermite(
+                    self.bess_max_powers_mw, grid, bess_slopes, bess_max_powers_mw
+                ),
+                0,
+                1,
+            )
+            columns[field] = _hermite(
+                self.solar_capacities_mw,
+                by_solar,
+                _pchip_slopes(self.solar_capacities_mw, by_solar),
+                solar_capacities_mw,
+                paired=True,
+            )
+        num_systems = len(solar_capacities_mw)
+        template = self._template
+        columns["solar_capacity_mw"] = solar_capacities_mw
+        columns["bess_max_power_mw"] = bess_max_powers_mw
+        columns["load_mw"] = np.repeat(template.load_mw, num_systems)
+        columns["natural_gas_capacity_mw"] = np.repeat(
+            template.natural_gas_capacity_mw, num_systems
+        )
+        return SystemArrays(
+            np.repeat(template.location, num_systems),
+            np.repeat(template.nat_gas_type, num_systems),
+            np.repeat(template.year, num_systems, axis=0),
+            **columns,
+        )
+
+    def system_data(
+        self, solar_capacity_mw: float, bess_max_power_mw: float
+    ) -> SystemData:
+        """Returns an interpolated SystemData for a single size."""
+        system_arrays = self.system_arrays([solar_capacity_mw], [bess_max_power_mw])
+        return system_arrays.to_system_data(0)
+
+    def bounds(self):
+        """The ((min, max) solar_capacity_mw, (min, max) bess_max_power_mw) covered."""
+        return (
+            (self.solar_capacities_mw[0], self.solar_capacities_mw[-1]),
+            (self.bess_max_powers_mw[0], self.bess_max_powers_mw[-1]),
+        )
+
+
+class SizingResult(NamedTuple):
+    solar_capacity_mw: float
+    bess_max_power_mw: float
+    lcoe: float
+    evaluations: int
+
+
+def optimize_system_size(
+    surrogate: ProductionSurrogate,
+    financial_inputs: FinancialInputs,
+    nat_gas_type: int = None,
+    max_evaluations: int = 60,
+    tolerance_mw: float = 0.5,
+) -> SizingResult:
+    """Finds the solar and BESS sizes with the lowest LCOE anywhere within the
+    surrogate's grid. The grid points, whose LCOEs take a single batch evaluation,
+    give the starting point, which a bounded Nelder-Mead search then refines in at
+    most max_evaluations further evaluations, stopping once the simplex is smaller
+    than tolerance_mw. This finds the minimum near the best grid point; in a long
+    flat valley it may stop short of the true minimum by a small fraction of the
+    LCOE.
+    """
+    (solar_low, solar_high), (bess_low, bess_high) = surrogate.bounds()
+    low = np.array([solar_low, bess_low])
+    high = np.array([solar_high, bess_high])
+    evaluations = 0
+
+    def lcoe(point):
+        nonlocal evaluations
+        evaluations += 1
+        return float(_lcoes(surrogate, financial_inputs, nat_gas_type, [point])[0])
+
+    grid_solar, grid_bess = np.meshgrid(
+        surrogate.solar_capacities_mw, surrogate.bess_max_powers_mw, indexing="ij"
+    )
+    grid_points = np.column_stack([grid_solar.ravel(), grid_bess.ravel()])
+    grid_lcoes = _lcoes(surrogate, financial_inputs, nat_gas_type, grid_points)
+    start = grid_points[np.argmin(grid_lcoes)]
+
+    steps = np.array(
+        [
+            np.diff(axis).min() if len(axis) > 1 else 0.0
+            for axis in [surrogate.solar_capacities_mw, surrogate.bess_max_powers_mw]
+        ]
+    )
+    simplex = _initial_simplex(start, steps, high)
+    values = np.array(
+        [float(grid_lcoes.min())] + [lcoe(vertex) for vertex in simplex[1:]]
+    )
+
+    while evaluations < max_evaluations:
+        order = np.argsort(values)
+        simplex, values = simplex[order], values[order]
+        if np.abs(simplex[1:] - simplex[0]).max() < tolerance_mw:
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        reflected = np.clip(centroid + REFLECTION * (centroid - simplex[-1]), low, high)
+        reflected_value = lcoe(reflected)
+        if reflected_value < values[0]:
+            expanded = np.clip(centroid + EXPANSION * (reflected - centroid), low, high)
+            expanded_value = lcoe(expanded)
+            if expanded_value < reflected_value:
+                simplex[-1], values[-1] = expanded, expanded_value
+            else:
+                simplex[-1], values[-1] = reflected, reflected_value
+        elif reflected_value < values[-2]:
+            simplex[-1], values[-1] = reflected, reflected_value
+        else:
+            contracted = centroid + CONTRACTION * (simplex[-1] - centroid)
+            contracted_value = lcoe(contracted)
+            if contracted_value < values[-1]:
+                simplex[-1], values[-1] = contracted, contracted_value
+            else:
+                simplex[1:] = simplex[0] + SHRINK * (simplex[1:] - simplex[0])
+                values[1:] = [lcoe(vertex) for vertex in simplex[1:]]
+
+    best = int(np.argmin(values))
+    return SizingResult(
+        solar_capacity_mw=float(simplex[best][0]),
+        bess_max_power_mw=float(simplex[best][1]),
+        lcoe=float(values[best]),
+        evaluations=evaluations,
+    )
+
+
+def _lcoes(
+    surrogate: ProductionSurrogate,
+    financial_inputs: FinancialInputs,
+    nat_gas_type,
+    points,
+) -> np.ndarray:
+    points = np.asarray(points, dtype=float)
+    system_arrays = surrogate.system_arrays(points[:, 0], points[:, 1])
+    if nat_gas_type is not None:
+        system_arrays = system_arrays.with_nat_gas_type(nat_gas_type)
+    return offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+
+
+def _initial_simplex(start: np.ndarray, steps: np.ndarray, high: np.ndarray):
+    # The simplex spans one grid step along each axis, pointing inwards at the upper
+    # bounds.
+    simplex = [start]
+    for dimension, step in enumerate(steps):
+        vertex = start.copy()
+        if start[dimension] + step <= high[dimension]:
+            vertex[dimension] += step
+        else:
+            vertex[dimension] -= step
+        simplex.append(vertex)
+    return np.array(simplex)
+
+
+def _check_bounds(axis: np.ndarray, values: np.ndarray):
+    if ((values < axis[0] - 1e-9) | (values > axis[-1] + 1e-9)).any():
+        raise ValueError(f"Sizes must be within [{axis[0]}, {axis[-1]}]")
+
+
+def _pchip_slopes(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """The slopes at x of the monotone piecewise cubic (Fritsch-Carlson) through y,
+    along its first axis. Between grid points the cubic stays within the neighbouring
+    values, so interpolated production never overshoots the data.
+    """
+    slopes = np.zeros(y.shape)
+    if len(x) < 2:
+        return slopes
+    h = np.diff(x).reshape((-1,) + (1,) * (y.ndim - 1))
+    delta = np.diff(y, axis=0) / h
+    if len(x) == 2:
+        slopes[0] = slopes[1] = delta[0]
+        return slopes
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harmonic = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+    slopes[1:-1] = np.where(delta[:-1] * delta[1:] > 0, harmonic, 0)
+    slopes[0] = _end_slope(h[0], h[1], delta[0], delta[1])
+    slopes[-1] = _end_slope(h[-1], h[-2], delta[-1], delta[-2])
+    return slopes
+
+
+def _hermite(
+    x: np.ndarray,
+    y: np.ndarray,
+    slopes: np.ndarray,
+    x_new: np.ndarray,
+    paired: bool = False,
+) -> np.ndarray:
+    """Evaluates the cubic Hermite interpolant of y and slopes, along their first
+    axis, at each of x_new. If paired, the second axis of y has an entry per x_new,
+    and only that entry is evaluated.
+    """
+    if len(x) < 2:
+        return y[0] if paired else np.repeat(y[:1], len(x_new), axis=0)
+    index = np.clip(np.searchsorted(x, x_new, side="right") - 1, 0, len(x) - 2)
+    selected = (index, np.arange(len(x_new))) if paired else (index,)
+    following = (index + 1,) + selected[1:]
+    width = (x[index + 1] - x[index]).reshape((-1,) + (1,) * (y.ndim - 1 - paired))
+    t = np.clip((x_new - x[index]).reshape(width.shape) / width, 0, 1)
+    return (
+        (2 * t**3 - 3 * t**2 + 1) * y[selected]
+        + (t**3 - 2 * t**2 + t) * width * slopes[selected]
+        + (-2 * t**3 + 3 * t**2) * y[following]
+        + (t**3 - t**2) * width * slopes[following]
+    )
+
+
+def _end_slope(h0, h1, delta0, delta1):
+    slope = ((2 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+    slope = np.where(np.sign(slope) != np.sign(delta0), 0, slope)
+    return np.where(
+        (np.sign(delta0) != np.sign(delta1)) & (np.abs(slope) > np.abs(3 * delta0)),
+        3 * delta0,
+        slope,
+    )
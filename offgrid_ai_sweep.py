@@ -0,0 +1,314 @@
+import argparse
+import csv
+import json
+import math
+import os
+from itertools import islice, product
+
+import numpy as np
+
+import offgrid_ai
+import offgrid_ai_batch
+import offgrid_ai_parallel
+from offgrid_ai_batch import SystemArrays
+from offgrid_ai_columnar import load_columnar_cache
+from offgrid_ai_pb2 import DataFile, FinancialInputs, NaturalGasType
+from offgrid_ai_price_coefficients import (
+    PRICE_FIELDS,
+    compute_price_coefficients,
+    price_vector,
+)
+
+RESULT_FIELDS = [
+    "location",
+    "natural_gas_capacity_mw",
+    "nat_gas_type",
+    "lcoe",
+    "lifetime_renewable_percentage",
+    "solar_capacity_mw",
+    "bess_max_power_mw",
+    "bess_energy_capacity_mwh",
+]
+
+
+class SweepSpec:
+    """A declarative scenario sweep: the Cartesian product of values for any number of
+    FinancialInputs fields (given by dotted path), applied on top of base financial
+    inputs, over the systems selected by the location, gas capacity and gas type
+    filters. A filter of None selects everything; nat_gas_types evaluates every selected
+    system with each of the given gas types.
+    """
+
+    def __init__(
+        self,
+        dimensions: dict,
+        locations=None,
+        natural_gas_capacity_mw=None,
+        nat_gas_types=None,
+        base_financial_inputs: FinancialInputs = None,
+    ):
+        self.dimensions = {
+            field_path: list(values) for field_path, values in dimensions.items()
+        }
+        self.locations = locations
+        self.natural_gas_capacity_mw = natural_gas_capacity_mw
+        self.nat_gas_types = nat_gas_types
+        self.base_financial_inputs = (
+            base_financial_inputs or offgrid_ai.build_standard_financial_inputs()
+        )
+
+    @classmethod
+    def from_json(cls, spec: dict) -> "SweepSpec":
+        """Builds a spec from its JSON form, e.g.
+
+        {"dimensions": {"capex_inputs.solar_capex.modules": [0.22, 0.18],
+                        "investment_tax_credit": {"start": 0.3, "stop": 0.5, "step": 0.1}},
+         "locations": ["El Paso, TX"], "natural_gas_capacity_mw": [125],
+         "nat_gas_types": ["GENERATOR", "GAS_TURBINE"]}
+
+        Ranges include their stop value.
+        """
+        dimensions = {}
+        for field_path, values in spec["dimensions"].items():
+            if isinstance(values, dict):
+                values = _inclusive_range(values["start"], values["stop"], values["step"])
+            dimensions[field_path] = values
+        nat_gas_types = spec.get("nat_gas_types")
+        if nat_gas_types is not None:
+            nat_gas_types = [NaturalGasType.Value(name) for name in nat_gas_types]
+        return cls(
+            dimensions,
+            locations=spec.get("locations"),
+            natural_gas_capacity_mw=spec.get("natural_gas_capacity_mw"),
+            nat_gas_types=nat_gas_types,
+        )
+
+    def __len__(self) -> int:
+        num_points = 1
+        for values in self.dimensions.values():
+            num_points *= len(values)
+        return num_points
+
+    def points(self):
+        """Lazily iterates over the tuples of dimension values."""
+        return product(*self.dimensions.values())
+
+    def financial_inputs(self, point) -> FinancialInputs:
+        """Returns the base financial inputs with the point's values applied."""
+        financial_inputs = FinancialInputs()
+        financial_inputs.CopyFrom(self.base_financial_inputs)
+        for field_path, value in zip(self.dimensions, point):
+            if isinstance(
+                offgrid_ai.get_financial_input(financial_inputs, field_path), int
+            ):
+                if value != round(value):
+                    raise ValueError(f"{field_path} takes whole numbers, got {value}")
+                value = round(value)
+            offgrid_ai.set_financial_input(financial_inputs, field_path, value)
+        return financial_inputs
+
+    def select_systems(self, system_arrays: SystemArrays) -> SystemArrays:
+        """Applies the filters, adding a copy of the selected systems for each gas
+        type to evaluate.
+        """
+        selected = np.ones(len(system_arrays), dtype=bool)
+        if self.locations is not None:
+            selected &= np.isin(system_arrays.location, self.locations)
+        if self.natural_gas_capacity_mw is not None:
+            selected &= np.isin(
+                np.round(system_arrays.natural_gas_capacity_mw),
+                self.natural_gas_capacity_mw,
+            )
+        system_arrays = system_arrays.subset(selected)
+        if self.nat_gas_types is None:
+            return system_arrays
+        return SystemArrays.concatenate(
+            [
+                system_arrays.with_nat_gas_type(nat_gas_type)
+                for nat_gas_type in self.nat_gas_types
+            ]
+        )
+
+
+class SystemGroups:
+    """Partitions systems by (location, natural_gas_capacity_mw, nat_gas_type) so the
+    lowest LCOE system of every group can be picked from one array of LCOEs.
+    """
+
+    def __init__(self, system_arrays: SystemArrays):
+        gas_capacities = np.round(system_arrays.natural_gas_capacity_mw)
+        order = np.lexsort(
+            (system_arrays.nat_gas_type, gas_capacities, system_arrays.location)
+        )
+        self.keys = []
+        self.indices = []
+        start = 0
+        for end in range(1, len(order) + 1):
+            if end == len(order) or _group_key(
+                system_arrays, gas_capacities, order[end]
+            ) != _group_key(system_arrays, gas_capacities, order[start]):
+                self.keys.append(_group_key(system_arrays, gas_capacities, order[start]))
+                # Sorting keeps the data file order within each group, so ties resolve
+                # to the first system as in get_lowest_lcoe_system.
+                self.indices.append(np.sort(order[start:end]))
+                start = end
+
+    def lowest(self, lcoes: np.ndarray) -> list:
+        """Returns the index of the lowest LCOE system in every group."""
+        return [int(indices[np.argmin(lcoes[indices])]) for indices in self.indices]
+
+
+def iter_sweep_results(system_arrays: SystemArrays, spec: SweepSpec, processes=None):
+    """Yields one result row (a dict of the dimension values and RESULT_FIELDS) per
+    sweep point and system group, in point order. Points are generated lazily so memory
+    use does not depend on the size of the sweep. When every dimension is a price field
+    the LCOEs come from precomputed price coefficients; otherwise each point is a batch
+    evaluation, spread over a process pool if processes is given.
+    """
+    system_arrays = spec.select_systems(system_arrays)
+    groups = SystemGroups(system_arrays)
+    lifetime_renewable = offgrid_ai_batch.lifetime_renewable_percentage(system_arrays)
+    for point, lcoes in zip(spec.points(), _iter_lcoes(system_arrays, spec, processes)):
+        row = dict(zip(spec.dimensions, point))
+        for key, index in zip(groups.keys, groups.lowest(lcoes)):
+            location, natural_gas_capacity_mw, nat_gas_type = key
+            yield {
+                **row,
+                "location": location,
+                "natural_gas_capacity_mw": natural_gas_capacity_mw,
+                "nat_gas_type": NaturalGasType.Name(nat_gas_type),
+                "lcoe": float(lcoes[index]),
+                "lifetime_renewable_percentage": float(lifetime_renewable[index]),
+                "solar_capacity_mw": float(system_arrays.solar_capacity_mw[index]),
+                "bess_max_power_mw": float(system_arrays.bess_max_power_mw[index]),
+                "bess_energy_capacity_mwh": float(
+                    system_arrays.bess_energy_capacity_mwh[index]
+                ),
+            }
+
+
+def run_sweep_to_file(
+    system_arrays: SystemArrays,
+    spec: SweepSpec,
+    output_file: str,
+    output_format: str = "csv",
+    processes: int = None,
+    batch_size: int = 10000,
+):
+    """Streams the sweep results to a CSV or Parquet file, holding at most batch_size
+    rows in memory at once.
+    """
+    field_names = list(spec.dimensions) + RESULT_FIELDS
+    rows = iter_sweep_results(system_arrays, spec, processes)
+    if output_format == "csv":
+        with open(output_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, field_names)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif output_format == "parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires the pyarrow package")
+        schema = pyarrow.schema(
+            [
+                (
+                    field_name,
+                    pyarrow.string()
+                    if field_name in ("location", "nat_gas_type")
+                    else pyarrow.float64(),
+                )
+                for field_name in field_names
+            ]
+        )
+        with pyarrow.parquet.ParquetWriter(output_file, schema) as writer:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+    else:
+        raise ValueError(f"Unknown output format {output_format}")
+
+
+def load_system_arrays(input_file: str) -> SystemArrays:
+    """Loads systems from a binarypb DataFile or a columnar cache directory."""
+    if os.path.isdir(input_file):
+        return load_columnar_cache(input_file)
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    return SystemArrays.from_system_data(data_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Finds the lowest LCOE system at every point of a scenario sweep."
+    )
+    parser.add_argument(
+        "data", help="offgrid_ai_data.binarypb or a columnar cache directory"
+    )
+    parser.add_argument("spec", help="JSON sweep specification, see SweepSpec.from_json")
+    parser.add_argument("output", help="Output file")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="Evaluate points in parallel"
+    )
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = SweepSpec.from_json(json.load(f))
+    run_sweep_to_file(
+        load_system_arrays(args.data),
+        spec,
+        args.output,
+        output_format=args.format,
+        processes=args.processes,
+    )
+
+
+def _iter_lcoes(system_arrays: SystemArrays, spec: SweepSpec, processes):
+    if all(field_path in PRICE_FIELDS for field_path in spec.dimensions):
+        price_coefficients = compute_price_coefficients(
+            system_arrays, spec.base_financial_inputs
+        )
+        base_prices = price_vector(spec.base_financial_inputs)
+        columns = [PRICE_FIELDS.index(field_path) for field_path in spec.dimensions]
+        for point in spec.points():
+            prices = base_prices.copy()
+            prices[columns] = point
+            yield price_coefficients.coefficients @ prices
+    elif processes is not None:
+        yield from offgrid_ai_parallel.iter_sweep(
+            system_arrays,
+            (spec.financial_inputs(point) for point in spec.points()),
+            evaluate=offgrid_ai_batch.breakeven_lcoe,
+            processes=processes,
+        )
+    else:
+        for point in spec.points():
+            yield offgrid_ai_batch.breakeven_lcoe(
+                system_arrays, spec.financial_inputs(point)
+            )
+
+
+def _group_key(system_arrays: SystemArrays, gas_capacities: np.ndarray, index):
+    return (
+        str(system_arrays.location[index]),
+        int(gas_capacities[index]),
+        int(system_arrays.nat_gas_type[index]),
+    )
+
+
+def _inclusive_range(start, stop, step) -> list:
+    if step <= 0:
+        raise ValueError(f"Range step must be positive, got {step}")
+    # The tolerance keeps a stop on the grid despite rounding in the division, while a
+    # stop between grid values is never overshot.
+    num_values = math.floor((stop - start) / step + 1e-9) + 1
+    return [round(start + i * step, 10) for i in range(num_values)]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import heapq
+from typing import NamedTuple
+
+import offgrid_ai
+from offgrid_ai_pb2 import NaturalGasType, SystemData
+
+GROUP_FIELDS = ("location", "natural_gas_capacity_mw", "nat_gas_type")
+
+
+class RankedSystem(NamedTuple):
+    # 1 for the best system of its group.
+    rank: int
+    # The value of the ranking key, lowest first.
+    score: float
+    lcoe: float
+    system_data: SystemData
+
+
+def lcoe_key(system_data: SystemData, lcoe: float) -> float:
+    """Ranks systems by LCOE alone."""
+    return lcoe
+
+
+def min_renewable_lcoe_key(min_lifetime_renewable: float):
+    """Returns a key ranking systems by LCOE which leaves out those with a lifetime
+    renewable percentage (as a fraction) below min_lifetime_renewable.
+    """
+
+    def key(system_data: SystemData, lcoe: float):
+        lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(system_data)
+        if lifetime_renewable < min_lifetime_renewable:
+            return None
+        return lcoe
+
+    return key
+
+
+def top_k_by_group(
+    system_data_with_lcoe, k: int = 1, key=lcoe_key, group_fields=GROUP_FIELDS
+) -> dict:
+    """Returns the k best systems of every group in one pass over an iterable of
+    (system_data, lcoe) pairs, such as compute_lcoes returns or a generator
+    evaluating systems as they are read. Groups are keyed by the tuple of the spec's
+    group_fields, by default (location, natural_gas_capacity_mw, nat_gas_type), and
+    map to a list of RankedSystems, best first.
+
+    key(system_data, lcoe) gives the score to rank by, lowest first, or None to leave
+    the system out. Each group keeps a heap of at most k systems, so memory does not
+    grow with the dataset and nothing is sorted beyond k entries. Systems with equal
+    scores keep their order in the input, as in get_lowest_lcoe_system.
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    heaps = {}
+    for order, (system_data, lcoe) in enumerate(system_data_with_lcoe):
+        score = key(system_data, lcoe)
+        if score is None:
+            continue
+        group = tuple(getattr(system_data.spec, field) for field in group_fields)
+        heap = heaps.setdefault(group, [])
+        # A max-heap on (score, order) through negation, so the root is the worst of
+        # the k kept and is the one replaced by a better system.
+        entry = (-score, -order, lcoe, system_data)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+    return {
+        group: [
+            RankedSystem(rank, -negative_score, lcoe, system_data)
+            for rank, (negative_score, _, lcoe, system_data) in enumerate(
+                sorted(heap, reverse=True), 1
+            )
+        ]
+        for group, heap in heaps.items()
+    }
+
+
+def summary_rows(top_k: dict, group_fields=GROUP_FIELDS) -> list:
+    """Flattens the result of top_k_by_group into one dict per ranked system, ordered
+    by group and rank, e.g. for csv.DictWriter.
+    """
+    rows = []
+    for group in sorted(top_k):
+        for ranked in top_k[group]:
+            spec = ranked.system_data.spec
+            row = dict(zip(group_fields, group))
+            if "nat_gas_type" in row:
+                row["nat_gas_type"] = NaturalGasType.Name(row["nat_gas_type"])
+            row.update(
+                rank=ranked.rank,
+                solar_capacity_mw=spec.solar_capacity_mw,
+                bess_max_power_mw=spec.bess_max_power_mw,
+                bess_energy_capacity_mwh=spec.bess_energy_capacity_mwh,
+                lifetime_renewable=offgrid_ai.lifetime_renewable_percentage(
+                    ranked.system_data
+                ),
+                lcoe=ranked.lcoe,
+                score=ranked.score,
+            )
+            rows.append(row)
+    return rows
+
+
+def format_summary(top_k: dict) -> str:
+    """Formats the result of top_k_by_group, grouped the default way, as a text
+    table.
+    """
+    lines = [
+        f"{'location':<22}{'gas MW':>8}{'gas type':>13}{'rank':>6}{'solar MW':>10}"
+        f"{'BESS MW':>9}{'renewable %':>13}{'LCOE':>10}"
+    ]
+    for row in summary_rows(top_k):
+        lines.append(
+            f"{row['location']:<22}{row['natural_gas_capacity_mw']:>8g}"
+            f"{row['nat_gas_type']:>13}{row['rank']:>6}"
+            f"{row['solar_capacity_mw']:>10g}{row['bess_max_power_mw']:>9g}"
+            f"{100 * row['lifetime_renewable']:>13.2f}{row['lcoe']:>10.4f}"
+        )
+    return "\n".join(lines)
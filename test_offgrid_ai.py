@@ -1,8 +1,28 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import offgrid_ai
+import offgrid_ai_batch
+import offgrid_ai_cache
+import offgrid_ai_columnar
+import offgrid_ai_crossover
+import offgrid_ai_dispatch
+import offgrid_ai_gradients
+import offgrid_ai_incremental
+import offgrid_ai_monte_carlo
+import offgrid_ai_price_coefficients
+import offgrid_ai_server
+import offgrid_ai_surrogate
+import offgrid_ai_sweep
 
-from operator import itemgetter
-from offgrid_ai_pb2 import DataFile, NaturalGasType
+from offgrid_ai_pb2 import DataFile, FinancialInputs, NaturalGasType
 
 def verify_lcoe_values(input_file):
     """This computes the LCOE for El Paso, TX with 125MW gas generators and all
@@ -29,6 +49,645 @@ def verify_lcoe_values(input_file):
             print(f"{solar_size};{bess_size};{gas_size};{lcoe}")
 
 
+def verify_batch_lcoe_values(input_file):
+    """Checks that the vectorized batch LCOE engine matches breakeven_lcoe for every
+    system in the data file.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    batch_lcoes = offgrid_ai_batch.breakeven_lcoes(data_file, financial_inputs)
+    max_difference = 0
+    for system_data, batch_lcoe in zip(data_file.system_data, batch_lcoes):
+        lcoe = offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
+        max_difference = max(max_difference, abs(lcoe - batch_lcoe))
+    print(f"Max batch LCOE difference: {max_difference}")
+
+
+def verify_columnar_cache(input_file):
+    """Checks that every system read back from a columnar cache of the data file is
+    equal to the one parsed from the data file.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = temp_dir + "/cache"
+        offgrid_ai_columnar.write_columnar_cache(data_file, cache_dir)
+        # Rewriting replaces the cache as a whole.
+        offgrid_ai_columnar.write_columnar_cache(data_file, cache_dir)
+        system_arrays = offgrid_ai_columnar.load_columnar_cache(cache_dir)
+        mismatches = sum(
+            system_arrays.to_system_data(index) != system_data
+            for index, system_data in enumerate(data_file.system_data)
+        )
+        num_systems = len(system_arrays)
+    print(f"Columnar cache systems: {num_systems} Mismatches: {mismatches}")
+
+
+def verify_lcoe_cache(input_file, num_systems=200, num_processes=4):
+    """Checks that processes reading and writing one LcoeCache concurrently all get
+    the uncached LCOEs, that SystemData and SystemRecords, and FinancialInputs and
+    their compiled form, share keys in every process, and that eviction removes the
+    least recently used entries.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    systems = list(data_file.system_data[:num_systems])
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = temp_dir + "/cache.sqlite"
+        # Every process evaluates every system, starting at a different one, so the
+        # same entries are read and written concurrently.
+        work = [
+            (path, systems[i::num_processes] + systems, i % 2 == 1)
+            for i in range(num_processes)
+        ]
+        with multiprocessing.Pool(num_processes) as pool:
+            results = pool.map(_cached_lcoes, work)
+        mismatches = 0
+        for (_, process_systems, _), (lcoes, _) in zip(work, results):
+            for system_data, lcoe in zip(process_systems, lcoes):
+                mismatches += lcoe != offgrid_ai.evaluate_lcoe(
+                    system_data, financial_inputs
+                ).lcoe
+        expected_key = offgrid_ai_cache.cache_key(systems[-1], financial_inputs)
+        keys_match = all(key == expected_key for _, key in results)
+        with offgrid_ai_cache.LcoeCache(path) as cache:
+            num_entries = len(cache)
+        print(
+            f"Cache processes: {num_processes} Entries: {num_entries} "
+            f"Mismatches: {mismatches} Keys match: {keys_match}"
+        )
+
+        with offgrid_ai_cache.LcoeCache(
+            temp_dir + "/eviction.sqlite", max_entries=3
+        ) as cache:
+            for system_data in systems[:4]:
+                cache.evaluate_lcoe(system_data, financial_inputs)
+            # Age the entries in order, then use the oldest again.
+            for age, system_data in enumerate(systems[:4]):
+                cache.touch(
+                    offgrid_ai_cache.cache_key(system_data, financial_inputs),
+                    1000.0 + age,
+                )
+            cache.get(systems[0], financial_inputs)
+            cache.evict()
+            kept = [
+                cache.get(system_data, financial_inputs) is not None
+                for system_data in systems[:4]
+            ]
+        print(f"Cache entries kept after eviction: {kept}")
+
+
+def verify_float32_lcoe_values(input_file, num_scenarios=20):
+    """Checks that the float32 batch LCOEs are within the documented error of the
+    float64 ones, and that lowest_lcoe finds the float64 optimum, for the standard
+    inputs and for scenarios with every price scaled at random by 0.5 to 1.5.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(data_file)
+    float32_arrays = system_arrays.astype(np.float32)
+    rng = np.random.default_rng(0)
+    max_difference = 0
+    within_bound = True
+    optimum_found = True
+    for scenario in range(num_scenarios + 1):
+        financial_inputs = offgrid_ai.build_standard_financial_inputs()
+        if scenario:
+            for field_path in offgrid_ai_price_coefficients.PRICE_FIELDS:
+                value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+                offgrid_ai.set_financial_input(
+                    financial_inputs, field_path, value * rng.uniform(0.5, 1.5)
+                )
+        lcoes = offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+        float32_lcoes = offgrid_ai_batch.breakeven_lcoe(
+            float32_arrays, financial_inputs, np.float32
+        )
+        differences = np.abs(float32_lcoes - lcoes)
+        max_difference = max(max_difference, differences.max())
+        bounds = np.maximum(
+            offgrid_ai_batch.FLOAT32_RELATIVE_ERROR * np.abs(lcoes),
+            offgrid_ai_batch.FLOAT32_ABSOLUTE_ERROR,
+        )
+        within_bound = within_bound and bool(np.all(differences <= bounds))
+        index, lcoe = offgrid_ai_batch.lowest_lcoe(
+            system_arrays, financial_inputs, float32_arrays
+        )
+        optimum_found = optimum_found and (
+            index == np.argmin(lcoes) and lcoe == lcoes[index]
+        )
+
+    # Empty systems, with no sizes or production, have a NaN LCOE and are skipped.
+    # The first system and the standard optimum are emptied.
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    empty = [0, offgrid_ai_batch.lowest_lcoe(system_arrays, financial_inputs)[0]]
+    system_arrays = system_arrays.subset(np.arange(len(system_arrays)))
+    for field in offgrid_ai_batch.SPEC_FIELDS + offgrid_ai_batch.PRODUCTION_FIELDS:
+        getattr(system_arrays, field)[empty] = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lcoes = offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+        index, lcoe = offgrid_ai_batch.lowest_lcoe(system_arrays, financial_inputs)
+    optimum_found = optimum_found and (
+        np.isnan(lcoes[empty]).all()
+        and index == np.nanargmin(lcoes)
+        and lcoe == lcoes[index]
+    )
+    print(f"Max float32 LCOE difference: {max_difference}")
+    print(f"Within float32 error bound: {within_bound}")
+    print(f"Lowest LCOE matches float64: {optimum_found}")
+
+
+def verify_incremental_lcoes(input_file, num_systems=500):
+    """Changes each numeric FinancialInputs field of the standard inputs through
+    IncrementalEvaluator.set and checks the LCOEs against a full batch evaluation,
+    so a field missing from the dependencies in offgrid_ai_incremental.NODES shows up
+    as a stale LCOE.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(
+        data_file.system_data[:num_systems]
+    )
+    system_arrays = offgrid_ai_batch.SystemArrays.concatenate(
+        [system_arrays, system_arrays.with_nat_gas_type(NaturalGasType.GAS_TURBINE)]
+    )
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    field_paths = offgrid_ai_gradients.numeric_fields() + [
+        "debt_term",
+        "construction_time",
+    ]
+    max_difference = 0
+    stale_fields = []
+    for field_path in field_paths:
+        evaluator = offgrid_ai_incremental.IncrementalEvaluator(
+            system_arrays, financial_inputs
+        )
+        value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+        if isinstance(value, int):
+            evaluator.set(field_path, value + 1)
+        else:
+            evaluator.set(field_path, value * 1.25 + 0.01)
+        lcoes = offgrid_ai_batch.breakeven_lcoe(
+            system_arrays, evaluator.financial_inputs
+        )
+        difference = np.abs(evaluator.lcoe - lcoes).max()
+        max_difference = max(max_difference, difference)
+        if difference > 1e-9 * np.abs(lcoes).max():
+            stale_fields.append(field_path)
+    print(
+        f"Incremental fields changed: {len(field_paths)} "
+        f"Max LCOE difference: {max_difference:.2e} Stale fields: {stale_fields}"
+    )
+
+
+def verify_crossovers(input_file, num_grid_points=2001):
+    """Checks that the LCOE is affine in every floating point field outside
+    offgrid_ai_crossover.NONLINEAR_FIELDS, and that the crossovers of the El Paso, TX
+    125MW systems match the sign changes of their LCOE differences on a dense grid,
+    for a field solved in closed form and one solved with Brent's method.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(data_file)
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+
+    def lcoes(systems, field_path, value):
+        return offgrid_ai_batch.breakeven_lcoe(
+            systems,
+            offgrid_ai.compile_financial_inputs(
+                financial_inputs, overrides={field_path: value}
+            ),
+        )
+
+    not_affine = []
+    for field_path in offgrid_ai_gradients.numeric_fields():
+        if field_path in offgrid_ai_crossover.NONLINEAR_FIELDS:
+            continue
+        value = offgrid_ai.get_financial_input(financial_inputs, field_path)
+        step = max(abs(value), 0.1) / 2
+        sampled = np.array(
+            [lcoes(system_arrays, field_path, value + k * step) for k in range(-2, 3)]
+        )
+        second_differences = sampled[2:] - 2 * sampled[1:-1] + sampled[:-2]
+        if np.any(np.abs(second_differences) > 1e-8 * np.abs(sampled).max()):
+            not_affine.append(field_path)
+    print(f"Fields not affine outside NONLINEAR_FIELDS: {not_affine}")
+
+    positions = np.flatnonzero(
+        (system_arrays.location == "El Paso, TX")
+        & (np.round(system_arrays.natural_gas_capacity_mw) == 125)
+    )
+    systems = system_arrays.subset(positions)
+    for field_path, start, end in [
+        ("fuel_price_mmbtu", 0.0, 20.0),
+        ("cost_of_equity", 0.05, 0.2),
+    ]:
+        found = offgrid_ai_crossover.crossovers(
+            systems, financial_inputs, field_path, start, end
+        )
+        grid = np.linspace(start, end, num_grid_points)
+        grid_lcoes = np.array([lcoes(systems, field_path, value) for value in grid])
+        # Each sign change of a pair's LCOE difference between adjacent grid points
+        # must hold a crossover of that pair, and each crossover a sign change.
+        values_by_pair = {}
+        for crossover in found:
+            pair = tuple(sorted((crossover.lower_system, crossover.upper_system)))
+            values_by_pair.setdefault(pair, []).append(crossover.value)
+        num_sign_changes = 0
+        unmatched = 0
+        for i in range(len(systems)):
+            differences = grid_lcoes[:, i + 1 :] - grid_lcoes[:, i, None]
+            changes, columns = np.nonzero(differences[:-1] * differences[1:] < 0)
+            for change, column in zip(changes, columns):
+                num_sign_changes += 1
+                values = values_by_pair.get((i, i + 1 + column), [])
+                unmatched += not any(
+                    grid[change] <= value <= grid[change + 1] for value in values
+                )
+        max_gap = max(
+            (
+                abs(np.subtract(*lcoes(systems.subset(list(pair)), field_path, value)))
+                for pair, values in values_by_pair.items()
+                for value in values
+            ),
+            default=0.0,
+        )
+        print(
+            f"{field_path} crossovers: {len(found)} Grid sign changes: "
+            f"{num_sign_changes} Unmatched: {unmatched} Max LCOE gap: {max_gap:.2e}"
+        )
+
+
+def verify_sweep_ranges():
+    """Checks that sweep ranges include a stop on the grid, never pass a stop between
+    grid values, and that integer fields reject fractional values.
+    """
+    ranges = [
+        ({"start": 0.3, "stop": 0.5, "step": 0.1}, [0.3, 0.4, 0.5]),
+        ({"start": 0, "stop": 1, "step": 0.35}, [0, 0.35, 0.7]),
+        ({"start": 0, "stop": 0.3, "step": 0.04}, [0.04 * i for i in range(8)]),
+        ({"start": 20, "stop": 30, "step": 5}, [20, 25, 30]),
+    ]
+    mismatches = 0
+    for values, expected in ranges:
+        spec = offgrid_ai_sweep.SweepSpec.from_json(
+            {"dimensions": {"investment_tax_credit": values}}
+        )
+        if not np.allclose(spec.dimensions["investment_tax_credit"], expected):
+            mismatches += 1
+    spec = offgrid_ai_sweep.SweepSpec({"debt_term": [20.0, 20.5]})
+    whole, fractional = spec.points()
+    try:
+        spec.financial_inputs(fractional)
+        fractional_rejected = False
+    except ValueError:
+        fractional_rejected = True
+    print(
+        f"Sweep ranges: {len(ranges)} Mismatches: {mismatches}",
+        f"Whole debt term: {spec.financial_inputs(whole).debt_term}",
+        f"Fractional rejected: {fractional_rejected}",
+    )
+
+
+def verify_monte_carlo(
+    input_file, num_systems=100, num_samples=300, chunk_size=64, seed=7
+):
+    """Checks run_monte_carlo against a brute-force evaluation of the same draws: the
+    sketch quantiles are within one bin width of np.quantile's inverted CDF ones, the
+    optimal counts match the argmin of every sample, and a process pool gives
+    identical results. The price only path is checked for quantiles too.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(data_file).subset(
+        np.arange(num_systems)
+    )
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    qs = (0.05, 0.25, 0.5, 0.75, 0.95)
+    scenarios = {
+        "Mixed": {
+            "cost_of_equity": offgrid_ai_monte_carlo.Normal(0.11, 0.01),
+            "investment_tax_credit": offgrid_ai_monte_carlo.Triangular(0.2, 0.3, 0.5),
+            "fuel_price_mmbtu": offgrid_ai_monte_carlo.Normal(5, 1),
+        },
+        "Price only": {
+            "capex_inputs.solar_capex.modules": offgrid_ai_monte_carlo.Normal(
+                0.2, 0.03
+            ),
+            "fuel_price_mmbtu": offgrid_ai_monte_carlo.Empirical([3, 4, 5, 6, 8]),
+        },
+    }
+    for name, distributions in scenarios.items():
+        result = offgrid_ai_monte_carlo.run_monte_carlo(
+            system_arrays,
+            financial_inputs,
+            distributions,
+            num_samples,
+            seed=seed,
+            chunk_size=chunk_size,
+        )
+        lcoes = np.array(
+            [
+                offgrid_ai_batch.breakeven_lcoe(
+                    system_arrays, _sampled_inputs(financial_inputs, distributions, row)
+                )
+                for row in _monte_carlo_draws(
+                    distributions, num_samples, chunk_size, seed
+                )
+            ]
+        )
+        exact_quantiles = np.quantile(lcoes, qs, axis=0, method="inverted_cdf").T
+        quantile_errors = np.abs(result.lcoe_quantiles(qs) - exact_quantiles)
+        tolerance = result.sketch.bin_width[:, None] * (1 + 1e-9)
+        line = (
+            f"{name} Monte Carlo samples: {result.num_samples} "
+            f"Quantiles beyond a bin width: {np.sum(quantile_errors > tolerance)}"
+        )
+        if name == "Mixed":
+            brute_force_counts = np.bincount(
+                np.argmin(lcoes, axis=1), minlength=num_systems
+            )
+            pooled_result = offgrid_ai_monte_carlo.run_monte_carlo(
+                system_arrays,
+                financial_inputs,
+                distributions,
+                num_samples,
+                seed=seed,
+                chunk_size=chunk_size,
+                processes=2,
+            )
+            pooled_identical = np.array_equal(
+                result.lcoe_quantiles(qs), pooled_result.lcoe_quantiles(qs)
+            ) and np.array_equal(result.optimal_counts, pooled_result.optimal_counts)
+            line += (
+                " Optimal counts match: "
+                f"{np.array_equal(result.optimal_counts, brute_force_counts)} "
+                f"Processes identical: {pooled_identical}"
+            )
+        print(line)
+
+
+def verify_dispatch(load_mw=100.0, seed=3):
+    """Checks the hourly dispatch on synthetic weather: with no BESS and no gas the
+    load served is the sum of min(solar, load), the BESS discharges its charged energy
+    less the round trip losses when every year ends at night, and simulated systems
+    give the same LCOEs as SystemData through to_data_file as they do in a batch.
+    """
+    rng = np.random.default_rng(seed)
+    hour_of_day = np.arange(offgrid_ai_dispatch.HOURS_PER_YEAR) % 24
+    daylight = np.maximum(np.sin(np.pi * (hour_of_day - 6) / 12), 0.0)
+    capacity_factors = daylight * np.repeat(0.5 + 0.5 * rng.random(365), 24)
+    parameters = offgrid_ai_dispatch.DispatchParameters()
+    solar_capacities = np.array([50.0, 150.0, 300.0, 500.0])
+
+    production = offgrid_ai_dispatch.dispatch(
+        capacity_factors, load_mw, solar_capacities, 0.0, 0.0, [0.0], parameters
+    )
+    solar_scale = (
+        solar_capacities[:, None]
+        * (1 - parameters.solar_degradation) ** np.arange(parameters.num_years)
+    )
+    expected_served = np.minimum(
+        solar_scale[:, :, None] * capacity_factors, load_mw
+    ).sum(axis=2)
+    solar_only_match = np.allclose(
+        production["load_served_mwh"][0], expected_served, rtol=1e-9
+    )
+
+    production = offgrid_ai_dispatch.dispatch(
+        capacity_factors,
+        load_mw,
+        solar_capacities,
+        [25.0, 50.0, 100.0, 100.0],
+        [100.0, 200.0, 400.0, 400.0],
+        [0.0, 125.0],
+        parameters,
+    )
+    bess_balanced = np.allclose(
+        production["bess_net_output_mwh"],
+        production["bess_throughput_mwh"] * parameters.bess_round_trip_efficiency,
+        rtol=1e-9,
+    )
+
+    system_arrays = offgrid_ai_dispatch.simulate_location(
+        "Synthetic",
+        capacity_factors,
+        load_mw,
+        solar_capacities_mw=[100, 300],
+        bess_max_powers_mw=[0, 50],
+        natural_gas_capacities_mw=[100, 125],
+    )
+    data_file = offgrid_ai_dispatch.to_data_file(system_arrays)
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    lcoes = [
+        offgrid_ai.breakeven_lcoe(system_data, financial_inputs)
+        for system_data in data_file.system_data
+    ]
+    batch_lcoes = offgrid_ai_batch.breakeven_lcoe(system_arrays, financial_inputs)
+    print(
+        f"Dispatch solar only served matches: {solar_only_match} "
+        f"BESS discharged = charged x efficiency: {bess_balanced} "
+        f"Simulated systems: {len(data_file.system_data)} "
+        f"Max LCOE difference: {np.max(np.abs(np.array(lcoes) - batch_lcoes)):.2e}"
+    )
+
+
+def verify_surrogate(input_file, gas_capacity_mw=125):
+    """Checks at each location that the ProductionSurrogate reproduces the production
+    of every grid point exactly, and that optimize_system_size finds an LCOE no higher
+    than the best grid point with either gas type.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(data_file)
+    financial_inputs = offgrid_ai.build_standard_financial_inputs()
+    fields = offgrid_ai_batch.PRODUCTION_FIELDS + ["bess_energy_capacity_mwh"]
+    mismatches = 0
+    worse_than_grid = 0
+    locations = np.unique(system_arrays.location)
+    for location in locations:
+        positions = np.flatnonzero(
+            (system_arrays.location == location)
+            & (np.round(system_arrays.natural_gas_capacity_mw) == gas_capacity_mw)
+        )
+        surrogate = offgrid_ai_surrogate.ProductionSurrogate(
+            [data_file.system_data[position] for position in positions]
+        )
+        systems = system_arrays.subset(positions)
+        interpolated = surrogate.system_arrays(
+            systems.solar_capacity_mw, systems.bess_max_power_mw
+        )
+        for field in fields:
+            mismatches += not np.array_equal(
+                getattr(interpolated, field), getattr(systems, field)
+            )
+        for nat_gas_type in (NaturalGasType.GENERATOR, NaturalGasType.GAS_TURBINE):
+            grid_lcoes = offgrid_ai_batch.breakeven_lcoe(
+                systems.with_nat_gas_type(nat_gas_type), financial_inputs
+            )
+            result = offgrid_ai_surrogate.optimize_system_size(
+                surrogate, financial_inputs, nat_gas_type
+            )
+            worse_than_grid += result.lcoe > grid_lcoes.min()
+    print(
+        f"Surrogate locations: {len(locations)} Grid point mismatches: {mismatches} "
+        f"Optimizations worse than the grid: {worse_than_grid}"
+    )
+
+
+def verify_lcoe_server(input_file, num_clients=8):
+    """Starts an LcoeServer on a temporary Unix socket and checks that concurrent
+    clients get the batch engine's LCOEs and optima, that a request which can't be
+    evaluated only fails itself, and that the server picks up a changed data file.
+    """
+    data_file = DataFile()
+    with open(input_file, "rb") as f:
+        data_file.ParseFromString(f.read())
+    system_arrays = offgrid_ai_batch.SystemArrays.from_system_data(data_file)
+    location, natural_gas_capacity_mw = "El Paso, TX", 125
+    positions = np.flatnonzero(
+        (system_arrays.location == location)
+        & (np.round(system_arrays.natural_gas_capacity_mw) == natural_gas_capacity_mw)
+    )
+    filters = {
+        "location": location,
+        "natural_gas_capacity_mw": natural_gas_capacity_mw,
+    }
+
+    # Clients with different prices are repriced together; the last has no debt,
+    # which changes the financing terms.
+    inputs = []
+    for client in range(num_clients):
+        financial_inputs = offgrid_ai.build_standard_financial_inputs()
+        financial_inputs.fuel_price_mmbtu *= 1 + client / num_clients
+        if client == num_clients - 1:
+            financial_inputs.cost_of_debt = 0
+        inputs.append(financial_inputs)
+    undefined_inputs = offgrid_ai.build_standard_financial_inputs()
+    undefined_inputs.cost_of_equity = -1
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = temp_dir + "/data.binarypb"
+        socket_path = temp_dir + "/lcoe.sock"
+        shutil.copyfile(input_file, data_path)
+        server = offgrid_ai_server.LcoeServer(data_path, reload_interval=0.05)
+        serving = {}
+        started = threading.Event()
+
+        async def serve():
+            serving["loop"] = asyncio.get_running_loop()
+            serving["task"] = asyncio.current_task()
+            started.set()
+            await server.serve(path=socket_path)
+
+        def run():
+            try:
+                asyncio.run(serve())
+            except asyncio.CancelledError:
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+
+        def request(financial_inputs):
+            with offgrid_ai_server.LcoeClient(socket_path) as client:
+                try:
+                    client.optimum(undefined_inputs, **filters)
+                    undefined_failed = False
+                except ValueError:
+                    undefined_failed = True
+                return (
+                    client.lcoes(financial_inputs, **filters),
+                    client.optimum(financial_inputs, **filters),
+                    undefined_failed,
+                )
+
+        try:
+            with ThreadPoolExecutor(num_clients) as executor:
+                results = list(executor.map(request, inputs))
+            spec_filter = offgrid_ai_server.SystemSpec(**filters)
+            # The same requests as one micro-batch, which reprices them together.
+            batched = server.evaluate(
+                [
+                    (offgrid_ai_server.LCOES, financial_inputs, spec_filter)
+                    for financial_inputs in inputs
+                ]
+            )
+            max_difference = 0
+            optima_match = True
+            for financial_inputs, (systems, optimum, _), response in zip(
+                inputs, results, batched
+            ):
+                lcoes = offgrid_ai_batch.breakeven_lcoe(
+                    system_arrays.subset(positions), financial_inputs
+                )
+                for served_systems in (systems, response["systems"]):
+                    served = np.array([system["lcoe"] for system in served_systems])
+                    max_difference = max(
+                        max_difference, np.abs(served - lcoes).max()
+                    )
+                best = positions[np.argmin(lcoes)]
+                optima_match = optima_match and (
+                    optimum["solar_capacity_mw"]
+                    == system_arrays.solar_capacity_mw[best]
+                    and optimum["bess_max_power_mw"]
+                    == system_arrays.bess_max_power_mw[best]
+                )
+            undefined_failed = all(result[2] for result in results)
+            isolated = server.evaluate(
+                [
+                    (offgrid_ai_server.OPTIMUM, inputs[0], spec_filter),
+                    (offgrid_ai_server.OPTIMUM, undefined_inputs, spec_filter),
+                ]
+            )
+            isolated = "system" in isolated[0] and "error" in isolated[1]
+
+            # Replace the data file with one without the location.
+            reduced = DataFile()
+            reduced.system_data.extend(
+                system_data
+                for system_data in data_file.system_data
+                if system_data.spec.location != location
+            )
+            with open(data_path + ".new", "wb") as f:
+                f.write(reduced.SerializeToString())
+            os.replace(data_path + ".new", data_path)
+            reloaded = False
+            with offgrid_ai_server.LcoeClient(socket_path) as client:
+                for _ in range(200):
+                    if not client.lcoes(inputs[0], **filters):
+                        reloaded = True
+                        break
+                    time.sleep(0.05)
+        finally:
+            serving["loop"].call_soon_threadsafe(serving["task"].cancel)
+            thread.join()
+    print(
+        f"Server clients: {num_clients} Max LCOE difference: {max_difference:.2e} "
+        f"Optima match: {optima_match}"
+    )
+    print(
+        f"Undefined inputs failed: {undefined_failed} Errors isolated: {isolated} "
+        f"Reloaded: {reloaded}"
+    )
+
+
 def get_pareto_frontier(input_file, location, natural_gas_capacity_mw):
     """Compute the Pareto frontier that trades off between the LCOE & lifetime
        renewable percentage for a given location and natural gas generator
@@ -39,7 +698,6 @@ def get_pareto_frontier(input_file, location, natural_gas_capacity_mw):
         data_file.ParseFromString(f.read())
 
     system_data_with_lcoe = []
-    pareto_frontier = []
 
     for system_data in data_file.system_data:
         if (
@@ -52,18 +710,7 @@ def get_pareto_frontier(input_file, location, natural_gas_capacity_mw):
             )
             system_data_with_lcoe.append((system_data, lcoe))
 
-    system_data_with_lcoe.sort(key=itemgetter(1))
-    for system_data, lcoe in system_data_with_lcoe:
-        if len(pareto_frontier) == 0:
-            pareto_frontier.append((system_data, lcoe))
-        else:
-            previous_lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(
-                pareto_frontier[-1][0]
-            )
-            lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(system_data)
-            if lifetime_renewable > previous_lifetime_renewable:
-                pareto_frontier.append((system_data, lcoe))
-
+    pareto_frontier = offgrid_ai.find_pareto_frontier(system_data_with_lcoe)
     for system_data, lcoe in pareto_frontier:
         lifetime_renewable = offgrid_ai.lifetime_renewable_percentage(system_data)
         solar_size = round(system_data.spec.solar_capacity_mw)
@@ -91,13 +738,56 @@ def generator_and_turbine_lcoe(input_file):
             generator_lcoe = offgrid_ai.breakeven_lcoe(
                 system_data, offgrid_ai.build_standard_financial_inputs()
             )
-            system_data.spec.nat_gas_type = NaturalGasType.GAS_TURBINE
             turbine_lcoe = offgrid_ai.breakeven_lcoe(
-                system_data, offgrid_ai.build_standard_financial_inputs()
+                offgrid_ai.override_spec(
+                    system_data, nat_gas_type=NaturalGasType.GAS_TURBINE
+                ),
+                offgrid_ai.build_standard_financial_inputs(),
             )
             print(f"Generator LCOE:{generator_lcoe} Turbine LCOE:{turbine_lcoe}")
 
 
+def _cached_lcoes(work):
+    path, systems, use_records = work
+    if use_records:
+        systems = offgrid_ai.system_records(systems)
+    financial_inputs = offgrid_ai.compile_financial_inputs(
+        offgrid_ai.build_standard_financial_inputs()
+    )
+    with offgrid_ai_cache.LcoeCache(path) as cache:
+        lcoes = [
+            cache.breakeven_lcoe(system_data, financial_inputs)
+            for system_data in systems
+        ]
+    return lcoes, offgrid_ai_cache.cache_key(systems[-1], financial_inputs)
+
+
+def _monte_carlo_draws(distributions, num_samples, chunk_size, seed):
+    # The draws run_monte_carlo makes: one random stream per chunk, spawned from seed.
+    chunk_sizes = [
+        min(chunk_size, num_samples - start)
+        for start in range(0, num_samples, chunk_size)
+    ]
+    return np.concatenate(
+        [
+            offgrid_ai_monte_carlo.sample_inputs(
+                distributions, num_chunk_samples, rng=np.random.default_rng(chunk_seed)
+            )
+            for num_chunk_samples, chunk_seed in zip(
+                chunk_sizes, np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+            )
+        ]
+    )
+
+
+def _sampled_inputs(financial_inputs, distributions, row):
+    sampled_inputs = FinancialInputs()
+    sampled_inputs.CopyFrom(financial_inputs)
+    for field_path, value in zip(distributions, row.tolist()):
+        offgrid_ai.set_financial_input(sampled_inputs, field_path, value)
+    return sampled_inputs
+
+
 def main():
     """Demonstration of code to calculate the LCOE & Pareto frontier."""
     if len(sys.argv) != 2:
@@ -108,6 +798,28 @@ def main():
 
     print("LCOE value table:")
     verify_lcoe_values(input_file)
+    print("Batch LCOE check:")
+    verify_batch_lcoe_values(input_file)
+    print("Columnar cache check:")
+    verify_columnar_cache(input_file)
+    print("LCOE cache check:")
+    verify_lcoe_cache(input_file)
+    print("Float32 LCOE check:")
+    verify_float32_lcoe_values(input_file)
+    print("Sweep range check:")
+    verify_sweep_ranges()
+    print("Monte Carlo check:")
+    verify_monte_carlo(input_file)
+    print("Dispatch check:")
+    verify_dispatch()
+    print("Surrogate check:")
+    verify_surrogate(input_file)
+    print("LCOE server check:")
+    verify_lcoe_server(input_file)
+    print("Incremental LCOE check:")
+    verify_incremental_lcoes(input_file)
+    print("Crossover check:")
+    verify_crossovers(input_file)
     print("El Paso, TX Pareto frontier")
     get_pareto_frontier(input_file, "El Paso, TX", 125)
     print("Amarillo, TX Pareto frontier")